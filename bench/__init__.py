@@ -0,0 +1,56 @@
+""" Benchmark harness for the cloudCache REST API. Seeds a database with users, notebooks and notes,
+then either drives every route in server.py against it and reports how each performed:
+
+    python -m bench.routes --users=10 --notebooks=10 --notes=1000 --requests=500
+
+or load tests a realistic mix of routes in-process, reporting latency percentiles and SQL statement
+counts per route, and comparing them against a saved baseline (see bench.load):
+
+    python -m bench.load --baseline=bench/baseline.json
+
+Password logins, whose hashing dominates their cost, have a benchmark of their own (see
+bench.logins):
+
+    python -m bench.logins --rounds=25000
+
+and so does authorization in each access token mode (see bench.authorize):
+
+    python -m bench.authorize
+
+and full-text search, over a million word-like notes (see bench.search):
+
+    python -m bench.search
+
+and the lookups every request makes, over a million notes, with and without their indexes (see
+bench.lookups):
+
+    python -m bench.lookups
+
+and the latency of other requests while a slow query runs (see bench.slowquery):
+
+    python -m bench.slowquery
+
+and paging deep into a notebook of a million notes, by keyset and by OFFSET (see bench.pages):
+
+    python -m bench.pages
+
+and the memory used by streamed and buffered listings of large notebooks (see bench.memory):
+
+    python -m bench.memory
+
+and serializing a hundred thousand notes, by the precompiled serializers and the legacy ones (see
+bench.serialize):
+
+    python -m bench.serialize
+
+and throughput with each number of server worker processes (see bench.workers):
+
+    python -m bench.workers --workers=1,2,4
+
+and the size and CPU cost of each response format, JSON or MessagePack, gzipped or not (see
+bench.formats):
+
+    python -m bench.formats
+
+The database is a SQLite file in a temporary directory unless --db-url names another one, so
+benchmarks run on any machine without a MySQL server. Run from the repository root. """
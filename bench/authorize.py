@@ -0,0 +1,137 @@
+""" Benchmarks the cost of authorizing a request in each access token mode: looks up the user for a
+seeded user's token with get_user_for_token, as AuthorizeHandler.authorize does, in a session of its
+own as a request would have, and reports the time and SQL statements each lookup takes.
+
+Database tokens are measured both with the process-local token cache warm, as for a client making
+repeated requests, and cold, as for a token seen for the first time (or by another worker). Signed
+tokens don't need either.
+
+Run from the repository root:
+
+    python -m bench.authorize --users=10 --lookups=10000
+
+To compare the modes end to end, run bench.routes or bench.load with CLOUDCACHE_AUTH_TOKEN_MODE set
+to `database` and then `signed`.
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from time import time
+
+from sqlalchemy import event
+from tabulate import tabulate
+
+from .load import percentile
+
+# -------------------------------------------------------------------------------------------------
+
+def measure(tokens, lookups, engine, before_lookup=None, random_seed=0):
+    """ Looks up the user for a randomly chosen token `lookups` times, and returns the latency of
+    each lookup, and the mean number of statements per lookup.
+
+    Args:
+        tokens (list): Access token strings, each belonging to a seeded user.
+        lookups (int): The number of lookups.
+        engine (sqlalchemy.engine.Engine): The models' engine, whose statements are counted.
+        before_lookup (callable): Called with the token before each lookup, outside of its timing.
+        random_seed (int): Seed for the choice of tokens.
+
+    """
+
+    from cloudCache.Business.Models import DB_SESSION as db
+    from cloudCache.Business.Models.UserAccessToken import get_user_for_token
+
+    choose = random.Random(random_seed).choice
+    statements, latencies = [0], list()
+
+    def count_statement(*_):
+        """ Engine event listener, called before every statement. """
+        statements[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_statement)
+
+    try:
+        for _ in range(lookups):
+            token = choose(tokens)
+            if before_lookup:
+                before_lookup(token)
+
+            start = time()
+            user = get_user_for_token(token)
+            db.remove()
+            latencies.append(time() - start)
+
+            if user is None:
+                raise RuntimeError('The token {} was rejected.'.format(token))
+
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+    return latencies, statements[0] / lookups
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--lookups', type=int, default=10000, help='Lookups per mode.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, issues a token of each kind to every user, and benchmarks looking them
+    up. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-authorize-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'authorize.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business import Models
+        from cloudCache.Business.Models.UserAccessToken import create_access_token
+        from cloudCache.Business.Models.UserAccessToken import get_token_cache, set_token_mode
+
+        users = seed(users=args.users, notebooks=1, notes=0)
+
+        tokens = dict()
+        for mode in ('database', 'signed'):
+            set_token_mode(mode)
+            tokens[mode] = [create_access_token(user.username, user.api_key).access_token
+                            for user in users]
+            Models.DB_SESSION.remove()
+
+        runs = (('database, cached', tokens['database'], None),
+                ('database, uncached', tokens['database'], get_token_cache().pop),
+                ('signed', tokens['signed'], None))
+
+        rows = list()
+        for name, mode_tokens, before_lookup in runs:
+            latencies, statements = measure(mode_tokens, args.lookups, Models.DB_ENGINE,
+                                            before_lookup=before_lookup, random_seed=args.seed)
+
+            rows.append((name, len(latencies), 1e6 * sum(latencies) / len(latencies),
+                         1e6 * percentile(latencies, 0.50), 1e6 * percentile(latencies, 0.99),
+                         statements))
+
+        headers = ('Token mode', 'Lookups', 'Mean us', 'p50 us', 'p99 us', 'Stmts/lookup')
+        print(tabulate(rows, headers=headers, floatfmt='.1f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
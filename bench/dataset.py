@@ -0,0 +1,87 @@
+""" Seeds a cloudCache database with a synthetic dataset for benchmarking. The CLOUDCACHE_DB_URL
+setting must name the database before this module is imported. """
+
+from collections import namedtuple
+
+from cloudCache.Business.Models import DB_SESSION as db, Note, Notebook
+from cloudCache.Business.Models.User import create_user
+
+# -------------------------------------------------------------------------------------------------
+
+PASSWORD = 'bench-password'
+
+# A seeded user, with their notebooks' IDs and a sample of their notes' IDs
+SeededUser = namedtuple('SeededUser', 'username password api_key notebook_ids note_ids')
+
+# Maximum number of note IDs remembered per user, for requests on individual notes
+NOTE_SAMPLE_SIZE = 1000
+
+# Notes are inserted with one statement per this many rows
+INSERT_BATCH_SIZE = 5000
+
+# -------------------------------------------------------------------------------------------------
+
+def seed(users=10, notebooks=10, notes=100, value_size=64, values=None):
+    """ Creates `users` users, each with `notebooks` notebooks of `notes` notes. Users are created
+    through the business layer (so their passwords are hashed as usual), and notebooks and notes by
+    bulk inserts.
+
+    Args:
+        users (int): The number of users.
+        notebooks (int): The number of notebooks per user.
+        notes (int): The number of notes per notebook.
+        value_size (int): The length of each note's value.
+        values (callable): Called with a notebook ID and a note number to make that note's value,
+            instead of a value of `value_size` characters, if given.
+
+    Returns:
+        list: A SeededUser for each user.
+
+    """
+
+    seeded = list()
+    values = values or (lambda notebook_id, n: ('{}:{}:'.format(notebook_id, n) * value_size)
+                                               [:value_size])
+
+    for user_number in range(users):
+        username = 'bench{}'.format(user_number)
+        user = create_user(username, 'Bench', 'User', username + '@example.com', PASSWORD)
+
+        db.execute(Notebook.__table__.insert(),
+                   [{'user_id': user.id, 'name': 'notebook{}'.format(n)} for n in range(notebooks)])
+
+        notebook_ids = [row.id for row in db.query(Notebook.id).filter(Notebook.user_id == user.id)]
+
+        rows = ({'notebook_id': notebook_id,
+                 'key': 'note{}'.format(n),
+                 'value': values(notebook_id, n)}
+                for notebook_id in notebook_ids for n in range(notes))
+
+        insert_in_batches(Note.__table__, rows)
+        db.commit()
+
+        note_ids = db.query(Note.id).join(Note.notebook)\
+                     .filter(Notebook.user_id == user.id)\
+                     .limit(NOTE_SAMPLE_SIZE)
+        note_ids = [row.id for row in note_ids]
+
+        seeded.append(SeededUser(username, PASSWORD, user.api_key, notebook_ids, note_ids))
+
+    db.remove()
+    return seeded
+
+
+def insert_in_batches(table, rows):
+    """ Inserts an iterable of rows into a table, INSERT_BATCH_SIZE rows per statement. """
+
+    batch = list()
+
+    for row in rows:
+        batch.append(row)
+
+        if len(batch) == INSERT_BATCH_SIZE:
+            db.execute(table.insert(), batch)
+            batch = list()
+
+    if batch:
+        db.execute(table.insert(), batch)
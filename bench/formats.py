@@ -0,0 +1,185 @@
+""" Benchmarks the response formats: JSON and MessagePack, each with and without gzip. A page of a
+notebook's notes is encoded in-process in each format, timing the CPU it takes and counting its
+bytes, and then fetched from an in-process server in each format (negotiated by the Accept and
+Accept-Encoding headers, as a client would) to measure the bytes on the wire and the throughput.
+
+Run from the repository root:
+
+    python -m bench.formats --notes=1000 --limit=100 --requests=1000
+
+MessagePack is skipped if the msgpack package isn't installed.
+
+"""
+
+import argparse
+import gzip
+import os
+import random
+import shutil
+import string
+import tempfile
+from time import process_time, time
+
+import tornado.ioloop
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tabulate import tabulate
+
+from .load import start_server
+from .routes import RouteBenchmark
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# -------------------------------------------------------------------------------------------------
+
+# Characters which the notes' values are made up of, so they compress about as well as text does
+VALUE_CHARACTERS = string.ascii_lowercase + '      '
+
+# -------------------------------------------------------------------------------------------------
+
+def get_formats():
+    """ Returns a list of (name, Accept header, Accept-Encoding header, encoder, gzipped) tuples for
+    each response format. """
+
+    from cloudCache.Business.Models.JsonMixin import encode_json
+
+    formats = [('JSON', 'application/json', 'identity', encode_json, False),
+               ('JSON+gzip', 'application/json', 'gzip', encode_json, True)]
+
+    if msgpack:
+        packb = lambda obj: msgpack.packb(obj, use_bin_type=True)
+        formats += [('MessagePack', 'application/msgpack', 'identity', packb, False),
+                    ('MessagePack+gzip', 'application/msgpack', 'gzip', packb, True)]
+
+    return formats
+
+
+def encode_page(encoder, gzipped, document):
+    """ Returns `document` encoded by `encoder`, and gzipped as CompressResponse would (at the
+    gzip module's default level) if `gzipped`. """
+
+    body = encoder(document)
+    return gzip.compress(body) if gzipped else body
+
+
+def time_encoding(encoder, gzipped, document, repeat):
+    """ Encodes `document` `repeat` times, and returns the CPU milliseconds each encoding took,
+    and the encoding's length in bytes. """
+
+    start = process_time()
+    for _ in range(repeat):
+        body = encode_page(encoder, gzipped, document)
+
+    return 1000 * (process_time() - start) / repeat, len(body)
+
+
+@gen.coroutine
+def fetch_pages(base_url, path, token, accept, accept_encoding, requests, concurrency):
+    """ Fetches `path` `requests` times, `concurrency` at a time, negotiating the response's format
+    with the given headers, and returns the number of requests made per second and the mean number
+    of bytes on the wire per response. """
+
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    headers = {'access token': token, 'Accept': accept, 'Accept-Encoding': accept_encoding}
+    sizes, numbers = list(), iter(range(requests))
+
+    @gen.coroutine
+    def worker():
+        """ Makes requests until there are none left to make. """
+
+        for _ in numbers:
+            request = HTTPRequest(base_url + path, headers=headers, decompress_response=False,
+                                  request_timeout=300)
+            response = yield client.fetch(request)
+            sizes.append(len(response.body))
+
+    try:
+        start = time()
+        yield [worker() for _ in range(concurrency)]
+        return requests / (time() - start), sum(sizes) / len(sizes)
+
+    finally:
+        client.close()
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--notes', type=int, default=1000, help='Notes in the notebook.')
+    parser.add_argument('--value-size', type=int, default=256, help='Length of each note\'s '
+                                                                     'value.')
+    parser.add_argument('--limit', type=int, default=100, help='Notes per page.')
+    parser.add_argument('--repeat', type=int, default=200, help='In-process encodings timed per '
+                                                                'format.')
+    parser.add_argument('--requests', type=int, default=1000, help='Pages fetched per format.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, and benchmarks encoding and serving a page of notes in each format. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-formats-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'formats.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business.Models import DB_SESSION as db, Notebook
+        from cloudCache.Business.Models.Note import get_notes_page
+
+        rng = random.Random(args.seed)
+        values = lambda notebook_id, n: ''.join(rng.choice(VALUE_CHARACTERS)
+                                                for _ in range(args.value_size))
+
+        users = seed(users=1, notebooks=1, notes=args.notes, values=values)
+
+        notebook = db.query(Notebook).one()
+        notes, next_cursor = get_notes_page(notebook, args.limit)
+        path = '/notebooks/{}/notes?limit={}'.format(notebook.id, args.limit)
+
+        # the page as NotesHandler responds with it
+        document = {'notebook': notebook.name, 'notes': [note.to_ordered_dict() for note in notes],
+                    'next': next_cursor}
+        db.remove()
+
+        base_url = start_server()
+        benchmark = RouteBenchmark(base_url, users, 0, 1)
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.run_sync(benchmark.authorize_users)
+        token = benchmark.tokens[users[0].username]
+
+        rows = list()
+        for name, accept, accept_encoding, encoder, gzipped in get_formats():
+            cpu_ms, size = time_encoding(encoder, gzipped, document, args.repeat)
+
+            rate, wire_size = io_loop.run_sync(
+                lambda: fetch_pages(base_url, path, token, accept, accept_encoding,
+                                    args.requests, args.concurrency))
+
+            rows.append((name, size / 1024, cpu_ms, wire_size / 1024, rate))
+
+        headers = ('Format', 'Encoded KB', 'Encode CPU ms', 'Wire KB', 'Req/s')
+        print(tabulate(rows, headers=headers, floatfmt='.2f'))
+
+        if not msgpack:
+            print('msgpack isn\'t installed, so MessagePack was skipped.')
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+""" Load test for the cloudCache REST API. Runs the server.py application in-process against a
+seeded database, then:
+
+1. Profiles each route in the mix serially, one request at a time, counting the SQL statements
+   each request issues. With only one request in flight every statement belongs to it, so the
+   counts are exact, and the same on every machine.
+2. Drives the mix concurrently, with requests to each route in proportion to its weight, and
+   reports the throughput and p50/p95/p99 latency of each route.
+
+Results can be saved as a baseline, and later runs compared against it, e.g.
+
+    python -m bench.load --notes=1000 --save-baseline=bench/baseline.json
+    python -m bench.load --notes=1000 --baseline=bench/baseline.json
+
+A comparison exits with status 1 if any route issues more statements than its baseline, or its p99
+latency grew by more than --tolerance. Statement counts are the reliable signal across machines;
+latencies are only comparable between runs on the same machine. Run from the repository root.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from bisect import bisect
+from collections import OrderedDict
+from itertools import accumulate, count
+from time import time
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+from sqlalchemy import event
+from tornado import gen
+from tabulate import tabulate
+
+from .routes import ROOT, RouteBenchmark
+
+# -------------------------------------------------------------------------------------------------
+
+# Requests profiled per route when counting statements
+PROFILE_REQUESTS = 5
+
+# Route weights for each mix. Every mix acquires tokens, reads and writes notes, and lists
+# notebooks.
+MIXES = {
+    'default': OrderedDict([
+        ('GET /access/{username}/{api_key}', 5),
+        ('GET /notes/{note}', 35),
+        ('POST /notebooks/{notebook}/notes', 15),
+        ('DELETE /notes/{note}', 5),
+        ('GET /notebooks/', 10),
+        ('GET /notebooks/{notebook}/notes', 25),
+        ('GET /sync?since={cursor}', 5),
+    ]),
+    'read-heavy': OrderedDict([
+        ('GET /access/{username}/{api_key}', 2),
+        ('GET /notes/{note}', 60),
+        ('POST /notebooks/{notebook}/notes', 3),
+        ('GET /notebooks/', 10),
+        ('GET /notebooks/{notebook}/notes', 25),
+    ]),
+    'write-heavy': OrderedDict([
+        ('GET /access/{username}/{api_key}', 5),
+        ('GET /notes/{note}', 20),
+        ('POST /notebooks/{notebook}/notes', 40),
+        ('DELETE /notes/{note}', 15),
+        ('POST /notebooks/{notebook}/notes/bulk', 5),
+        ('GET /notebooks/{notebook}/notes', 15),
+    ]),
+}
+
+# -------------------------------------------------------------------------------------------------
+
+class LoadTest(RouteBenchmark):
+    """ Drives a weighted mix of routes on an in-process server, counting the SQL statements issued
+    by each route through the models' engine.
+
+    Args:
+        base_url (string): The server's URL.
+        users (list): The dataset's bench.dataset.SeededUsers.
+        mix (OrderedDict): Route name -> relative weight.
+        requests (int): The total number of requests made by the mix.
+        concurrency (int): The number of requests in flight at a time.
+        engine (sqlalchemy.engine.Engine): The server's engine, whose statements are counted.
+        random_seed (int): Seed for the choice of routes, users and resources.
+
+    """
+
+    def __init__(self, base_url, users, mix, requests, concurrency, engine, random_seed=0):
+        super().__init__(base_url, users, requests, concurrency, random_seed=random_seed)
+
+        self.mix = mix
+        self.statements = 0
+
+        self._numbers = count()
+        self._builders = {
+            'GET /access/{username}/{api_key}': ('GET', self._access),
+            'GET /notes/{note}': ('GET', self.get_note),
+            'POST /notebooks/{notebook}/notes': ('POST', self._create_note),
+            'DELETE /notes/{note}': ('DELETE', self._delete_created(self._created_notes,
+                                                                   '/notes/{}')),
+            'POST /notebooks/{notebook}/notes/bulk': ('POST', self._import_notes),
+            'GET /notebooks/': ('GET', lambda n: ('/notebooks/', None, self._user())),
+            'GET /notebooks/{notebook}/notes': ('GET', self.notebook_path('/notes')),
+            'GET /sync?since={cursor}': ('GET', self._sync),
+        }
+
+        event.listen(engine, 'before_cursor_execute', self._count_statement)
+
+
+    def _count_statement(self, *_):
+        """ Engine event listener, called before every statement. """
+        self.statements += 1
+
+
+    @gen.coroutine
+    def profile(self):
+        """ Makes PROFILE_REQUESTS requests to each route in the mix, one at a time, and returns the
+        mean number of statements per request of each route. Routes which create resources are
+        profiled before routes which delete them. """
+
+        statements = OrderedDict()
+
+        for route in sorted(self.mix, key=lambda r: r.startswith('DELETE')):
+            method, build = self._builders[route]
+            before = self.statements
+            made = 0
+
+            for _ in range(PROFILE_REQUESTS):
+                request = build(next(self._numbers))
+                if request is None:
+                    break
+
+                path, body, user = request
+                response = yield self.fetch(method, path, body=body, user=user)
+                self._record(route, method, user, body, response)
+                made += 1
+
+            statements[route] = (self.statements - before) / made if made else None
+
+        return statements
+
+
+    @gen.coroutine
+    def run_mix(self):
+        """ Drives the mix concurrently, and returns (route -> list of latencies, route -> error
+        count, elapsed seconds). """
+
+        routes     = list(self.mix)
+        cumulative = list(accumulate(self.mix[route] for route in routes))
+
+        latencies = OrderedDict((route, list()) for route in routes)
+        errors    = OrderedDict((route, 0) for route in routes)
+        remaining = [self.requests]
+
+        @gen.coroutine
+        def worker():
+            """ Makes requests until the mix's quota has been made. """
+
+            while remaining[0] > 0:
+                route = routes[bisect(cumulative, self._random.random() * cumulative[-1])]
+                method, build = self._builders[route]
+
+                request = build(next(self._numbers))
+                if request is None:
+                    # nothing to delete yet; choose again
+                    continue
+
+                remaining[0] -= 1
+                path, body, user = request
+
+                start    = time()
+                response = yield self.fetch(method, path, body=body, user=user)
+                latencies[route].append(time() - start)
+
+                if response.code >= 400:
+                    errors[route] += 1
+                else:
+                    self._record(route, method, user, body, response)
+
+        start = time()
+        yield [worker() for _ in range(self.concurrency)]
+
+        return latencies, errors, time() - start
+
+
+    def _record(self, route, method, user, body, response):
+        """ Remembers a resource created by a successful POST. """
+
+        if method == 'POST' and response.code < 400:
+            self._record_created(route, user, body, json.loads(response.body.decode('utf-8')))
+
+# -------------------------------------------------------------------------------------------------
+
+def percentile(values, fraction):
+    """ Returns the nearest-rank percentile of a list of values, e.g. fraction=0.99 for p99. """
+
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(statements, latencies, errors, elapsed):
+    """ Returns route -> OrderedDict of the route's results. """
+
+    summary = OrderedDict()
+
+    for route, route_latencies in latencies.items():
+        summary[route] = OrderedDict([
+            ('requests', len(route_latencies)),
+            ('errors', errors[route]),
+            ('rate', len(route_latencies) / elapsed),
+            ('p50_ms', 1000 * percentile(route_latencies, 0.50)),
+            ('p95_ms', 1000 * percentile(route_latencies, 0.95)),
+            ('p99_ms', 1000 * percentile(route_latencies, 0.99)),
+            ('statements', statements.get(route)),
+        ])
+
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """ Prints how each route's results differ from its baseline, and returns whether any route
+    regressed: issued more statements, or had a p99 latency more than `tolerance` higher. """
+
+    rows, regressed = list(), False
+
+    for route, result in summary.items():
+        base = baseline['routes'].get(route)
+        if base is None:
+            rows.append((route, 'new', '', '', ''))
+            continue
+
+        statements_changed = result['statements'] != base['statements']
+        statements_up = (result['statements'] or 0) > (base['statements'] or 0)
+
+        p50_change = _change(result['p50_ms'], base['p50_ms'])
+        p99_change = _change(result['p99_ms'], base['p99_ms'])
+        p99_up = p99_change is not None and p99_change > tolerance
+
+        flag = 'REGRESSED' if statements_up or p99_up else ('changed' if statements_changed else '')
+        regressed = regressed or statements_up or p99_up
+
+        rows.append((route, flag, '{} -> {}'.format(base['statements'], result['statements']),
+                     _format_change(p50_change), _format_change(p99_change)))
+
+    print(tabulate(rows, headers=('Route', '', 'Stmts/req', 'p50', 'p99')))
+    return regressed
+
+
+def _change(value, base):
+    """ Returns the relative change from `base` to `value`, or `None` if there's no base. """
+    return (value - base) / base if base else None
+
+
+def _format_change(change):
+    """ Formats a relative change as a signed percentage. """
+    return '' if change is None else '{:+.0%}'.format(change)
+
+
+def start_server(handlers=()):
+    """ Starts the server.py application on its own thread and IOLoop, and returns its URL.
+    `handlers` are (pattern, handler class) routes added to the application's own, e.g. for a
+    benchmark's handlers. """
+
+    # server.py imports the handlers as a top-level `API` package
+    sys.path[:0] = [ROOT, os.path.join(ROOT, 'cloudCache')]
+    import server
+
+    application = server.make_application()
+    if handlers:
+        application.add_handlers(r'.*$', list(handlers))
+
+    sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+    started = threading.Event()
+
+    def serve():
+        """ Runs the server's IOLoop. """
+
+        io_loop = tornado.ioloop.IOLoop()
+        io_loop.make_current()
+
+        http_server = tornado.httpserver.HTTPServer(application, io_loop=io_loop)
+        http_server.add_sockets(sockets)
+
+        started.set()
+        io_loop.start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+
+    return 'http://127.0.0.1:{}'.format(sockets[0].getsockname()[1])
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and load. Defaults to a temporary '
+                                         'SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--notebooks', type=int, default=10, help='Notebooks per user.')
+    parser.add_argument('--notes', type=int, default=100, help='Notes per notebook.')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='default', help='Route mix.')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests made by the mix.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--baseline', help='Baseline file to compare the results against.')
+    parser.add_argument('--save-baseline', help='File to save the results to as a baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed p99 latency growth over the baseline, e.g. 0.25 for 25%%.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, starts the server in-process, and runs the load test. Returns the exit
+    status. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-load-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir, 'load.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business import Models
+
+        start = time()
+        users = seed(users=args.users, notebooks=args.notebooks, notes=args.notes)
+        print('Seeded {} users x {} notebooks x {} notes in {:.1f}s.'.format(
+            args.users, args.notebooks, args.notes, time() - start))
+
+        load_test = LoadTest(start_server(), users, MIXES[args.mix], args.requests,
+                             args.concurrency, Models.DB_ENGINE, random_seed=args.seed)
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.run_sync(load_test.authorize_users)
+        statements = io_loop.run_sync(load_test.profile)
+        latencies, errors, elapsed = io_loop.run_sync(load_test.run_mix)
+
+        summary = summarize(statements, latencies, errors, elapsed)
+
+        rows = [(route,) + tuple(result.values()) for route, result in summary.items()]
+        headers = ('Route', 'Requests', 'Errors', 'Req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+                   'Stmts/req')
+        print(tabulate(rows, headers=headers, floatfmt='.1f'))
+        print('{} requests in {:.1f}s ({:.1f} req/s).'.format(args.requests, elapsed,
+                                                             args.requests / elapsed))
+
+        config = OrderedDict((key, getattr(args, key))
+                             for key in ('users', 'notebooks', 'notes', 'mix', 'requests',
+                                         'concurrency', 'seed'))
+
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as baseline_file:
+                json.dump({'config': config, 'routes': summary}, baseline_file, indent=4)
+                baseline_file.write('\n')
+
+        if args.baseline:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file, object_pairs_hook=OrderedDict)
+
+            if baseline['config'] != config:
+                print('Warning: the baseline was recorded with different settings: {}'.format(
+                    dict(baseline['config'])))
+
+            if compare(summary, baseline, args.tolerance):
+                return 1
+
+        return 0
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+""" Benchmarks password logins: requests to GET /users/{username} with the user's password, which
+verify it against its PBKDF2 hash. Logins are driven against an in-process server twice, first with
+the credential cache turned off, so every login pays for a full hash, then with it on. While they
+run, a probe makes one cheap request (GET /notebooks/) at a time, and its latency shows whether the
+hashing holds up the rest of the server.
+
+Run from the repository root:
+
+    python -m bench.logins --users=10 --requests=200 --concurrency=10 --rounds=25000
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+from time import time
+
+import tornado.ioloop
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tabulate import tabulate
+
+from .load import percentile, start_server
+from .routes import RouteBenchmark
+
+# -------------------------------------------------------------------------------------------------
+
+# Hashes timed, one at a time, to measure the cost of a single hash
+HASH_SAMPLES = 10
+
+# -------------------------------------------------------------------------------------------------
+
+class LoginBenchmark(RouteBenchmark):
+    """ Drives logins on behalf of randomly chosen seeded users, while probing the latency of a
+    cheap route. Takes the same arguments as RouteBenchmark. """
+
+    def __init__(self, base_url, users, requests, concurrency, random_seed=0):
+        super().__init__(base_url, users, requests, concurrency, random_seed=random_seed)
+
+        # one more connection than there are logins in flight, so the probe never queues
+        self._client = AsyncHTTPClient(force_instance=True, max_clients=concurrency + 1)
+
+
+    @gen.coroutine
+    def run_logins(self):
+        """ Makes `requests` logins, and returns their RouteResult, and the latencies of the probe
+        requests made meanwhile. """
+
+        probes, done = list(), [False]
+
+        @gen.coroutine
+        def probe():
+            """ Makes one probe request at a time until the logins are done. """
+
+            while not done[0]:
+                start = time()
+                yield self.fetch('GET', '/notebooks/', user=self._user())
+                probes.append(time() - start)
+
+        probing = probe()
+        result = yield self.run_route('GET /users/{username}', 'GET', self._get_user)
+
+        done[0] = True
+        yield probing
+
+        return result, probes
+
+# -------------------------------------------------------------------------------------------------
+
+def time_hash(username, password):
+    """ Returns the mean time taken to verify a user's password with no help from the credential
+    cache, in seconds. """
+
+    from cloudCache.Business import Models
+    from cloudCache.Business.Cache import NullCache
+    from cloudCache.Business.Models.User import get_password_hash, verify_password
+    from cloudCache.Business.Models.User import get_credential_cache, set_credential_cache
+
+    password_hash = get_password_hash(username)
+    Models.DB_SESSION.remove()
+
+    cache = get_credential_cache()
+    set_credential_cache(NullCache())
+
+    try:
+        start = time()
+        for _ in range(HASH_SAMPLES):
+            verify_password(username, password_hash, password)
+
+        return (time() - start) / HASH_SAMPLES
+
+    finally:
+        set_credential_cache(cache)
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--requests', type=int, default=200, help='Logins per run.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Logins in flight.')
+    parser.add_argument('--rounds', type=int, help='PBKDF2 rounds for the seeded users\' '
+                                                   'passwords. Defaults to the auth setting.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, starts the server in-process, and benchmarks logins with the credential
+    cache off and on. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-logins-')
+
+    # the models read their settings when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'logins.db')
+    if args.rounds:
+        os.environ['CLOUDCACHE_AUTH_PBKDF2_ROUNDS'] = str(args.rounds)
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business.Cache import NullCache, TTLCache
+        from cloudCache.Business.Models.User import CREDENTIAL_CACHE_TTL, PASSWORD_ROUNDS
+        from cloudCache.Business.Models.User import set_credential_cache
+
+        users = seed(users=args.users, notebooks=1, notes=0)
+
+        hash_seconds = time_hash(users[0].username, users[0].password)
+        print('One password hash ({} rounds) takes {:.1f}ms, {:.0f} hashes/s on one core.'.format(
+            PASSWORD_ROUNDS, 1000 * hash_seconds, 1 / hash_seconds))
+
+        benchmark = LoginBenchmark(start_server(), users, args.requests, args.concurrency,
+                                   random_seed=args.seed)
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.run_sync(benchmark.authorize_users)
+
+        rows = list()
+        for name, cache in (('off', NullCache()),
+                            ('on', TTLCache(max_entries=10000, default_ttl=CREDENTIAL_CACHE_TTL))):
+            set_credential_cache(cache)
+            result, probes = io_loop.run_sync(benchmark.run_logins)
+
+            rows.append((name, result.requests, result.errors, result.rate, result.mean_ms,
+                         result.max_ms, 1000 * percentile(probes, 0.50),
+                         1000 * percentile(probes, 0.99)))
+
+        headers = ('Credential cache', 'Logins', 'Errors', 'Logins/s', 'Mean ms', 'Max ms',
+                   'Probe p50 ms', 'Probe p99 ms')
+        print(tabulate(rows, headers=headers, floatfmt='.1f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
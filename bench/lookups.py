@@ -0,0 +1,194 @@
+""" Benchmarks the lookups that every request makes by something other than a primary key: a note by
+its notebook and key, a notebook's notes, a notebook by its user and name, and an access token. Each
+is timed against a seeded database with the schema's indexes, then again with them dropped (as the
+schema was before they were added), and their latency percentiles reported side by side.
+
+The default dataset is 10 users with 10 notebooks of 10000 notes each, i.e. 1M notes, and 100000
+access tokens. Run from the repository root:
+
+    python -m bench.lookups --users=10 --notebooks=10 --notes=10000 --lookups=1000
+
+Without the indexes every lookup scans its table, so only --unindexed-lookups of each are made.
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from time import time
+
+from tabulate import tabulate
+
+from .load import percentile
+
+# -------------------------------------------------------------------------------------------------
+
+# The indexes dropped for the unindexed run, as the schema had none of them. The unique index on
+# USER.username predates them, and is kept.
+INDEXES = ('ux_note_notebook_id_key', 'ix_note_notebook_id_id', 'ux_notebook_user_id_name',
+           'ux_user_access_token_access_token', 'ix_user_access_token_user_id')
+
+# Notes fetched by a lookup of a notebook's notes, as for a page of a listing
+PAGE_SIZE = 100
+
+# -------------------------------------------------------------------------------------------------
+
+def make_lookups(users, notes, tokens, random_seed=0):
+    """ Returns a list of (name, lookup) pairs, where each lookup is a function which looks up a
+    randomly chosen row of its kind, with the query the business layer makes for it.
+
+    Args:
+        users (list): The seeded users, as SeededUsers.
+        notes (int): The number of notes per notebook.
+        tokens (list): The seeded access tokens.
+        random_seed (int): Seed for the choice of rows.
+
+    """
+
+    from cloudCache.Business.Models import DB_SESSION as db, Note, Notebook, User
+    from cloudCache.Business.Models import UserAccessToken
+
+    rng = random.Random(random_seed)
+
+    user_ids = dict(db.query(User.username, User.id))
+    notebooks = [(notebook_id, user_ids[user.username], 'notebook{}'.format(n))
+                 for user in users for n, notebook_id in enumerate(user.notebook_ids)]
+    db.remove()
+
+    def note_by_key():
+        """ As create_note, get_note_by_key and the unique index's check on insert. """
+        notebook_id = rng.choice(notebooks)[0]
+        key = 'note{}'.format(rng.randrange(notes))
+        return db.query(Note).filter(Note.notebook_id == notebook_id, Note.key == key).first()
+
+    def notebook_notes():
+        """ As the first page of a notebook's notes. """
+        notebook_id = rng.choice(notebooks)[0]
+        return db.query(Note).filter(Note.notebook_id == notebook_id)\
+                 .order_by(Note.id).limit(PAGE_SIZE).all()
+
+    def notebook_by_name():
+        """ As create_notebook and the unique index's check on insert. """
+        _, user_id, name = rng.choice(notebooks)
+        return db.query(Notebook).filter(Notebook.user_id == user_id, Notebook.name == name).first()
+
+    def token():
+        """ As get_user_for_token, on a miss in the token cache. """
+        return db.query(UserAccessToken)\
+                 .filter(UserAccessToken.access_token == rng.choice(tokens)).first()
+
+    return [('note by notebook and key', note_by_key),
+            ('notebook\'s notes (first page)', notebook_notes),
+            ('notebook by user and name', notebook_by_name),
+            ('access token', token)]
+
+
+def measure(lookup, lookups):
+    """ Makes `lookups` lookups, each in a session of its own as a request's would be, and returns
+    the latency of each. """
+
+    from cloudCache.Business.Models import DB_SESSION as db
+
+    latencies = list()
+
+    for _ in range(lookups):
+        start = time()
+        if lookup() is None:
+            raise RuntimeError('A lookup found nothing.')
+        db.remove()
+        latencies.append(time() - start)
+
+    return latencies
+
+
+def seed_tokens(users, tokens):
+    """ Inserts `tokens` unexpired access tokens, shared among the seeded users, and returns them.
+    """
+
+    import arrow
+    from cloudCache.Business.Models import DB_SESSION as db, User, UserAccessToken
+
+    user_ids = [row.id for row in db.query(User.id)]
+    expires_on = arrow.utcnow().replace(hours=1)
+
+    rows = [{'user_id': user_ids[n % len(user_ids)], 'access_token': uuid.uuid4().hex.upper(),
+             'expires_on': expires_on} for n in range(tokens)]
+
+    db.execute(UserAccessToken.__table__.insert(), rows)
+    db.commit()
+    db.remove()
+
+    return [row['access_token'] for row in rows]
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--notebooks', type=int, default=10, help='Notebooks per user.')
+    parser.add_argument('--notes', type=int, default=10000, help='Notes per notebook.')
+    parser.add_argument('--tokens', type=int, default=100000, help='Access tokens to seed.')
+    parser.add_argument('--lookups', type=int, default=1000, help='Lookups of each kind.')
+    parser.add_argument('--unindexed-lookups', type=int, default=20,
+                        help='Lookups of each kind without the indexes.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, and benchmarks the lookups with and without the indexes. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-lookups-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'lookups.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business import Models
+
+        start = time()
+        users  = seed(users=args.users, notebooks=args.notebooks, notes=args.notes)
+        tokens = seed_tokens(users, args.tokens)
+
+        print('Seeded {} notes and {} access tokens in {:.1f}s.'.format(
+            args.users * args.notebooks * args.notes, args.tokens, time() - start))
+
+        lookups = make_lookups(users, args.notes, tokens, random_seed=args.seed)
+        results = [measure(lookup, args.lookups) for _, lookup in lookups]
+
+        for table in Models.SQL_ALCHEMY_BASE.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in INDEXES:
+                    index.drop(bind=Models.DB_ENGINE)
+
+        unindexed = [measure(lookup, args.unindexed_lookups) for _, lookup in lookups]
+
+        rows = list()
+        for (name, _), indexed_latencies, unindexed_latencies in zip(lookups, results, unindexed):
+            p50, unindexed_p50 = (percentile(indexed_latencies, 0.50),
+                                  percentile(unindexed_latencies, 0.50))
+
+            rows.append((name, 1000 * p50, 1000 * percentile(indexed_latencies, 0.99),
+                         1000 * unindexed_p50, 1000 * percentile(unindexed_latencies, 0.99),
+                         unindexed_p50 / p50))
+
+        headers = ('Lookup', 'p50 ms', 'p99 ms', 'Unindexed p50 ms', 'Unindexed p99 ms',
+                   'Speedup')
+        print(tabulate(rows, headers=headers, floatfmt='.2f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+""" Benchmarks the memory used to list a notebook's notes in full. Notebooks of increasing size are
+fetched with GET /notebooks/{notebook}/notes?stream=1 from an in-process server, by a client which
+discards each chunk as it arrives, and their notes are also serialized into a single document, as
+the listing was built before it was streamed. The peak memory allocated by each (as traced by
+tracemalloc, across every thread) is reported side by side.
+
+Run from the repository root:
+
+    python -m bench.memory --sizes=1000,10000,100000 --value-size=256
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import tracemalloc
+from time import time
+
+import tornado.ioloop
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tabulate import tabulate
+
+from .load import start_server
+from .routes import RouteBenchmark
+
+# -------------------------------------------------------------------------------------------------
+
+def seed_notebooks(sizes, value_size):
+    """ Seeds a user with a notebook of each size in `sizes`, and returns the user and the
+    notebooks' IDs, in the same order. """
+
+    from .dataset import insert_in_batches, seed
+    from cloudCache.Business.Models import DB_SESSION as db, Note
+
+    user, = seed(users=1, notebooks=len(sizes), notes=0)
+
+    for notebook_id, size in zip(user.notebook_ids, sizes):
+        rows = ({'notebook_id': notebook_id, 'key': 'note{}'.format(n), 'value': 'v' * value_size}
+                for n in range(size))
+        insert_in_batches(Note.__table__, rows)
+
+    db.commit()
+    db.remove()
+
+    return user, user.notebook_ids
+
+
+def trace_peak(func, *args):
+    """ Calls `func` with tracemalloc tracing, and returns its result and the peak memory allocated
+    while it ran, in bytes. """
+
+    tracemalloc.start()
+
+    try:
+        result = func(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+
+def build_listing(notebook_id):
+    """ Serializes every note in a notebook into a single JSON document, as a listing's response
+    was built before listings were streamed, and returns its length. """
+
+    from cloudCache.Business.Models.JsonMixin import encode_json
+    from cloudCache.Business.Models import DB_SESSION as db, Note, Notebook
+
+    try:
+        notebook = db.query(Notebook).get(notebook_id)
+        notes = db.query(Note).filter(Note.notebook_id == notebook_id).order_by(Note.id)
+
+        document = {'notebook': notebook.name, 'notes': [note.to_ordered_dict() for note in notes]}
+        return len(encode_json(document))
+
+    finally:
+        db.remove()
+
+
+@gen.coroutine
+def stream_listing(base_url, token, notebook_id):
+    """ Fetches a notebook's streamed listing, discarding its chunks as they arrive, and returns
+    the number of bytes received. """
+
+    received = [0]
+
+    def discard(chunk):
+        received[0] += len(chunk)
+
+    client = AsyncHTTPClient(force_instance=True)
+    request = HTTPRequest('{}/notebooks/{}/notes?stream=1'.format(base_url, notebook_id),
+                          headers={'access token': token}, streaming_callback=discard,
+                          decompress_response=False, request_timeout=300)
+    try:
+        yield client.fetch(request)
+        return received[0]
+
+    finally:
+        client.close()
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma separated numbers of notes in the notebooks listed.')
+    parser.add_argument('--value-size', type=int, default=256, help='Length of each note\'s '
+                                                                     'value.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, starts the server in-process, and benchmarks the memory used by streamed
+    and buffered listings of each notebook. """
+
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    workdir = tempfile.mkdtemp(prefix='cloudcache-memory-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'memory.db')
+
+    try:
+        user, notebook_ids = seed_notebooks(sizes, args.value_size)
+
+        base_url = start_server()
+        benchmark = RouteBenchmark(base_url, [user], 0, 1)
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.run_sync(benchmark.authorize_users)
+        token = benchmark.tokens[user.username]
+
+        rows = list()
+        for size, notebook_id in zip(sizes, notebook_ids):
+            start = time()
+            received, streamed_peak = trace_peak(
+                io_loop.run_sync, lambda: stream_listing(base_url, token, notebook_id))
+            streamed_seconds = time() - start
+
+            start = time()
+            _, buffered_peak = trace_peak(build_listing, notebook_id)
+            buffered_seconds = time() - start
+
+            rows.append((size, received / 1024 / 1024, streamed_peak / 1024 / 1024,
+                         streamed_seconds, buffered_peak / 1024 / 1024, buffered_seconds))
+
+        headers = ('Notes', 'Listing MB', 'Streamed peak MB', 'Streamed s', 'Buffered peak MB',
+                   'Buffered s')
+        print(tabulate(rows, headers=headers, floatfmt='.2f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+""" Benchmarks paging through a large notebook's notes. Pages of a notebook of a million notes are
+fetched at increasing depths with get_notes_page, which selects them by keyset (`id > cursor`), and
+with the same query paginated by OFFSET instead, as listings were before, and the latency
+percentiles of each are reported side by side.
+
+Run from the repository root:
+
+    python -m bench.pages --notes=1000000 --limit=100 --pages=50
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+from time import time
+
+from tabulate import tabulate
+
+from .load import percentile
+
+# -------------------------------------------------------------------------------------------------
+
+# Depths of the pages fetched, as fractions of the notebook's notes
+DEPTHS = (0, 0.01, 0.1, 0.5, 0.999)
+
+# -------------------------------------------------------------------------------------------------
+
+def measure(fetch, pages):
+    """ Calls `fetch` `pages` times, each in a session of its own as a request's would be, and
+    returns the latency of each. """
+
+    from cloudCache.Business.Models import DB_SESSION as db
+
+    latencies = list()
+
+    for _ in range(pages):
+        start = time()
+        if not fetch():
+            raise RuntimeError('A page was empty.')
+        db.remove()
+        latencies.append(time() - start)
+
+    return latencies
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--notes', type=int, default=1000000, help='Notes in the notebook.')
+    parser.add_argument('--limit', type=int, default=100, help='Notes per page.')
+    parser.add_argument('--pages', type=int, default=50, help='Pages fetched at each depth.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database with one large notebook, and benchmarks fetching pages of it at increasing
+    depths by keyset and by OFFSET. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-pages-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'pages.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business.Models import DB_SESSION as db, Note, Notebook
+        from cloudCache.Business.Models.Note import get_notes_page
+
+        start = time()
+        seed(users=1, notebooks=1, notes=args.notes, value_size=16)
+        print('Seeded {} notes in {:.1f}s.'.format(args.notes, time() - start))
+
+        notebook = db.query(Notebook).one()
+
+        def notes():
+            """ Returns the notebook's notes, ordered by ID, in the current session. """
+            return db.query(Note).filter(Note.notebook_id == notebook.id).order_by(Note.id)
+
+        rows = list()
+        for depth in DEPTHS:
+            offset = int(depth * args.notes)
+
+            # the cursor a client would hold on reaching this depth, i.e. the previous note's ID
+            cursor = notes().with_entities(Note.id).offset(offset - 1).limit(1).scalar() \
+                if offset else None
+            db.remove()
+
+            keyset = measure(lambda: get_notes_page(notebook, args.limit, after=cursor)[0],
+                             args.pages)
+            by_offset = measure(lambda: notes().offset(offset).limit(args.limit + 1).all(),
+                                args.pages)
+
+            rows.append((offset, 1000 * percentile(keyset, 0.50), 1000 * percentile(keyset, 0.99),
+                         1000 * percentile(by_offset, 0.50), 1000 * percentile(by_offset, 0.99)))
+
+        headers = ('Depth', 'Keyset p50 ms', 'Keyset p99 ms', 'OFFSET p50 ms', 'OFFSET p99 ms')
+        print(tabulate(rows, headers=headers, floatfmt='.2f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+""" Drives every route in server.py against a seeded database, and reports the throughput and
+latency of each. The server runs as a separate process, exactly as it's deployed (including
+--workers), so the numbers include everything but the network.
+
+Run from the repository root:
+
+    python -m bench.routes --users=10 --notebooks=10 --notes=1000 --requests=500 --concurrency=10
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+from collections import namedtuple
+from time import time, sleep
+
+import tornado.ioloop
+from tornado import gen
+from tornado.escape import json_decode, json_encode
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tabulate import tabulate
+
+# -------------------------------------------------------------------------------------------------
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_START_TIMEOUT = 30 # seconds
+
+# Number of notes posted by each request to the bulk import route
+BULK_IMPORT_SIZE = 100
+
+# Number of notes looked up by each request to the batch get routes
+BATCH_GET_SIZE = 10
+
+RouteResult = namedtuple('RouteResult', 'route requests errors rate mean_ms max_ms kb_per_request')
+
+# -------------------------------------------------------------------------------------------------
+
+class RouteBenchmark(object):
+    """ Drives each route of a running cloudCache server in turn, with `concurrency` requests in
+    flight at a time, on behalf of randomly chosen seeded users.
+
+    Args:
+        base_url (string): The server's URL, e.g. http://127.0.0.1:8888.
+        users (list): The dataset's bench.dataset.SeededUsers.
+        requests (int): The number of requests made to each route.
+        concurrency (int): The number of requests in flight at a time.
+        random_seed (int): Seed for the choice of users and resources, so runs are repeatable.
+
+    """
+
+    def __init__(self, base_url, users, requests, concurrency, random_seed=0):
+        self.base_url    = base_url
+        self.users       = users
+        self.requests    = requests
+        self.concurrency = concurrency
+
+        self.started = time()
+        self.tokens  = dict()
+
+        self._random = random.Random(random_seed)
+        self._client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+
+        # resources created by the POST benchmarks, for the DELETE benchmarks to delete
+        self._created_users     = list()
+        self._created_notebooks = list()
+        self._created_notes     = list()
+
+
+    @gen.coroutine
+    def fetch(self, method, path, body=None, user=None):
+        """ Makes a request to the server, authorized as `user` if one is given, and returns the
+        response (whatever its status code). """
+
+        headers = {'access token': self.tokens[user.username]} if user else {}
+
+        if body is not None:
+            body = json_encode(body)
+        elif method == 'POST':
+            body = ''
+
+        request = HTTPRequest(self.base_url + path, method=method, headers=headers, body=body,
+                              allow_nonstandard_methods=True, request_timeout=300)
+
+        response = yield self._client.fetch(request, raise_error=False)
+        return response
+
+
+    @gen.coroutine
+    def authorize_users(self):
+        """ Fetches an access token for every seeded user. """
+
+        for user in self.users:
+            response = yield self.fetch('GET', '/access/{}/{}'.format(user.username, user.api_key))
+            self.tokens[user.username] = json_decode(response.body)['access token']['access_token']
+
+
+    @gen.coroutine
+    def run(self):
+        """ Benchmarks every route, and returns a list of RouteResults. Routes which create
+        resources run before the routes which delete them. """
+
+        yield self.authorize_users()
+
+        benchmarks = [
+            ('GET /access/{username}/{api_key}', 'GET', self._access),
+            ('POST /users/', 'POST', self._create_user),
+            ('GET /users/', 'GET', lambda n: ('/users/', None, self._user())),
+            ('GET /users/?stream=1', 'GET', lambda n: ('/users/?stream=1', None, self._user())),
+            ('GET /users/{username}', 'GET', self._get_user),
+            ('POST /notebooks/', 'POST', self._create_notebook),
+            ('GET /notebooks/', 'GET', lambda n: ('/notebooks/', None, self._user())),
+            ('POST /notebooks/{notebook}/notes', 'POST', self._create_note),
+            ('GET /notebooks/{notebook}/notes', 'GET', self.notebook_path('/notes')),
+            ('GET /notebooks/{notebook}/notes?stream=1', 'GET',
+             self.notebook_path('/notes?stream=1')),
+            ('POST /notebooks/{notebook}/notes/bulk', 'POST', self._import_notes),
+            ('GET /notebooks/{notebook}/notes/bulk', 'GET', self.notebook_path('/notes/bulk')),
+            ('GET /notebooks/{notebook}/notes?prefix={prefix}', 'GET',
+             self.notebook_path('/notes?prefix=note1')),
+            ('GET /notebooks/{notebook}/notes?key={key}&...', 'GET',
+             self.notebook_path('/notes?' + '&'.join('key=note{}'.format(n)
+                                                      for n in range(BATCH_GET_SIZE)))),
+            ('GET /notebooks/{notebook}/keys/{key}', 'GET', self.notebook_path('/keys/note0')),
+            ('GET /notes/{note}', 'GET', self.get_note),
+            ('GET /notes/?id={note},...', 'GET', self._get_notes),
+            ('PATCH /notes/{note}', 'PATCH', self._patch_note),
+            ('GET /sync?since={cursor}', 'GET', self._sync),
+            ('DELETE /notes/{note}', 'DELETE', self._delete_created(self._created_notes,
+                                                                   '/notes/{}')),
+            ('DELETE /notebooks/{notebook}', 'DELETE',
+             self._delete_created(self._created_notebooks, '/notebooks/{}')),
+            ('DELETE /users/{username}', 'DELETE', self._delete_user),
+        ]
+
+        results = list()
+        for route, method, build in benchmarks:
+            result = yield self.run_route(route, method, build)
+            results.append(result)
+
+        return results
+
+
+    @gen.coroutine
+    def run_route(self, route, method, build):
+        """ Makes `requests` requests to a single route, and returns its RouteResult.
+
+        Args:
+            route (string): The route's name.
+            method (string): The HTTP method.
+            build (callable): Called with the request number, and returns the request's path, body
+                and user, or `None` if there's nothing left to request.
+
+        """
+
+        latencies, sizes, errors = list(), list(), [0]
+        numbers = iter(range(self.requests))
+
+        @gen.coroutine
+        def worker():
+            """ Makes requests until there are none left to make. """
+
+            for number in numbers:
+                request = build(number)
+                if request is None:
+                    return
+
+                path, body, user = request
+
+                start    = time()
+                response = yield self.fetch(method, path, body=body, user=user)
+                latencies.append(time() - start)
+                sizes.append(len(response.body or b''))
+
+                if response.code >= 400:
+                    errors[0] += 1
+                elif method == 'POST':
+                    self._record_created(route, user, body, json_decode(response.body))
+
+        start = time()
+        yield [worker() for _ in range(self.concurrency)]
+        elapsed = time() - start
+
+        count = len(latencies)
+        if not count:
+            return RouteResult(route, 0, 0, 0.0, 0.0, 0.0, 0.0)
+
+        return RouteResult(route, count, errors[0], count / elapsed,
+                           1000 * sum(latencies) / count, 1000 * max(latencies),
+                           sum(sizes) / count / 1024)
+
+
+    def _user(self):
+        """ Returns a random seeded user. """
+        return self._random.choice(self.users)
+
+
+    def _record_created(self, route, user, body, response):
+        """ Remembers a resource created by a POST benchmark. """
+
+        if route == 'POST /users/':
+            self._created_users.append(body['username'])
+        elif route == 'POST /notebooks/':
+            self._created_notebooks.append((user, response['notebook_id']))
+        elif route == 'POST /notebooks/{notebook}/notes':
+            self._created_notes.append((user, response['note_id']))
+
+
+    def _access(self, _):
+        user = self._user()
+        return '/access/{}/{}'.format(user.username, user.api_key), None, None
+
+
+    def _create_user(self, number):
+        body = {'username': 'created{}'.format(number), 'first_name': 'Created',
+                'last_name': 'User', 'email': 'created@example.com', 'password': 'password'}
+        return '/users/', body, None
+
+
+    def _get_user(self, _):
+        user = self._user()
+        return '/users/{}'.format(user.username), {'password': user.password}, user
+
+
+    def _create_notebook(self, number):
+        return '/notebooks/', {'notebook_name': 'created{}'.format(number)}, self._user()
+
+
+    def notebook_path(self, suffix):
+        """ Returns a builder for requests to a random notebook's path plus `suffix`. """
+
+        def build(_):
+            user = self._user()
+            notebook_id = self._random.choice(user.notebook_ids)
+            return '/notebooks/{}{}'.format(notebook_id, suffix), None, user
+
+        return build
+
+
+    def _create_note(self, number):
+        path, _, user = self.notebook_path('/notes')(number)
+        return path, {'note_key': 'created{}'.format(number), 'note_value': 'value'}, user
+
+
+    def _import_notes(self, number):
+        path, _, user = self.notebook_path('/notes/bulk')(number)
+        notes = [{'note_key': 'imported{}-{}'.format(number, n), 'note_value': 'value'}
+                 for n in range(BULK_IMPORT_SIZE)]
+        return path, notes, user
+
+
+    def get_note(self, _):
+        """ Builds a request for a random note of a random user. """
+
+        user = self._user()
+        return '/notes/{}'.format(self._random.choice(user.note_ids)), None, user
+
+
+    def _get_notes(self, _):
+        user = self._user()
+        note_ids = self._random.sample(user.note_ids, min(BATCH_GET_SIZE, len(user.note_ids)))
+        return '/notes/?id={}'.format(','.join(str(note_id) for note_id in note_ids)), None, user
+
+
+    def _patch_note(self, number):
+        path, _, user = self.get_note(number)
+        return path, {'note_value': 'patched{}'.format(number)}, user
+
+
+    def _sync(self, _):
+        # the notes created and imported by the benchmarks so far count as changed, the seeded
+        # ones don't
+        since = int(self.started * 1000)
+        return '/sync?since={}'.format(since), None, self._user()
+
+
+    def _delete_created(self, created, path):
+        """ Returns a builder for requests deleting the resources in `created`, one each. """
+
+        def build(_):
+            if not created:
+                return None
+
+            user, resource_id = created.pop()
+            return path.format(resource_id), None, user
+
+        return build
+
+
+    def _delete_user(self, _):
+        if not self._created_users:
+            return None
+
+        username = self._created_users.pop()
+        return '/users/{}'.format(username), {'password': 'password'}, self._user()
+
+# -------------------------------------------------------------------------------------------------
+
+def start_server(port, workers, env):
+    """ Starts server.py in its own process group, and waits for it to accept connections. """
+
+    command = [sys.executable, os.path.join(ROOT, 'server.py'),
+               '--port={}'.format(port), '--workers={}'.format(workers), '--logging=warning']
+    server = subprocess.Popen(command, cwd=ROOT, env=env, start_new_session=True)
+
+    deadline = time() + SERVER_START_TIMEOUT
+    while time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('The server exited with status {}.'.format(server.returncode))
+
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            sleep(0.1)
+
+    stop_server(server)
+    raise RuntimeError('The server didn\'t start within {}s.'.format(SERVER_START_TIMEOUT))
+
+
+def stop_server(server):
+    """ Shuts down the server's process group gracefully, or kills it if that takes too long. """
+
+    try:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=30)
+
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+        server.wait()
+
+    except ProcessLookupError:
+        pass
+
+
+def free_port():
+    """ Returns a TCP port which nothing is listening on. """
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--notebooks', type=int, default=10, help='Notebooks per user.')
+    parser.add_argument('--notes', type=int, default=100, help='Notes per notebook.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight.')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, starts the server against it, and benchmarks every route. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-bench-')
+
+    env = dict(os.environ)
+    env['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, os.path.join(ROOT, 'cloudCache')])
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = env['CLOUDCACHE_DB_URL']
+    from bench.dataset import seed
+
+    server = None
+
+    try:
+        start = time()
+        users = seed(users=args.users, notebooks=args.notebooks, notes=args.notes)
+        print('Seeded {} users x {} notebooks x {} notes in {:.1f}s.'.format(
+            args.users, args.notebooks, args.notes, time() - start))
+
+        port   = free_port()
+        server = start_server(port, args.workers, env)
+
+        benchmark = RouteBenchmark('http://127.0.0.1:{}'.format(port), users, args.requests,
+                                   args.concurrency, random_seed=args.seed)
+        results = tornado.ioloop.IOLoop.current().run_sync(benchmark.run)
+
+        headers = ('Route', 'Requests', 'Errors', 'Req/s', 'Mean ms', 'Max ms', 'KB/req')
+        print(tabulate(results, headers=headers, floatfmt='.1f'))
+
+    finally:
+        if server:
+            stop_server(server)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
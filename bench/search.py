@@ -0,0 +1,154 @@
+""" Benchmarks full-text search: seeds users with notes whose values are made of words drawn from a
+fixed vocabulary, then times search_notes (as SearchHandler calls it, in a session of its own) for
+queries matching many notes, few notes, two words, and none, and reports their latency percentiles.
+
+The default dataset is 10 users with 10 notebooks of 10000 notes each, i.e. 1M notes. Run from the
+repository root:
+
+    python -m bench.search --users=10 --notebooks=10 --notes=10000 --searches=200
+
+The first word of the vocabulary appears in roughly half of all notes, and the last in very few, as
+words in real text do (a Zipf-like distribution).
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from time import time
+
+from tabulate import tabulate
+
+from .load import percentile
+
+# -------------------------------------------------------------------------------------------------
+
+# The words note values are made of, most common first
+VOCABULARY = ('note', 'list', 'shopping', 'meeting', 'project', 'idea', 'travel', 'recipe',
+              'budget', 'reading', 'garden', 'birthday', 'invoice', 'holiday', 'workout',
+              'password', 'kitchen', 'conference', 'dentist', 'quarterly', 'xylophone')
+
+# Words per note value
+WORDS_PER_NOTE = 8
+
+# Query name -> query
+QUERIES = (('common', VOCABULARY[0]),
+           ('rare', VOCABULARY[-1]),
+           ('two words', '{} {}'.format(VOCABULARY[1], VOCABULARY[4])),
+           ('no match', 'zeppelin'))
+
+# Results per page, as for a request with no `limit`
+PAGE_SIZE = 100
+
+# -------------------------------------------------------------------------------------------------
+
+def make_values(random_seed=0):
+    """ Returns a `values` function for bench.dataset.seed, which makes note values of
+    WORDS_PER_NOTE words each, the n-th word of VOCABULARY being chosen with weight 1 / n. """
+
+    choose = random.Random(random_seed).choice
+
+    # each word repeated in proportion to its weight, so a uniform choice from them is weighted
+    words = [word for rank, word in enumerate(VOCABULARY, 1)
+             for _ in range(round(len(VOCABULARY) / rank))]
+
+    def values(*_):
+        """ Returns a note value. """
+        return ' '.join(choose(words) for _ in range(WORDS_PER_NOTE))
+
+    return values
+
+
+def measure(users, query, searches, random_seed=0):
+    """ Searches a randomly chosen user's notes for a query `searches` times, and returns the
+    latency of each search and the mean number of notes returned.
+
+    Args:
+        users (list): The seeded users, as SeededUsers.
+        query (string): The search query.
+        searches (int): The number of searches.
+        random_seed (int): Seed for the choice of users.
+
+    """
+
+    from cloudCache.Business.Models import DB_SESSION as db, User
+    from cloudCache.Business.Models.Search import search_notes
+    from cloudCache.Business.Models.UserAccessToken import TokenUser
+
+    # search_notes only needs the user's ID, as a request's authorized user would have
+    usernames = [user.username for user in users]
+    users = [TokenUser(user_id, username) for user_id, username in
+             db.query(User.id, User.username).filter(User.username.in_(usernames))]
+    db.remove()
+
+    choose = random.Random(random_seed).choice
+    latencies, results = list(), 0
+
+    for _ in range(searches):
+        start = time()
+        notes, _ = search_notes(choose(users), query, PAGE_SIZE)
+        db.remove()
+        latencies.append(time() - start)
+
+        results += len(notes)
+
+    return latencies, results / searches
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--notebooks', type=int, default=10, help='Notebooks per user.')
+    parser.add_argument('--notes', type=int, default=10000, help='Notes per notebook.')
+    parser.add_argument('--searches', type=int, default=200, help='Searches per query.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database with word-like notes, and benchmarks searching them. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-search-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'search.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business import Models
+        from cloudCache.Business.Models.Search import _get_backend
+
+        start = time()
+        users = seed(users=args.users, notebooks=args.notebooks, notes=args.notes,
+                     values=make_values(args.seed))
+
+        print('Seeded {} notes in {:.1f}s, searched with the {} backend.'.format(
+            args.users * args.notebooks * args.notes, time() - start, _get_backend()))
+        Models.DB_SESSION.remove()
+
+        rows = list()
+        for name, query in QUERIES:
+            latencies, results = measure(users, query, args.searches, random_seed=args.seed)
+
+            rows.append((name, query, len(latencies), results,
+                         1000 * sum(latencies) / len(latencies), 1000 * percentile(latencies, 0.50),
+                         1000 * percentile(latencies, 0.99)))
+
+        headers = ('Query', 'Terms', 'Searches', 'Notes/search', 'Mean ms', 'p50 ms', 'p99 ms')
+        print(tabulate(rows, headers=headers, floatfmt='.1f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
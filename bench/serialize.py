@@ -0,0 +1,130 @@
+""" Benchmarks serializing notes for a response. A notebook's notes are loaded once, and then
+serialized into a listing, both by the precompiled serializers and encode_json, and by the
+serializer and encoding the models and handlers used before (getattr and an isinstance check on
+every attribute, Arrow's own timezone conversion, and tornado's json_encode), and the time taken by
+each is reported side by side. Both must produce the same documents.
+
+Run from the repository root:
+
+    python -m bench.serialize --notes=100000 --repeat=3
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from time import time
+
+from arrow.arrow import Arrow
+from tabulate import tabulate
+from tornado.escape import json_decode, json_encode, utf8
+
+# -------------------------------------------------------------------------------------------------
+
+def legacy_to_ordered_dict(obj, attrs):
+    """ Returns an OrderedDict of the given attributes of a model, as JsonMixin._to_ordered_dict did
+    before it used precompiled serializers. """
+
+    ordered_dict = OrderedDict()
+
+    for attribute in attrs:
+        attr_val = getattr(obj, attribute)
+
+        if isinstance(attr_val, Arrow):
+            attr_val = str(attr_val.to('local'))
+
+        ordered_dict[attribute] = attr_val
+
+    return ordered_dict
+
+
+def serialize_legacy(notebook, notes, attrs):
+    """ Returns the listing of `notes` as UTF-8 JSON, serialized the way it was before. """
+
+    document = {'notebook': notebook.name,
+                'notes': [legacy_to_ordered_dict(note, attrs) for note in notes]}
+
+    return utf8(json_encode(document))
+
+
+def serialize(notebook, notes):
+    """ Returns the listing of `notes` as UTF-8 JSON, serialized as the handlers now do. """
+
+    from cloudCache.Business.Models.JsonMixin import encode_json
+
+    return encode_json({'notebook': notebook.name,
+                        'notes': [note.to_ordered_dict() for note in notes]})
+
+
+def best_time(func, repeat, *args):
+    """ Calls `func` `repeat` times, and returns its result and the fastest call's time. """
+
+    times = list()
+
+    for _ in range(repeat):
+        start = time()
+        result = func(*args)
+        times.append(time() - start)
+
+    return result, min(times)
+
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--notes', type=int, default=100000, help='Notes serialized.')
+    parser.add_argument('--repeat', type=int, default=3, help='Times each serializer is timed; '
+                                                              'the fastest time is reported.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, and benchmarks serializing its notes with the precompiled serializers and
+    the legacy ones. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-serialize-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'serialize.db')
+
+    try:
+        from .dataset import seed
+        from cloudCache.Business.Models import DB_SESSION as db, Note, Notebook
+        from cloudCache.Business.Models.Note import _get_attributes
+        from cloudCache.Business.Models.JsonMixin import _fast_dumps
+
+        seed(users=1, notebooks=1, notes=args.notes)
+
+        notebook = db.query(Notebook).one()
+        notes = db.query(Note).order_by(Note.id).all()
+
+        current, current_seconds = best_time(serialize, args.repeat, notebook, notes)
+        legacy, legacy_seconds = best_time(serialize_legacy, args.repeat, notebook, notes,
+                                           _get_attributes())
+
+        # the encoders' whitespace and escaping differ, so the documents are compared decoded
+        if json_decode(current) != json_decode(legacy):
+            raise RuntimeError('The serializers produced different documents.')
+
+        rows = [('legacy', legacy_seconds, len(notes) / legacy_seconds, len(legacy) / 1024 / 1024),
+                ('precompiled', current_seconds, len(notes) / current_seconds,
+                 len(current) / 1024 / 1024)]
+
+        print('Encoder: {}'.format('ujson' if _fast_dumps else 'json'))
+        print(tabulate(rows, headers=('Serializer', 'Seconds', 'Notes/s', 'MB'), floatfmt='.2f'))
+        print('Speedup: {:.1f}x'.format(legacy_seconds / current_seconds))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
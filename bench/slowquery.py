@@ -0,0 +1,215 @@
+""" Benchmarks how a slow query affects the latency of every other request. GET /notes/{note} is
+driven against an in-process server three times: with no slow query running, then while a slow
+query runs on the DB_EXECUTOR thread pool (as the handlers run their queries), and
+then while it runs on the server's IOLoop thread (as they ran them before). The slow query is run
+once every --slow-interval seconds. It runs in the database, not in Python, so only the last run
+should hold up the other requests.
+
+Run from the repository root:
+
+    python -m bench.slowquery --users=10 --requests=1000 --concurrency=10 --slow-seconds=0.5
+
+On SQLite the slow query counts through a recursive CTE, sized to take about --slow-seconds, and on
+MySQL it sleeps for that long.
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+from functools import partial
+from time import time
+
+import tornado.ioloop
+import tornado.web
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tabulate import tabulate
+
+from .load import percentile, start_server
+from .routes import RouteBenchmark
+
+# -------------------------------------------------------------------------------------------------
+
+# Paths of the slow query's handlers, on the DB_EXECUTOR thread pool and on the IOLoop thread
+EXECUTOR_PATH = '/bench/slow-query/executor'
+IOLOOP_PATH = '/bench/slow-query/ioloop'
+
+# Counts up to :rows, one row at a time, within SQLite
+SQLITE_SLOW_QUERY = ('WITH RECURSIVE counter(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM counter '
+                     'WHERE n < :rows) SELECT count(*) FROM counter')
+
+MYSQL_SLOW_QUERY = 'SELECT SLEEP(:seconds)'
+
+# Rows counted to time the SQLite slow query, before it's sized
+CALIBRATION_ROWS = 1000000
+
+# -------------------------------------------------------------------------------------------------
+
+def make_slow_query(seconds):
+    """ Returns a function which runs a query taking about `seconds` seconds in the database, and
+    then removes its session. """
+
+    from sqlalchemy import text
+    from cloudCache.API.Concurrency import run_in_session
+    from cloudCache.Business.Models import DB_ENGINE, DB_SESSION as db
+
+    if DB_ENGINE.dialect.name == 'mysql':
+        query, params = text(MYSQL_SLOW_QUERY), {'seconds': seconds}
+    else:
+        query = text(SQLITE_SLOW_QUERY)
+
+        start = time()
+        run_in_session(db.execute, query, {'rows': CALIBRATION_ROWS})
+        params = {'rows': int(CALIBRATION_ROWS * seconds / (time() - start))}
+
+    return lambda: run_in_session(db.execute, query, params)
+
+
+def make_handlers(slow_query):
+    """ Returns routes for a handler which runs `slow_query` on the DB_EXECUTOR thread pool, and one
+    which runs it on the IOLoop thread. """
+
+    from cloudCache.API.Concurrency import run_on_db_executor
+
+    class ExecutorHandler(tornado.web.RequestHandler):
+        """ Runs the slow query on the DB_EXECUTOR thread pool. """
+
+        @gen.coroutine
+        def get(self):
+            yield run_on_db_executor(slow_query)
+
+
+    class IOLoopHandler(tornado.web.RequestHandler):
+        """ Runs the slow query on the IOLoop thread. """
+
+        def get(self):
+            slow_query()
+
+
+    return [(EXECUTOR_PATH, ExecutorHandler), (IOLOOP_PATH, IOLoopHandler)]
+
+# -------------------------------------------------------------------------------------------------
+
+class SlowQueryBenchmark(RouteBenchmark):
+    """ Drives GET /notes/{note} on behalf of randomly chosen seeded users, while a slow query
+    runs. Takes the same arguments as RouteBenchmark. """
+
+    def __init__(self, base_url, users, requests, concurrency, random_seed=0):
+        super().__init__(base_url, users, requests, concurrency, random_seed=random_seed)
+
+        # one more connection than there are notes requested at a time, so the slow query never
+        # queues
+        self._client = AsyncHTTPClient(force_instance=True, max_clients=concurrency + 1)
+
+
+    @gen.coroutine
+    def run_notes(self, slow_path=None, slow_interval=1.0):
+        """ Makes `requests` requests to GET /notes/{note}, `concurrency` at a time, while making
+        a request to `slow_path`, if it's given, every `slow_interval` seconds. Returns the latency
+        of each note request, and the number of slow queries run meanwhile. """
+
+        latencies, numbers, done, slow_queries = list(), iter(range(self.requests)), [False], [0]
+
+        @gen.coroutine
+        def worker():
+            """ Makes note requests until there are none left to make. """
+
+            for number in numbers:
+                path, _, user = self.get_note(number)
+
+                start = time()
+                response = yield self.fetch('GET', path, user=user)
+                latencies.append(time() - start)
+
+                if response.code != 200:
+                    raise RuntimeError('GET {} returned {}.'.format(path, response.code))
+
+        @gen.coroutine
+        def slow():
+            """ Runs a slow query every `slow_interval` seconds until the note requests are
+            done. """
+
+            while not done[0]:
+                yield [self.fetch('GET', slow_path), gen.sleep(slow_interval)]
+                slow_queries[0] += 1
+
+        slowing = slow() if slow_path else None
+        yield [worker() for _ in range(self.concurrency)]
+
+        done[0] = True
+        if slowing:
+            yield slowing
+
+        return latencies, slow_queries[0]
+
+# -------------------------------------------------------------------------------------------------
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--notes', type=int, default=100, help='Notes per user.')
+    parser.add_argument('--requests', type=int, default=1000, help='Note requests per run.')
+    parser.add_argument('--concurrency', type=int, default=10, help='Note requests in flight.')
+    parser.add_argument('--slow-seconds', type=float, default=0.5,
+                        help='Approximate duration of the slow query.')
+    parser.add_argument('--slow-interval', type=float, default=1.0,
+                        help='Seconds from the start of one slow query to the start of the next.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, starts the server in-process, and benchmarks note requests with no slow
+    query, and with one on the DB_EXECUTOR and on the IOLoop. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-slowquery-')
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir,
+                                                                                'slowquery.db')
+
+    try:
+        from .dataset import seed
+
+        users = seed(users=args.users, notebooks=1, notes=args.notes)
+        slow_query = make_slow_query(args.slow_seconds)
+
+        start = time()
+        slow_query()
+        print('The slow query takes {:.0f}ms.'.format(1000 * (time() - start)))
+
+        benchmark = SlowQueryBenchmark(start_server(make_handlers(slow_query)), users,
+                                       args.requests, args.concurrency, random_seed=args.seed)
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.run_sync(benchmark.authorize_users)
+
+        rows = list()
+        for name, slow_path in (('none', None),
+                                ('on the DB_EXECUTOR', EXECUTOR_PATH),
+                                ('on the IOLoop', IOLOOP_PATH)):
+            start = time()
+            run = partial(benchmark.run_notes, slow_path, args.slow_interval)
+            latencies, slow_queries = io_loop.run_sync(run)
+
+            rows.append((name, slow_queries, len(latencies) / (time() - start),
+                         1000 * percentile(latencies, 0.50), 1000 * percentile(latencies, 0.99),
+                         1000 * max(latencies)))
+
+        headers = ('Slow query', 'Slow queries run', 'Notes/s', 'p50 ms', 'p99 ms', 'Max ms')
+        print(tabulate(rows, headers=headers, floatfmt='.1f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
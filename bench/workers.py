@@ -0,0 +1,93 @@
+""" Benchmarks how throughput scales with the number of server worker processes. server.py is
+started with each --workers count in turn, as it's deployed, and a read-heavy route and a CPU-heavy
+one (a page of a notebook's notes, which is mostly serialization) are driven against it.
+
+Run from the repository root:
+
+    python -m bench.workers --workers=1,2,4 --requests=1000 --concurrency=20
+
+Each worker is a process of its own, so the scaling is bounded by the cores the machine has (the
+client shares them too, so leave it one spare).
+
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import tornado.ioloop
+from tabulate import tabulate
+
+from .routes import ROOT, RouteBenchmark, free_port, start_server, stop_server
+
+# -------------------------------------------------------------------------------------------------
+
+def parse_args(argv=None):
+    """ Parses the command line. """
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db-url', help='Database to seed and benchmark. Defaults to a '
+                                         'temporary SQLite file. Must be empty.')
+    parser.add_argument('--users', type=int, default=10, help='Number of users to seed.')
+    parser.add_argument('--notebooks', type=int, default=10, help='Notebooks per user.')
+    parser.add_argument('--notes', type=int, default=100, help='Notes per notebook.')
+    parser.add_argument('--workers', default='1,2,4',
+                        help='Comma separated numbers of server worker processes to benchmark.')
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per route.')
+    parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds a database, and benchmarks a server with each number of workers against it. """
+
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='cloudcache-workers-')
+
+    env = dict(os.environ)
+    env['CLOUDCACHE_DB_URL'] = args.db_url or 'sqlite:///' + os.path.join(workdir, 'workers.db')
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, os.path.join(ROOT, 'cloudCache')])
+
+    # the models read the database URL when they're first imported
+    os.environ['CLOUDCACHE_DB_URL'] = env['CLOUDCACHE_DB_URL']
+
+    try:
+        from .dataset import seed
+
+        users = seed(users=args.users, notebooks=args.notebooks, notes=args.notes)
+        print('{} cores.'.format(os.cpu_count()))
+
+        rows = list()
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            port = free_port()
+            server = start_server(port, workers, env)
+
+            try:
+                benchmark = RouteBenchmark('http://127.0.0.1:{}'.format(port), users,
+                                           args.requests, args.concurrency, random_seed=args.seed)
+
+                io_loop = tornado.ioloop.IOLoop.current()
+                io_loop.run_sync(benchmark.authorize_users)
+
+                for route, build in (('GET /notes/{note}', benchmark.get_note),
+                                     ('GET /notebooks/{notebook}/notes',
+                                      benchmark.notebook_path('/notes'))):
+                    result = io_loop.run_sync(lambda: benchmark.run_route(route, 'GET', build))
+                    rows.append((workers, route, result.requests, result.errors, result.rate,
+                                 result.mean_ms, result.max_ms))
+
+            finally:
+                stop_server(server)
+
+        headers = ('Workers', 'Route', 'Requests', 'Errors', 'Req/s', 'Mean ms', 'Max ms')
+        print(tabulate(rows, headers=headers, floatfmt='.1f'))
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+""" Module for compressing the cloudCache REST API's responses. """
+
+from tornado.escape import to_unicode, utf8
+from tornado.web import GZipContentEncoding
+
+# -------------------------------------------------------------------------------------------------
+
+class CompressResponse(GZipContentEncoding):
+    """ Output transform which gzips responses for clients which accept it. Passed to the
+    tornado.web.Application in place of the default transform enabled by `compress_response`.
+
+    Compared to the default transform, it also compresses newline-delimited JSON and MessagePack
+    responses, and leaves responses of fewer than MIN_LENGTH bytes alone, as they don't shrink by
+    enough to be worth the CPU time. Streamed responses are always compressed, as their length isn't
+    known when their first chunk is written. """
+
+    CONTENT_TYPES = GZipContentEncoding.CONTENT_TYPES | {'application/x-ndjson',
+                                                         'application/msgpack',
+                                                         'application/x-msgpack'}
+    MIN_LENGTH = 1024 # bytes
+
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        """ As GZipContentEncoding's, which adds Accept-Encoding to every response's Vary header,
+        but doesn't add it twice to a response which varies by it already, e.g. a note value
+        download (see NoteValueHandler). """
+
+        if 'Vary' in headers:
+            vary = [field.strip() for field in to_unicode(headers['Vary']).split(',')
+                    if field.strip() and field.strip().lower() != 'accept-encoding']
+
+            # kept as bytes, which the superclass appends bytes to
+            if vary:
+                headers['Vary'] = utf8(', '.join(vary))
+            else:
+                del headers['Vary']
+
+        return super().transform_first_chunk(status_code, headers, chunk, finishing)
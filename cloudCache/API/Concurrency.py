@@ -0,0 +1,79 @@
+""" Module for running blocking database work off of the cloudCache server's IOLoop thread. """
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudCache.Business.Config import get_setting
+from cloudCache.Business.Models import DB_SESSION as db, POOL_SIZE, POOL_OVERFLOW
+
+# -------------------------------------------------------------------------------------------------
+
+# Bounded to the size of the connection pool, so a worker thread never waits on a connection.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=POOL_SIZE + POOL_OVERFLOW)
+
+# For CPU-bound work, such as password hashing, which shouldn't tie up a DB_EXECUTOR thread and its
+# connection. hashlib releases the GIL while hashing, so its threads can use every core.
+CPU_EXECUTOR = ThreadPoolExecutor(max_workers=get_setting('server', 'cpu_workers',
+                                                          os.cpu_count() or 1, int))
+
+# The request handler each DB_EXECUTOR thread is currently working for, see current_handler
+_CURRENT = threading.local()
+
+# -------------------------------------------------------------------------------------------------
+
+def run_in_session(func, *args, **kwargs):
+    """ Calls `func`, and then removes the calling thread's database session, so the work gets a
+    session of its own and returns its connection to the pool when it's done. """
+
+    try:
+        return func(*args, **kwargs)
+
+    finally:
+        db.remove()
+
+
+def current_handler():
+    """ Returns the RequestHandler which the calling DB_EXECUTOR thread is working for, or `None` if
+    it isn't working for one (e.g. it's running a background task), or isn't a DB_EXECUTOR thread.
+    Used to attribute work, such as the statements issued, to the request which caused it. """
+
+    return getattr(_CURRENT, 'handler', None)
+
+
+def _run_for_handler(handler, func, *args, **kwargs):
+    """ Calls run_in_session, with `handler` as the thread's current handler. If the handler's
+    request is being profiled (it has a `profiler`, see cloudCache.API.Profiling), the call is run
+    under its profiler. """
+
+    _CURRENT.handler = handler
+    profiler = getattr(handler, 'profiler', None)
+
+    try:
+        if profiler is not None:
+            return profiler.runcall(run_in_session, func, *args, **kwargs)
+
+        return run_in_session(func, *args, **kwargs)
+
+    finally:
+        _CURRENT.handler = None
+
+
+def run_on_db_executor(func, *args, handler=None, **kwargs):
+    """ Runs `func` in its own database session on the DB_EXECUTOR thread pool, and returns a
+    Future which resolves to its result. Work done for a request should pass its `handler`, which
+    is then the current_handler while `func` runs.
+
+    The session is removed once `func` returns, so it should return plain data (e.g. serialized
+    models) rather than models to be read later, and it mustn't touch the handler's response,
+    which is only written on the IOLoop. """
+
+    return DB_EXECUTOR.submit(_run_for_handler, handler, func, *args, **kwargs)
+
+
+def run_on_cpu_executor(func, *args, **kwargs):
+    """ Runs `func` on the CPU_EXECUTOR thread pool, and returns a Future which resolves to its
+    result. `func` mustn't use the database. """
+
+    return CPU_EXECUTOR.submit(func, *args, **kwargs)
+
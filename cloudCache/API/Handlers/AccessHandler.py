@@ -1,7 +1,11 @@
 """ Module for the AccessHandler class in the cloudCache REST API. """
 
+from tornado import gen
+
 from . import AuthorizeHandler
 
+from cloudCache.API.Concurrency import run_on_db_executor
+
 from cloudCache.Business.Models.UserAccessToken import create_access_token
 from cloudCache.Business.Errors import InvalidApiKeyError, UserDoesntExistError
 
@@ -10,6 +14,7 @@ from cloudCache.Business.Errors import InvalidApiKeyError, UserDoesntExistError
 class AccessHandler(AuthorizeHandler):
     """ The request handler for creating and delivering cloudCache UserAccessTokens. """
 
+    @gen.coroutine
     def get(self, username, api_key):
         """ Handles creating an access token for a given username, if they submit the correct API
         key. If the key is invalid, or the user doesn't exist, and appropriate error message is
@@ -17,8 +22,9 @@ class AccessHandler(AuthorizeHandler):
         returned. """
 
         try:
-            token = create_access_token(username, api_key)
-            response = {'access token': token.to_ordered_dict()}
+            token = yield run_on_db_executor(_create_access_token, username, api_key,
+                                             handler=self)
+            response = {'access token': token}
 
         except UserDoesntExistError as e:
             self.set_status(404) # Not Found
@@ -28,4 +34,10 @@ class AccessHandler(AuthorizeHandler):
             self.set_status(401) # unauthenticated
             response = {'message': str(e)}
 
-        self.write(response)
+        self.respond(response)
+
+# -------------------------------------------------------------------------------------------------
+
+def _create_access_token(username, api_key):
+    """ Returns the OrderedDict representation of a new access token for a user. """
+    return create_access_token(username, api_key).to_ordered_dict()
@@ -1,17 +1,111 @@
+import datetime
+import email.utils
+import hashlib
+from time import time
+
 import arrow
 import tornado.web
+from mimeparse import quality
+from tornado import gen
+from tornado.iostream import StreamClosedError
+from tornado.log import app_log
+from cloudCache.API import Metrics, Profiling
+from cloudCache.API.Concurrency import run_on_db_executor
 from cloudCache.Business.Models import DB_SESSION as db, User, UserAccessToken
+from cloudCache.Business.Models.JsonMixin import encode_json
+from cloudCache.Business.Models.Notebook import get_notebook
+from cloudCache.Business.Errors import NotebookDoesntExistError
 from cloudCache.Business.Models.UserAccessToken import get_user_for_token
+from cloudCache.Business.Models.UserAccessToken import get_cached_user_for_token
+
+try:
+    # optional compact binary response format
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# -------------------------------------------------------------------------------------------------
+
+JSON_TYPE     = 'application/json'
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE     = 1000
+
+# Number of items fetched from the database and written out per chunk of a streamed response
+STREAM_BATCH_SIZE = 500
 
 # -------------------------------------------------------------------------------------------------
 
 class AuthorizeHandler(tornado.web.RequestHandler):
     """ Provides an 'authorize' interface to tornado.web.RequestHandler, which will authorize a
-    user for a cloudCache handler web request via access token and username. """
+    user for a cloudCache handler web request via access token and username.
+
+    Also manages the database session lifecycle, so that each request gets its own session. Handler
+    methods are coroutines on the IOLoop, which run their model calls on the DB executor (see
+    cloudCache.API.Concurrency), each in a session of its own on the worker thread, and get plain
+    data back. The response (its status, headers and body) is only ever written on the IOLoop.
+
+    Records each request's metrics (see cloudCache.API.Metrics): the statements its DB executor work
+    issues are counted in `request_metrics`, and its response bodies are encoded through `encode`,
+    which times them. Slow requests are logged, and a sample of requests is profiled, as configured
+    in cloudCache.API.Profiling. """
+
+
+    # number of requests which have started but not yet finished, so that the server can wait for
+    # them to complete when shutting down
+    in_flight = 0
+
+
+    def initialize(self):
+        """ Starts this request's metrics, and its profiler if it's in the profiled sample. Done
+        here rather than in `prepare`, which isn't called for requests rejected before reaching the
+        handler, e.g. for an unsupported method. """
+        self.request_metrics = Metrics.RequestMetrics(log_statements=Profiling.log_statements())
+        self.profiler = Profiling.start_profiler()
+
+        # the authorized user's ID and username, kept apart from `current_user`, which may be an ORM
+        # object that can't be read once the request's session is gone (e.g. in `on_finish`)
+        self.user_id  = None
+        self.username = None
+
+        # whether this request was counted in `in_flight`, which only happens once it reaches
+        # `prepare`, whereas `on_finish` is called for every request
+        self.counted_in_flight = False
+
 
+    def prepare(self):
+        """ Counts this request as in flight, and discards any database session left over on this
+        thread, so that this request starts with a fresh one. """
+        AuthorizeHandler.in_flight += 1
+        self.counted_in_flight = True
+        db.remove()
 
+
+    def on_finish(self):
+        """ Closes this request's database session, returning its connection to the pool and
+        discarding its identity map, and records the request's metrics, and its profile if it
+        was profiled. """
+        if self.counted_in_flight:
+            AuthorizeHandler.in_flight -= 1
+        db.remove()
+
+        seconds = self.request.request_time()
+        Metrics.observe_request(type(self).__name__, self.request.method, self.get_status(),
+                                seconds, self.request_metrics)
+
+        if Profiling.is_slow(seconds):
+            Profiling.log_slow_request(self, seconds, self.request_metrics)
+
+        if self.profiler is not None:
+            Profiling.dump_profile(self.profiler, self)
+
+
+    @gen.coroutine
     def authorize(self):
-        """ Check username and access token are provided, and that they're valid and have not expired. """
+        """ Check username and access token are provided, and that they're valid and have not
+        expired. A token which can be validated without the database (see
+        get_cached_user_for_token) is validated on the IOLoop, and any other on the DB executor. """
 
         message  = 'You are not authorized for this action. '
         message += 'Please check that you have supplied a username and access token, '
@@ -21,14 +115,341 @@ class AuthorizeHandler(tornado.web.RequestHandler):
 
         if not access_token:
             self.set_status(401) # unauthenticated
-            self.write({'message': message})
+            self.respond({'message': message})
             raise tornado.web.Finish()
 
-        user = get_user_for_token(access_token)
+        user = get_cached_user_for_token(access_token)
+
+        if not user:
+            user = yield run_on_db_executor(get_user_for_token, access_token, handler=self)
 
         if not user:
             self.set_status(401) # unauthenticated
-            self.write({'message': message})
+            self.respond({'message': message})
             raise tornado.web.Finish()
 
         self.current_user = user
+        self.user_id, self.username = user.id, user.username
+
+
+    def get_page_arguments(self, cursor=int):
+        """ Returns the (limit, after) keyset pagination arguments from the query string. `limit`
+        defaults to DEFAULT_PAGE_SIZE, and `after` (the `next` cursor from the previous page) to
+        `None`, meaning the first page. `cursor` is the type of the cursor, an int (an ID) unless
+        the listing is paginated by another column. Invalid arguments finish the request with a
+        400. """
+
+        try:
+            limit = int(self.get_argument('limit', DEFAULT_PAGE_SIZE))
+            after = self.get_argument('after', None)
+            after = None if after is None else cursor(after)
+
+            if not 0 < limit <= MAX_PAGE_SIZE:
+                raise ValueError()
+
+        except ValueError:
+            message  = 'Invalid pagination arguments. `limit` must be an integer from 1 to {}, '
+            message += 'and `after` must be the `next` cursor from a previous page.'
+            self.set_status(400) # Bad Request
+            self.respond({'message': message.format(MAX_PAGE_SIZE)})
+            raise tornado.web.Finish()
+
+        return limit, after
+
+
+    def is_streaming(self):
+        """ Returns whether the caller asked for a listing to be streamed in full, rather than
+        returned a page at a time. """
+
+        return self.get_argument('stream', 'false').lower() in ('1', 'true')
+
+
+    @gen.coroutine
+    def get_authorized_notebook(self, notebook_id):
+        """ Authorizes the request, and returns the notebook that it's for, loaded on the DB
+        executor. The notebook is detached from its session by then, so only its columns can be
+        read. If the notebook ID is invalid, or the user doesn't have a notebook with that ID, the
+        request is finished with an appropriate error message. """
+
+        yield self.authorize()
+
+        try:
+            # will raise ValueError if the notebook_id isn't parseable as an int
+            int(notebook_id)
+
+            notebook = yield run_on_db_executor(get_notebook, notebook_id, self.current_user,
+                                                handler=self)
+            return notebook
+
+        except NotebookDoesntExistError as e:
+            self.set_status(404) # Not Found
+            app_log.debug('Notebook lookup for %s failed: %s', self.username, e)
+            response = {'message': str(e)}
+
+        except ValueError:
+            self.set_status(400) # Bad Request
+            message = 'Invalid notebook argument. '
+            message += 'You must supply the notebook ID, not the notebook name.'
+            response = {'message': message}
+
+        self.respond(response)
+        raise tornado.web.Finish()
+
+
+    @gen.coroutine
+    def stream_json(self, head, key, fetch_page):
+        """ Streams a JSON object made up of the items in `head`, plus `key` mapped to an array of
+        every item produced by `fetch_page`. The array is built in batches of STREAM_BATCH_SIZE
+        items, each written and flushed to the client before the next is fetched, so only one batch
+        is held in memory no matter how large the listing is.
+
+        Args:
+            head (dict): Items written before the array. Must be JSON serializable.
+            key (string): The key of the array.
+            fetch_page (callable): Called on the DB executor as fetch_page(limit, after), and
+                returns a list of JSON-serializable items and the cursor for the next call (`None`
+                after the last batch), like the get_*_page model functions.
+
+        """
+
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+
+        opening = self.encode(encode_json, head)[:-1]
+        if head:
+            opening += b','
+        self.write(opening + encode_json(key) + b':[')
+
+        written = yield self._write_batches(fetch_page, b',')
+
+        if written is not None:
+            self.write(b']}')
+
+
+    @gen.coroutine
+    def stream_ndjson(self, fetch_page, prepare_batch=None):
+        """ Streams every item produced by `fetch_page` as newline-delimited JSON, one item per
+        line, in the same batched way as `stream_json`. If given, `prepare_batch` is a coroutine
+        called on the IOLoop with each batch's list of items before they're written, which may
+        complete the items in place, e.g. with data read on the executors. """
+
+        self.set_header('Content-Type', 'application/x-ndjson; charset=UTF-8')
+
+        written = yield self._write_batches(fetch_page, b'\n', prepare_batch)
+
+        if written:
+            self.write(b'\n')
+
+
+    @gen.coroutine
+    def _write_batches(self, fetch_page, separator, prepare_batch=None):
+        """ Fetches batches from `fetch_page` on the DB executor until it runs out, writing the
+        items of each batch (once `prepare_batch` has been yielded for them, if given) as JSON
+        joined by `separator`, and flushing them to the client before the next batch is fetched.
+        Returns the number of items written, or `None` if the client went away part way
+        through. """
+
+        after, leading, written = None, b'', 0
+
+        try:
+            while True:
+                items, after = yield run_on_db_executor(fetch_page, STREAM_BATCH_SIZE, after,
+                                                        handler=self)
+
+                if items and prepare_batch is not None:
+                    yield prepare_batch(items)
+
+                if items:
+                    self.write(leading + self.encode(_join_json, items, separator))
+                    leading  = separator
+                    written += len(items)
+
+                if after is None:
+                    break
+
+                yield self.flush()
+
+        except StreamClosedError:
+            # the client went away mid-stream, there's nobody left to write the rest to
+            return None
+
+        return written
+
+
+    def should_return_304(self, etag, last_modified=None):
+        """ Sets the ETag and Last-Modified validators of the response, and returns whether the
+        request's If-None-Match (or failing that, If-Modified-Since) header shows that the client
+        already has this version of the resource. Handlers check this before building the response
+        body, and respond with a bare 304 if it's true, so an unchanged resource is never loaded.
+
+        Args:
+            etag (string): The resource's quoted entity tag, e.g. from make_etag.
+            last_modified (datetime): When the resource was last modified, as a naive UTC datetime,
+                or `None` if it isn't known.
+
+        """
+
+        self.set_header('Etag', etag)
+        if last_modified is not None:
+            self.set_header('Last-Modified', last_modified)
+
+        # If-None-Match takes precedence over If-Modified-Since when both are sent (RFC 7232)
+        if self.request.headers.get('If-None-Match') is not None:
+            return self.check_etag_header()
+
+        ims_value = self.request.headers.get('If-Modified-Since')
+        if ims_value is not None and last_modified is not None:
+            date_tuple = email.utils.parsedate(ims_value)
+            if date_tuple is not None:
+                # HTTP dates only have a resolution of one second
+                if_since = datetime.datetime(*date_tuple[:6])
+                return if_since >= last_modified.replace(microsecond=0)
+
+        return False
+
+
+    def get_if_match_versions(self, resource_id):
+        """ Returns the versions of a versioned resource which the request's If-Match header names
+        (see parse_version_etags), or `None` if it has no If-Match header, or it's `*`. Returns an
+        empty list if it names no version of the resource, in which case no version can match. """
+
+        if_match = self.request.headers.get('If-Match')
+        return None if if_match is None else parse_version_etags(if_match, resource_id)
+
+
+    def not_modified(self):
+        """ Finishes the request with a 304 Not Modified, and no body. """
+
+        self.set_status(304) # Not Modified
+        raise tornado.web.Finish()
+
+
+    def get_response_type(self):
+        """ Returns the media type that `respond` will encode the response as: a MessagePack type if
+        the msgpack package is installed and the request's Accept header prefers it to JSON, and
+        JSON otherwise (including when there's no Accept header at all). """
+
+        accept = self.request.headers.get('Accept')
+
+        if not accept or msgpack is None:
+            return JSON_TYPE
+
+        best_quality, best_type = quality(JSON_TYPE, accept), JSON_TYPE
+        for media_type in MSGPACK_TYPES:
+            if quality(media_type, accept) > best_quality:
+                best_quality, best_type = quality(media_type, accept), media_type
+
+        return best_type
+
+
+    def accepts_encoding(self, coding):
+        """ Returns whether the request's Accept-Encoding header accepts a content-coding, e.g.
+        'deflate', with a q-value above 0, whether by name or by `*`. A malformed header accepts
+        nothing but the identity coding, which is always sent unless a coding is accepted. """
+
+        accept_encoding = self.request.headers.get('Accept-Encoding')
+
+        if not accept_encoding:
+            return False
+
+        # mimeparse only parses media types, so the codings (which are case-insensitive) are parsed
+        # as subtypes of a made-up type, which keeps its precedence of a named coding over `*`
+        ranges = ','.join('coding/' + coding_range.strip()
+                          for coding_range in accept_encoding.lower().split(',')
+                          if coding_range.strip())
+
+        try:
+            return quality('coding/' + coding, ranges) > 0
+
+        except ValueError:
+            return False
+
+
+    def respond(self, obj):
+        """ Writes `obj` to the response in the format negotiated by `get_response_type`: compact
+        JSON (see write_json) or MessagePack. Every handler responds through here, apart from
+        streamed responses, which are always JSON. """
+
+        self.set_header('Vary', 'Accept')
+        response_type = self.get_response_type()
+
+        if response_type == JSON_TYPE:
+            self.write_json(obj)
+
+        else:
+            self.set_header('Content-Type', response_type)
+            self.write(self.encode(msgpack.packb, obj, use_bin_type=True))
+
+
+    def write_json(self, obj):
+        """ Writes `obj` to the response as JSON, encoded by the fast path in JsonMixin rather than
+        by tornado's json_encode. """
+
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(self.encode(encode_json, obj))
+
+
+    def encode(self, encoder, *args, **kwargs):
+        """ Returns `encoder(*args, **kwargs)`, adding the time it took to this request's
+        serialization time. """
+
+        started = time()
+
+        try:
+            return encoder(*args, **kwargs)
+
+        finally:
+            self.request_metrics.serialization_seconds += time() - started
+
+# -------------------------------------------------------------------------------------------------
+
+Metrics.register_gauge('cloudcache_requests_in_flight', 'Requests started but not yet finished.',
+                       lambda: [({}, AuthorizeHandler.in_flight)])
+
+# -------------------------------------------------------------------------------------------------
+
+def _join_json(items, separator):
+    """ Returns the JSON encodings of `items`, joined by `separator`. """
+    return separator.join(encode_json(item) for item in items)
+
+
+def make_etag(*parts):
+    """ Returns a quoted entity tag which identifies a version of a resource, built from the values
+    (e.g. an ID, a modification time and the query arguments) which determine its content. """
+
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def make_version_etag(resource_id, version, response_type, content_coding=None):
+    """ Returns a quoted entity tag for a version of a versioned resource (e.g. a note) in one of
+    the response types, and optionally a content-coding (e.g. 'deflate') other than identity, which
+    makes it a different representation with a tag of its own. Unlike make_etag's, the resource's ID
+    and version can be read back out of it with parse_version_etags, so a client can make an update
+    conditional on the version it has by sending the tag back in an If-Match header. """
+
+    # e.g. 'json' for application/json, 'msgpack' for application/x-msgpack
+    type_name = response_type.rsplit('/', 1)[-1].replace('x-', '')
+    if content_coding is not None:
+        type_name += '+' + content_coding
+
+    return '"{}.{}.{}"'.format(resource_id, version, type_name)
+
+
+def parse_version_etags(header, resource_id):
+    """ Returns the versions of a resource named by the entity tags in an If-Match header, from
+    tags made by make_version_etag in any response type. Weak tags, and tags for other resources
+    or not made by make_version_etag, can't match and are ignored. Returns `None` if the header is
+    `*`, which matches any version. """
+
+    if header.strip() == '*':
+        return None
+
+    versions = list()
+
+    for etag in header.split(','):
+        parts = etag.strip().strip('"').split('.')
+
+        if len(parts) == 3 and parts[0] == str(resource_id) and parts[1].isdigit():
+            versions.append(int(parts[1]))
+
+    return versions
@@ -0,0 +1,149 @@
+""" Module for the BulkNotesHandler class in the cloudCache REST API. """
+
+from functools import partial
+
+from tornado import gen
+from tornado.escape import json_decode
+from tornado.log import app_log
+
+from . import AuthorizeHandler
+
+from cloudCache.API.Concurrency import run_on_db_executor, run_on_cpu_executor
+
+from cloudCache.Business.Models.Note import import_notes, export_notes_page
+from cloudCache.Business.Models.NoteValue import ChunkedValue, ValueReader, ValueDecompressor
+from cloudCache.Business.Errors import NoteAlreadyExistsError, NoteVersionMismatchError
+
+# -------------------------------------------------------------------------------------------------
+
+MAX_IMPORT_NOTES = 100000
+
+# -------------------------------------------------------------------------------------------------
+
+# /notebooks/{notebook}/notes/bulk
+
+class BulkNotesHandler(AuthorizeHandler):
+    """ The request handler for importing and exporting many cloudCache notes at once. """
+
+    @gen.coroutine
+    def get(self, **kwargs):
+        """ Implements the HTTP GET call on /notebooks/{notebook}/notes/bulk. Streams every note in
+        the notebook as newline-delimited JSON, one note per line, in the format accepted by POST:
+
+        {"note_key": "My awesome note", "note_value": "The contents of my awesome note"}
+
+        Values of any size are exported in full. A value uploaded as raw bytes which aren't UTF-8
+        text (see NoteValueHandler) is exported with its undecodable bytes replaced by U+FFFD. """
+
+        notebook = yield self.get_authorized_notebook(kwargs.get('notebook'))
+
+        try:
+            yield self.stream_ndjson(partial(export_notes_page, notebook),
+                                     self._read_chunked_values)
+
+        except NoteVersionMismatchError as error:
+            # the response has already started, so the only way to tell the client that it's
+            # incomplete is to end it without finishing it
+            app_log.info('Aborted export: %s', error)
+            self.request.connection.close()
+
+
+    @gen.coroutine
+    def post(self, **kwargs):
+        """ Implements the HTTP POST call on /notebooks/{notebook}/notes/bulk. The user must provide
+        an HTTP body of the type application/json, with a list of notes in the following format:
+
+        [
+            {"note_key": "My awesome note", "note_value": "The contents of my awesome note"},
+            {"note_key": "My other note", "note_value": "The contents of my other note"}
+        ]
+
+        or of the type application/x-ndjson, with one such note per line.
+
+        Returns a result for each note, in order, with its key, its status ('created', 'exists',
+        'duplicate' or 'invalid') and, if it was created, its note ID. """
+
+        notebook = yield self.get_authorized_notebook(kwargs.get('notebook'))
+
+        try:
+            notes = self._parse_notes()
+
+            if len(notes) > MAX_IMPORT_NOTES:
+                raise ValueError()
+
+            # only well-formed notes are imported, the rest are reported as invalid in place
+            items    = [(n['note_key'], n['note_value']) for n in notes if _is_valid(n)]
+            imported = yield run_on_db_executor(import_notes, notebook, items, handler=self)
+            imported = iter(imported)
+
+            results = list()
+            for note in notes:
+                if _is_valid(note):
+                    results.append(next(imported))
+                else:
+                    key = note.get('note_key') if isinstance(note, dict) else None
+                    results.append({'key': key, 'status': 'invalid'})
+
+            response = {'results': results}
+
+        except NoteAlreadyExistsError as e:
+            self.set_status(409) # Conflict
+            response = {'message': str(e)}
+
+        except ValueError:
+            self.set_status(400) # Bad Request
+            message  = 'Invalid POST body. Must be a JSON list (or newline-delimited JSON) of at '
+            message += 'most {} notes.'.format(MAX_IMPORT_NOTES)
+            response = {'message': message}
+
+        self.respond(response)
+
+
+    @gen.coroutine
+    def _read_chunked_values(self, notes):
+        """ Replaces the NoteValue.ChunkedValue of each exported note whose value is stored in
+        chunks with the value itself, reading its chunks on the DB executor and decompressing them
+        on the CPU executor, as NoteValueHandler.get does. """
+
+        for note in notes:
+            chunked = note['note_value']
+            if not isinstance(chunked, ChunkedValue):
+                continue
+
+            reader = ValueReader(chunked.note_id, chunked.version)
+            decompressor = ValueDecompressor(chunked.encoding)
+            pieces = list()
+
+            while not reader.done:
+                data = yield run_on_db_executor(reader.read, handler=self)
+                pieces.append((yield run_on_cpu_executor(decompressor.decompress, data,
+                                                         final=reader.done)))
+
+            note['note_value'] = b''.join(pieces).decode('utf-8', errors='replace')
+
+
+    def _parse_notes(self):
+        """ Returns the list of notes in the request body. Raises ValueError if the body isn't a
+        JSON list, or newline-delimited JSON. """
+
+        content_type = self.request.headers.get('Content-Type', '')
+
+        if content_type.startswith('application/x-ndjson'):
+            lines = self.request.body.decode('utf-8').splitlines()
+            return [json_decode(line) for line in lines if line.strip()]
+
+        notes = json_decode(self.request.body)
+        if not isinstance(notes, list):
+            raise ValueError()
+
+        return notes
+
+# -------------------------------------------------------------------------------------------------
+
+def _is_valid(note):
+    """ Returns whether an imported note has a string key and value. """
+
+    if not isinstance(note, dict):
+        return False
+
+    return isinstance(note.get('note_key'), str) and isinstance(note.get('note_value'), str)
@@ -0,0 +1,20 @@
+""" Module for the MetricsHandler class in the cloudCache REST API. """
+
+import tornado.web
+from cloudCache.API import Metrics
+
+# -------------------------------------------------------------------------------------------------
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """ Serves the server's metrics in the Prometheus text exposition format (see
+    cloudCache.API.Metrics). Not an AuthorizeHandler: scrapers don't hold access tokens, and scrapes
+    aren't counted among the API's requests. For that reason the endpoint is only served if the
+    `metrics.enabled` setting turns it on, which should only be done where the server can't be
+    reached from outside, or /metrics is blocked in front of it. """
+
+
+    def get(self):
+        """ Returns the current value of every metric. """
+
+        self.set_header('Content-Type', Metrics.CONTENT_TYPE)
+        self.write(Metrics.render())
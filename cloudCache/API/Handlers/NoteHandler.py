@@ -1,11 +1,17 @@
 """ Module for the Notes class in the cloudCache REST API. """
 
+from tornado import gen
 from tornado.escape import json_decode
 
 from . import AuthorizeHandler
+from .AuthorizeHandler import make_version_etag
 
-from cloudCache.Business.Models.Note import get_note, delete_note
-from cloudCache.Business.Errors import NoteDoesntExistError
+from cloudCache.API.Concurrency import run_on_db_executor
+
+from cloudCache.Business.Models.Note import get_note_dict, get_note_dicts, delete_note
+from cloudCache.Business.Models.Note import update_note, MAX_NOTES_PER_LOOKUP
+from cloudCache.Business.Errors import NoteDoesntExistError, NoteAlreadyExistsError
+from cloudCache.Business.Errors import NoteVersionMismatchError
 
 # -------------------------------------------------------------------------------------------------
 
@@ -14,17 +20,37 @@ from cloudCache.Business.Errors import NoteDoesntExistError
 class NoteHandler(AuthorizeHandler):
     """ The request handler for managing individual cloudCache notes. """
 
+    @gen.coroutine
     def get(self, **kwargs):
-        """ Implements the HTTP GET call on /notes/{note}. """
-        self.authorize()
+        """ Implements the HTTP GET call on /notes/{note}. Responds with a 304 if the client already
+        has the current version of the note (see AuthorizeHandler.should_return_304).
+
+        Without a note, e.g. /notes/?id=1&id=2 (or /notes/?id=1,2), responds with the notes with
+        the given IDs all at once, along with the IDs which don't exist:
+
+        {
+            "notes": [{"key": "a", "value": "...", "id": 1, ...}],
+            "missing": [2]
+        }
+
+        """
+        yield self.authorize()
 
         note_id = kwargs.get('note')
 
+        if note_id is None:
+            yield self._get_many()
+            return
+
         try:
             # will raise ValueError if the note_id isn't parseable as an int
-            int(note_id)
-            note = get_note(note_id, self.current_user)
-            response = note.to_ordered_dict()
+            response, last_modified = yield run_on_db_executor(get_note_dict, note_id,
+                                                               self.current_user, handler=self)
+
+            etag = make_version_etag(response['id'], response['version'],
+                                     self.get_response_type())
+            if self.should_return_304(etag, last_modified):
+                self.not_modified()
 
         except NoteDoesntExistError as error:
             self.set_status(404)  # Not Found
@@ -36,19 +62,137 @@ class NoteHandler(AuthorizeHandler):
             message += 'You must supply the note ID, not the note name.'
             response = {'message': message}
 
-        self.write(response)
+        self.respond(response)
+
+
+    @gen.coroutine
+    def _get_many(self):
+        """ Writes the notes with the IDs given by the `id` arguments, looked up all at once. """
+
+        try:
+            note_ids = [int(note_id) for argument in self.get_arguments('id')
+                        for note_id in argument.split(',')]
+
+            if not 0 < len(note_ids) <= MAX_NOTES_PER_LOOKUP:
+                raise ValueError()
+
+            notes, missing = yield run_on_db_executor(get_note_dicts, note_ids, self.current_user,
+                                                      handler=self)
+            response = {'notes': notes, 'missing': missing}
+
+        except ValueError:
+            self.set_status(400) # Bad Request
+            message  = 'Invalid id arguments. You must supply from 1 to {} note IDs, '
+            message += 'e.g. ?id=1&id=2 or ?id=1,2.'
+            response = {'message': message.format(MAX_NOTES_PER_LOOKUP)}
+
+        self.respond(response)
+
+
+    @gen.coroutine
+    def put(self, **kwargs):
+        """ Implements the HTTP PUT call on /notes/{note}, which replaces a note's key and value in
+        place, keeping its ID. The user must provide an HTTP body of the type application/json,
+        with the following format:
+
+        {
+            'note_key': 'My awesome note',
+            'note_value': 'The new contents of my awesome note'
+        }
+
+        See `_update` for the response, and for making the update conditional with If-Match. """
+
+        yield self._update(kwargs.get('note'), ('note_key', 'note_value'))
+
+
+    @gen.coroutine
+    def patch(self, **kwargs):
+        """ Implements the HTTP PATCH call on /notes/{note}, which changes a note's key or value (or
+        both) in place, keeping its ID. The user must provide an HTTP body of the type
+        application/json, with either or both of `note_key` and `note_value`, e.g.
+
+        {
+            'note_value': 'The new contents of my awesome note'
+        }
+
+        See `_update` for the response, and for making the update conditional with If-Match. """
 
+        yield self._update(kwargs.get('note'), ())
 
+
+    @gen.coroutine
+    def _update(self, note_id, required):
+        """ Updates a note with the `note_key` and `note_value` in the request body, which must
+        include the fields in `required`, and at least one of them, as strings (a field which isn't
+        required may be null, which leaves it unchanged). Returns the note's ID and new version, and
+        its new ETag in the ETag header.
+
+        If the request has an If-Match header with the ETag of the version of the note the client
+        last read (from GET /notes/{note}, or a previous update), the note is only updated if it's
+        still at that version, and otherwise the response is a 412, so that concurrent updates
+        can't silently overwrite each other. """
+        yield self.authorize()
+
+        try:
+            # will raise ValueError if the note_id isn't parseable as an int (or is missing)
+            note_id = int(note_id or '')
+            info    = json_decode(self.request.body)
+
+            note_key   = info.get('note_key')
+            note_value = info.get('note_value')
+
+            # a required field which is missing or null isn't a string either
+            fields = (('note_key', note_key), ('note_value', note_value))
+            invalid_field = any(not isinstance(value, str) for field, value in fields
+                                if field in required or value is not None)
+
+            if invalid_field or (note_key is None and note_value is None):
+                raise ValueError()
+
+            versions = self.get_if_match_versions(note_id)
+            if versions == []:
+                raise NoteVersionMismatchError("The If-Match header doesn't name a version of the "
+                                               "note with ID '{}'.".format(note_id))
+
+            version  = yield run_on_db_executor(update_note, note_id, self.current_user,
+                                                key=note_key, value=note_value, versions=versions,
+                                                handler=self)
+            response = {'note_id': note_id, 'version': version}
+
+            self.set_header('Etag', make_version_etag(note_id, version, self.get_response_type()))
+
+        except NoteDoesntExistError as error:
+            self.set_status(404) # Not Found
+            response = {'message': str(error)}
+
+        except NoteVersionMismatchError as error:
+            self.set_status(412) # Precondition Failed
+            response = {'message': str(error)}
+
+        except NoteAlreadyExistsError as error:
+            self.set_status(409) # Conflict
+            response = {'message': str(error)}
+
+        except (ValueError, AttributeError):
+            self.set_status(400) # Bad Request
+            message  = 'Invalid note ID or body. You must supply the note ID, and a body with '
+            message += 'note_key and note_value as strings (PUT), or either of them (PATCH).'
+            response = {'message': message}
+
+        self.respond(response)
+
+
+    @gen.coroutine
     def delete(self, **kwargs):
         """ Implements the HTTP DELETE call on /notes/{note}. """
-        self.authorize()
+        yield self.authorize()
 
         note_id = kwargs.get('note')
 
         try:
-            # will raise ValueError if the note_id isn't parseable as an int
-            int(note_id)
-            delete_note(note_id, self.current_user)
+            # will raise ValueError if the note_id isn't parseable as an int (or is missing)
+            int(note_id or '')
+            yield run_on_db_executor(delete_note, note_id, self.current_user, handler=self)
             response = {'message': 'Success'}
 
         except NoteDoesntExistError as error:
@@ -61,4 +205,4 @@ class NoteHandler(AuthorizeHandler):
             message += 'You must supply the note ID, not the note name.'
             response = {'message': message}
 
-        self.write(response)
\ No newline at end of file
+        self.respond(response)
\ No newline at end of file
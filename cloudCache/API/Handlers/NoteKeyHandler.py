@@ -0,0 +1,52 @@
+""" Module for the NoteKeyHandler class in the cloudCache REST API. """
+
+from tornado import gen
+
+from . import AuthorizeHandler
+from .AuthorizeHandler import make_version_etag
+
+from cloudCache.API.Concurrency import run_on_db_executor
+
+from cloudCache.Business.Models.Note import get_note_by_key
+from cloudCache.Business.Errors import NoteDoesntExistError
+
+# -------------------------------------------------------------------------------------------------
+
+# /notebooks/{notebook}/keys/{key}
+
+class NoteKeyHandler(AuthorizeHandler):
+    """ The request handler for looking up cloudCache notes by their notebook and key, for clients
+    which know a note's key but not its ID. """
+
+    @gen.coroutine
+    def get(self, **kwargs):
+        """ Implements the HTTP GET call on /notebooks/{notebook}/keys/{key}. The key is URL-encoded
+        in the path, e.g. /notebooks/1/keys/Shopping%20list. Responds with the note, as GET
+        /notes/{note} does, including a 304 if the client already has its current version (see
+        AuthorizeHandler.should_return_304). """
+        yield self.authorize()
+
+        try:
+            response, last_modified = yield run_on_db_executor(
+                _get_note_dict_by_key, int(kwargs.get('notebook')), kwargs.get('key'),
+                self.current_user, handler=self)
+
+            etag = make_version_etag(response['id'], response['version'],
+                                     self.get_response_type())
+            if self.should_return_304(etag, last_modified):
+                self.not_modified()
+
+        except NoteDoesntExistError as error:
+            self.set_status(404)  # Not Found
+            response = {'message': str(error)}
+
+        self.respond(response)
+
+# -------------------------------------------------------------------------------------------------
+
+def _get_note_dict_by_key(notebook_id, key, user):
+    """ Returns the OrderedDict representation of the note with a key in a user's notebook, and its
+    last_updated time as a naive UTC datetime. """
+
+    note = get_note_by_key(notebook_id, key, user)
+    return note.to_ordered_dict(), note.last_updated.to('utc').naive
@@ -0,0 +1,236 @@
+""" Module for the NoteValueHandler class in the cloudCache REST API. """
+
+import tornado.web
+from tornado import gen
+from tornado.iostream import StreamClosedError
+from tornado.log import app_log
+
+from . import AuthorizeHandler
+from .AuthorizeHandler import make_version_etag
+
+from cloudCache.API.Concurrency import run_on_db_executor, run_on_cpu_executor
+
+from cloudCache.Business.Models.Note import get_note, upload_note_value
+from cloudCache.Business.Models.NoteValue import ValueReader, ValueDecompressor, ValueUpload, \
+                                                 prepare_upload, MAX_VALUE_BYTES, ZLIB
+from cloudCache.Business.Errors import NoteDoesntExistError, NoteVersionMismatchError
+
+# -------------------------------------------------------------------------------------------------
+
+VALUE_TYPE = 'application/octet-stream'
+
+# -------------------------------------------------------------------------------------------------
+
+# /notes/{note}/value
+
+@tornado.web.stream_request_body
+class NoteValueHandler(AuthorizeHandler):
+    """ The request handler for downloading and uploading the values of cloudCache notes as raw
+    bytes. Unlike the JSON routes, it streams values of any size (up to MAX_VALUE_BYTES) in both
+    directions, without holding them in memory as a whole: an uploaded value is spooled as it
+    arrives (see NoteValue.ValueUpload), rather than buffered in `self.request.body`, and a
+    downloaded value is written out a few chunks at a time.
+
+    Values are compressed and decompressed on the CPU executor, and only their chunks are written
+    and read on the DB executor, so a large value doesn't hold a DB thread and its connection while
+    it's being (de)compressed. """
+
+    def initialize(self):
+        """ Starts with no upload, see `prepare`. """
+        super().initialize()
+        self.upload = None
+
+
+    @gen.coroutine
+    def prepare(self):
+        """ Before the body of a PUT arrives, authorizes the request, and checks that the note
+        exists for the user and that the body isn't too large, so that an upload which would be
+        rejected isn't received first. Then starts spooling the upload. """
+
+        super().prepare()
+
+        if self.request.method != 'PUT':
+            return
+
+        yield self._check_upload(self.path_kwargs.get('note'))
+
+        # in place of the server's limit, enforced on the body as it arrives, however it's sent
+        self.request.connection.set_max_body_size(MAX_VALUE_BYTES)
+        self.upload = ValueUpload()
+
+
+    def data_received(self, chunk):
+        """ Spools a piece of an uploaded value. """
+
+        if self.upload is not None:
+            self.upload.write(chunk)
+
+
+    def on_finish(self):
+        """ Discards the spooled upload, if there is one. """
+
+        super().on_finish()
+
+        if self.upload is not None:
+            self.upload.close()
+
+
+    @gen.coroutine
+    def get(self, **kwargs):
+        """ Implements the HTTP GET call on /notes/{note}/value. Streams the note's value as
+        application/octet-stream, however large it is (a string value is UTF-8 encoded). Responds
+        with a 304 if the client already has the current version of the value (see
+        AuthorizeHandler.should_return_304).
+
+        A value stored compressed with zlib is sent as it's stored, with the deflate
+        Content-Encoding, to clients which accept it, so it isn't decompressed at all. The deflate
+        and identity representations have different ETags. """
+
+        note = yield self._get_authorized_note(kwargs.get('note'))
+        note_id, version, value, encoding, last_modified = note
+
+        raw = encoding == ZLIB and self.accepts_encoding('deflate')
+        content_coding = 'deflate' if raw else None
+
+        self.set_header('Vary', 'Accept-Encoding')
+
+        etag = make_version_etag(note_id, version, VALUE_TYPE, content_coding)
+        if self.should_return_304(etag, last_modified):
+            self.not_modified()
+
+        self.set_header('Content-Type', VALUE_TYPE)
+
+        if encoding is None:
+            self.write((value or '').encode('utf-8'))
+            return
+
+        if raw:
+            self.set_header('Content-Encoding', content_coding)
+
+        reader = ValueReader(note_id, version)
+        decompressor = None if raw else ValueDecompressor(encoding)
+
+        try:
+            while not reader.done:
+                data = yield run_on_db_executor(reader.read, handler=self)
+
+                if decompressor is not None:
+                    data = yield run_on_cpu_executor(decompressor.decompress, data,
+                                                     final=reader.done)
+
+                if data:
+                    self.write(data)
+                    yield self.flush()
+
+        except StreamClosedError:
+            # the client went away mid-stream, there's nobody left to write the rest to
+            return
+
+        except NoteVersionMismatchError as error:
+            # the response has already started, so the only way to tell the client that it's
+            # incomplete is to end it without finishing it
+            app_log.info('Aborted download: %s', error)
+            self.request.connection.close()
+
+
+    @gen.coroutine
+    def put(self, **kwargs):
+        """ Implements the HTTP PUT call on /notes/{note}/value, which replaces the note's value
+        with the request body, as raw bytes of any type, keeping the note's ID. The body is
+        streamed in, so it can be as large as MAX_VALUE_BYTES.
+
+        Returns the note's ID, new version, and the value's size and SHA-256 hash, and the note's
+        new ETag in the ETag header. As with PUT /notes/{note}, If-Match makes the update
+        conditional on the note still being at the version the client last read. """
+
+        # `prepare` has already checked that the note ID is valid
+        note_id  = int(kwargs.get('note'))
+        prepared = yield run_on_cpu_executor(prepare_upload, self.upload)
+
+        try:
+            yield self._store_upload(note_id, prepared)
+
+        finally:
+            prepared.source.close()
+
+
+    @gen.coroutine
+    def _store_upload(self, note_id, prepared):
+        """ Stores a compressed upload as a note's value, and responds as described by `put`. """
+
+        try:
+            versions = self.get_if_match_versions(note_id)
+            if versions == []:
+                raise NoteVersionMismatchError("The If-Match header doesn't name a version of the "
+                                               "note with ID '{}'.".format(note_id))
+
+            version  = yield run_on_db_executor(upload_note_value, note_id, self.current_user,
+                                                prepared, versions=versions, handler=self)
+            response = {'note_id': note_id, 'version': version, 'value_size': self.upload.size,
+                        'value_hash': self.upload.hexdigest()}
+
+            self.set_header('Etag', make_version_etag(note_id, version, self.get_response_type()))
+
+        except NoteDoesntExistError as error:
+            self.set_status(404) # Not Found
+            response = {'message': str(error)}
+
+        except NoteVersionMismatchError as error:
+            self.set_status(412) # Precondition Failed
+            response = {'message': str(error)}
+
+        self.respond(response)
+
+
+    @gen.coroutine
+    def _check_upload(self, note_id):
+        """ Authorizes an upload to a note, finishing the request with an error if the note doesn't
+        exist for the user, or the body's declared length is too large. """
+
+        yield self._get_authorized_note(note_id)
+
+        length = self.request.headers.get('Content-Length')
+
+        if length is not None and length.isdigit() and int(length) > MAX_VALUE_BYTES:
+            self.set_status(413) # Payload Too Large
+            message = 'The value is too large. Values can be at most {} bytes.'
+            self.respond({'message': message.format(MAX_VALUE_BYTES)})
+            raise tornado.web.Finish()
+
+
+    @gen.coroutine
+    def _get_authorized_note(self, note_id):
+        """ Authorizes the request, and returns the ID, version, inline value, value encoding and
+        last modified time of the note that it's for. If the note ID is invalid, or the user doesn't
+        have a note with that ID, the request is finished with an appropriate error message. """
+
+        yield self.authorize()
+
+        try:
+            # will raise ValueError if the note_id isn't parseable as an int
+            note = yield run_on_db_executor(_get_note_state, int(note_id), self.current_user,
+                                            handler=self)
+            return note
+
+        except NoteDoesntExistError as error:
+            self.set_status(404) # Not Found
+            response = {'message': str(error)}
+
+        except ValueError:
+            self.set_status(400) # Bad Request
+            message = 'Invalid note argument. '
+            message += 'You must supply the note ID, not the note name.'
+            response = {'message': message}
+
+        self.respond(response)
+        raise tornado.web.Finish()
+
+# -------------------------------------------------------------------------------------------------
+
+def _get_note_state(note_id, user):
+    """ Returns a user's note's ID, version, inline value, value encoding and last modified time
+    (as a naive UTC datetime). """
+
+    note = get_note(note_id, user)
+    return note.id, note.version, note.value, note.value_encoding, \
+           note.last_updated.to('utc').naive
@@ -1,11 +1,13 @@
 """ Module for the NotebookHandler class in the cloudCache REST API. """
 
+from tornado import gen
 from tornado.escape import json_decode
 
 from . import AuthorizeHandler
 
-from cloudCache.Business.Models import Notebook, DB_SESSION as db
-from cloudCache.Business.Models.Notebook import create_notebook, delete_notebook
+from cloudCache.API.Concurrency import run_on_db_executor
+
+from cloudCache.Business.Models.Notebook import create_notebook, delete_notebook, get_notebooks_page
 from cloudCache.Business.Errors import NotebookAlreadyExistsError, NotebookDoesntExistError
 
 # -------------------------------------------------------------------------------------------------
@@ -15,13 +17,14 @@ from cloudCache.Business.Errors import NotebookAlreadyExistsError, NotebookDoesn
 class NotebookHandler(AuthorizeHandler):
     """ The request handler for managing cloudCache notebooks. """
 
+    @gen.coroutine
     def get(self, **kwargs):
         """ Implements the HTTP GET call on /notebooks/{notebook}. If the user does not provide a
         a notebook, the call will retrieve details for all notebooks that belong to the
-        authenticated user. If the caller provides a notebook, the call will retrieve all notes in
-        that notebook. """
+        authenticated user, a page at a time (see AuthorizeHandler.get_page_arguments). If the
+        caller provides a notebook, the call will retrieve all notes in that notebook. """
 
-        self.authorize()
+        yield self.authorize()
 
         notebook = kwargs.get('notebook')
 
@@ -30,23 +33,28 @@ class NotebookHandler(AuthorizeHandler):
             response = {'message': 'Not yet implemented.'}
 
         else:
-            notebooks = db.query(Notebook).filter_by(user=self.current_user).all()
-            response  = {'notebooks': [{'id': nb.id, 'name': nb.name} for nb in notebooks]}
+            limit, after = self.get_page_arguments()
+            notebooks, next_cursor = yield run_on_db_executor(_fetch_notebooks, self.current_user,
+                                                              limit, after, handler=self)
+
+            response = {'notebooks': notebooks, 'next': next_cursor}
 
-        self.write(response)
+        self.respond(response)
 
 
+    @gen.coroutine
     def delete(self, **kwargs):
         """ Implements the HTTP DELETE call on /notebooks/{notebook}. """
 
-        self.authorize()
+        yield self.authorize()
 
         notebook_id = kwargs.get('notebook')
 
         try:
             # will raise ValueError if the note_id isn't parseable as an int
             int(notebook_id)
-            delete_notebook(notebook_id, self.current_user)
+            yield run_on_db_executor(delete_notebook, notebook_id, self.current_user,
+                                     handler=self)
             response = {'message': 'Success'}
 
         except NotebookDoesntExistError as error:
@@ -57,9 +65,10 @@ class NotebookHandler(AuthorizeHandler):
             self.set_status(400) # Bad Request
             response = {'message': 'Invalid notebook argument. You must supply the notebook ID.'}
 
-        self.write(response)
+        self.respond(response)
 
 
+    @gen.coroutine
     def post(self, **kwargs):
         """ Implements the HTTP POST call on /notebooks. The user must provide an HTTP
         body of the type application/json, with the following format:
@@ -70,15 +79,16 @@ class NotebookHandler(AuthorizeHandler):
 
         Returns the notebook ID if successful, or an error message otherwise. """
 
-        self.authorize()
+        yield self.authorize()
 
         info = json_decode(self.request.body)
 
         try:
             notebook_name = info['notebook_name']
 
-            notebook = create_notebook(notebook_name, self.current_user)
-            response = {'notebook_id': notebook.id}
+            notebook_id = yield run_on_db_executor(_create_notebook, notebook_name,
+                                                   self.current_user, handler=self)
+            response = {'notebook_id': notebook_id}
 
         except NotebookAlreadyExistsError as e:
             self.set_status(409) # Conflict
@@ -89,4 +99,17 @@ class NotebookHandler(AuthorizeHandler):
             message = 'Invalid POST body. Must include notebook_name.'
             response = {'message': message}
 
-        self.write(response)
+        self.respond(response)
+
+# -------------------------------------------------------------------------------------------------
+
+def _fetch_notebooks(user, limit, after):
+    """ Returns a page of a user's notebooks' IDs and names, and the cursor for the next page. """
+
+    notebooks, next_cursor = get_notebooks_page(user, limit, after=after)
+    return [{'id': nb.id, 'name': nb.name} for nb in notebooks], next_cursor
+
+
+def _create_notebook(name, user):
+    """ Creates a notebook for a user, and returns its ID. """
+    return create_notebook(name, user).id
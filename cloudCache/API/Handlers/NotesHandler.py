@@ -1,10 +1,18 @@
 """ Module for the NotesHandler class in the cloudCache REST API. """
 
+from functools import partial
+
+from tornado import gen
 from tornado.escape import json_decode
 
 from . import AuthorizeHandler
+from .AuthorizeHandler import make_etag
+
+from cloudCache.API.Concurrency import run_on_db_executor
 
-from cloudCache.Business.Models.Note import create_note
+from cloudCache.Business.Models.Note import create_note, get_notes_page, get_notebook_version
+from cloudCache.Business.Models.Note import get_notes_by_keys, get_notes_by_prefix_page
+from cloudCache.Business.Models.Note import MAX_NOTES_PER_LOOKUP
 from cloudCache.Business.Models.Notebook import get_notebook
 from cloudCache.Business.Errors import NoteAlreadyExistsError, NotebookDoesntExistError
 
@@ -15,35 +23,87 @@ from cloudCache.Business.Errors import NoteAlreadyExistsError, NotebookDoesntExi
 class NotesHandler(AuthorizeHandler):
     """ The request handler for managing cloudCache notes in a notebook. """
 
+    @gen.coroutine
     def get(self, **kwargs):
-        """ Implements the HTTP GET call on /notebooks/{notebook}/notes/. """
-        self.authorize()
+        """ Implements the HTTP GET call on /notebooks/{notebook}/notes/. Notes are returned a page
+        at a time (see AuthorizeHandler.get_page_arguments), or all at once in a streamed response
+        if the caller asks for one (see AuthorizeHandler.stream_json).
 
-        notebook_id = kwargs.get('notebook')
+        With a `prefix` argument, only the notes whose keys start with the prefix are listed, in
+        order of their keys rather than their IDs (so the `next` cursor is a key).
 
-        try:
-            # will raise ValueError if the notebook_id isn't parseable as an int
-            int(notebook_id)
+        With one or more `key` arguments, e.g. /notebooks/1/notes?key=a&key=b, the notes with those
+        keys are returned all at once instead, along with the keys which don't exist:
 
-            notebook = get_notebook(notebook_id, self.current_user)
-            name     = notebook.name
-            notes    = [note.to_ordered_dict() for note in notebook.notes]
-            response = {'notebook': name, 'notes': notes}
+        {
+            "notebook": "My notebook",
+            "notes": [{"key": "a", "value": "...", "id": 2, ...}],
+            "missing": ["b"]
+        }
 
-        except NotebookDoesntExistError as e:
-            self.set_status(404) # Not Found
-            print(e)
-            response = {'message': str(e)}
+        Responds with a 304 if none of the notebook's notes have changed since the client last
+        fetched the same listing (see AuthorizeHandler.should_return_304). """
+
+        keys = self.get_arguments('key', strip=False)
+
+        if keys:
+            yield self._get_many(kwargs.get('notebook'), keys)
+            return
+
+        notebook = yield self.get_authorized_notebook(kwargs.get('notebook'))
+        count, last_modified = yield run_on_db_executor(get_notebook_version, notebook,
+                                                        handler=self)
+        etag = make_etag(notebook.id, count, last_modified, self.request.query,
+                         self.get_response_type())
+
+        if self.should_return_304(etag, last_modified):
+            self.not_modified()
+
+        prefix = self.get_argument('prefix', None, strip=False)
+
+        if self.is_streaming():
+            yield self.stream_json({'notebook': notebook.name}, 'notes',
+                                   partial(_fetch_notes, notebook, prefix))
+
+        else:
+            yield self._get_page(notebook, prefix)
+
+
+    @gen.coroutine
+    def _get_page(self, notebook, prefix=None):
+        """ Writes a single page of the notes in a notebook, or of those whose keys start with
+        `prefix` if it's given. """
+
+        limit, after = self.get_page_arguments(cursor=int if prefix is None else str)
 
-        except ValueError:
+        notes, next_cursor = yield run_on_db_executor(_fetch_notes, notebook, prefix, limit, after,
+                                                      handler=self)
+        response = {'notebook': notebook.name, 'notes': notes, 'next': next_cursor}
+
+        self.respond(response)
+
+
+    @gen.coroutine
+    def _get_many(self, notebook_id, keys):
+        """ Writes the notes in a notebook with the given keys, looked up all at once. """
+
+        notebook = yield self.get_authorized_notebook(notebook_id)
+
+        if len(keys) > MAX_NOTES_PER_LOOKUP:
             self.set_status(400) # Bad Request
-            message = 'Invalid notebook argument. '
-            message += 'You must supply the notebook ID, not the notebook name.'
-            response = {'message': message}
+            message = 'Too many keys. At most {} notes can be looked up at once.'
+            self.respond({'message': message.format(MAX_NOTES_PER_LOOKUP)})
+            return
+
+        notes, missing = yield run_on_db_executor(_fetch_notes_by_keys, notebook, keys,
+                                                  handler=self)
 
-        self.write(response)
+        response = {'notebook': notebook.name, 'notes': notes, 'missing': missing}
 
+        self.respond(response)
 
+
+    @gen.coroutine
     def post(self, **kwargs):
         """ Implements the HTTP POST call on /notebooks/{notebook}/notes. The user must
         provide an HTTP body of the type application/json, with the following format:
@@ -55,17 +115,17 @@ class NotesHandler(AuthorizeHandler):
 
         Returns the note ID if successful, or an error message otherwise. """
 
-        self.authorize()
+        yield self.authorize()
 
         info = json_decode(self.request.body)
 
         try:
             note_key   = info['note_key']
             note_value = info['note_value']
-            notebook   = get_notebook(kwargs['notebook'], self.current_user)
 
-            note = create_note(note_key, note_value, notebook)
-            response = {'note_id': note.id}
+            note_id = yield run_on_db_executor(_create_note, note_key, note_value,
+                                               kwargs['notebook'], self.current_user, handler=self)
+            response = {'note_id': note_id}
 
         except NoteAlreadyExistsError as e:
             self.set_status(409) # Conflict
@@ -80,4 +140,30 @@ class NotesHandler(AuthorizeHandler):
             message = 'Invalid POST body. Must include note_key and note_value.'
             response = {'message': message}
 
-        self.write(response)
+        self.respond(response)
+
+# -------------------------------------------------------------------------------------------------
+
+def _fetch_notes(notebook, prefix, limit, after):
+    """ Returns a page of serialized notes from a notebook, or of those whose keys start with
+    `prefix` if it isn't `None`, and the cursor for the next page. """
+
+    if prefix is None:
+        notes, next_cursor = get_notes_page(notebook, limit, after=after)
+    else:
+        notes, next_cursor = get_notes_by_prefix_page(notebook, prefix, limit, after=after)
+
+    return [note.to_ordered_dict() for note in notes], next_cursor
+
+
+def _fetch_notes_by_keys(notebook, keys):
+    """ Returns the serialized notes in a notebook with the given keys, and the keys which don't
+    exist (see get_notes_by_keys). """
+
+    notes, missing = get_notes_by_keys(notebook, keys)
+    return [note.to_ordered_dict() for note in notes], missing
+
+
+def _create_note(key, value, notebook_id, user):
+    """ Creates a note in a user's notebook, and returns its ID. """
+    return create_note(key, value, get_notebook(notebook_id, user)).id
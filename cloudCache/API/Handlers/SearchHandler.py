@@ -0,0 +1,76 @@
+""" Module for the SearchHandler class in the cloudCache REST API. """
+
+from tornado import gen
+
+from . import AuthorizeHandler
+
+from cloudCache.API.Concurrency import run_on_db_executor
+
+from cloudCache.Business.Models.Search import search_notes, MAX_SEARCH_OFFSET
+from cloudCache.Business.Errors import InvalidSearchQueryError
+
+# -------------------------------------------------------------------------------------------------
+
+# /search?q={query}
+
+class SearchHandler(AuthorizeHandler):
+    """ The request handler for searching a user's cloudCache notes. """
+
+    @gen.coroutine
+    def get(self, **kwargs):
+        """ Implements the HTTP GET call on /search?q={query}. Returns the user's notes whose key or
+        value contains every word of the query, best matches first, a page at a time (see
+        AuthorizeHandler.get_page_arguments). An optional `notebook` argument limits the search to
+        one of the user's notebooks. Results can be paged at most MAX_SEARCH_OFFSET matches deep.
+        Values longer than 255 characters, and values uploaded as raw bytes, aren't searched, only
+        their notes' keys are.
+
+        {
+            "query": "shopping list",
+            "notes": [{"key": "Shopping list", "value": "...", "id": 2, ...}],
+            "next": 100
+        }
+
+        """
+
+        yield self.authorize()
+
+        limit, offset = self.get_page_arguments()
+        query = self.get_argument('q', '')
+
+        # search_notes never returns a cursor beyond MAX_SEARCH_OFFSET, but a client can send any
+        # `after`, and the database would rank and skip that many matches to honour it
+        if offset is not None and not 0 <= offset <= MAX_SEARCH_OFFSET:
+            message  = 'Invalid pagination arguments. `after` must be the `next` cursor from a '
+            message += 'previous page, at most {}.'
+            self.set_status(400) # Bad Request
+            self.respond({'message': message.format(MAX_SEARCH_OFFSET)})
+            return
+
+        try:
+            notebook_id = self.get_argument('notebook', None)
+            notebook_id = None if notebook_id is None else int(notebook_id)
+
+            notes, next_cursor = yield run_on_db_executor(_search, self.current_user, query, limit,
+                                                          offset or 0, notebook_id, handler=self)
+
+            response = {'query': query, 'notes': notes, 'next': next_cursor}
+
+        except InvalidSearchQueryError as e:
+            self.set_status(400) # Bad Request
+            response = {'message': str(e)}
+
+        except ValueError:
+            self.set_status(400) # Bad Request
+            response = {'message': 'Invalid notebook argument. It must be a notebook ID.'}
+
+        self.respond(response)
+
+# -------------------------------------------------------------------------------------------------
+
+def _search(user, query, limit, offset, notebook_id):
+    """ Returns a page of a user's serialized notes matching a query (see search_notes), and the
+    cursor for the next page. """
+
+    notes, next_cursor = search_notes(user, query, limit, offset=offset, notebook_id=notebook_id)
+    return [note.to_ordered_dict() for note in notes], next_cursor
@@ -0,0 +1,125 @@
+""" Module for the SyncHandler class in the cloudCache REST API. """
+
+from collections import OrderedDict
+from functools import partial
+
+import arrow
+import tornado.web
+from tornado import gen
+
+from . import AuthorizeHandler
+
+from cloudCache.API.Concurrency import run_on_db_executor
+
+from cloudCache.Business.Models.Note import get_changed_notes_page
+from cloudCache.Business.Models.NoteTombstone import get_tombstones_since, get_retention_horizon
+
+# -------------------------------------------------------------------------------------------------
+
+# A note's last_updated time is set before its transaction commits, so a change can become visible
+# slightly after the time it's stamped with. Cursors are set this many seconds in the past, so such
+# changes are picked up by the next sync rather than missed.
+SYNC_OVERLAP = 5 # seconds
+
+# -------------------------------------------------------------------------------------------------
+
+# /sync
+
+class SyncHandler(AuthorizeHandler):
+    """ The request handler for incrementally syncing a user's cloudCache notes. """
+
+    @gen.coroutine
+    def get(self, **kwargs):
+        """ Implements the HTTP GET call on /sync?since={cursor}. Returns the cursor to pass as
+        `since` to the next sync, the notes deleted since `since`, and the notes created or modified
+        since `since` (streamed, see AuthorizeHandler.stream_json):
+
+        {
+            "cursor": "1445167560000",
+            "reset": false,
+            "deleted": [{"note_id": 1, "notebook_id": 1, "deleted_on": "2015-10-18T11:26:00"}],
+            "notes": [{"key": "My awesome note", "value": "...", "id": 2, ...}]
+        }
+
+        Clients apply the deletions before the notes. A note may be returned by two consecutive
+        syncs, so applying a note is expected to overwrite the client's copy.
+
+        If `since` is omitted, or older than the period for which deletions are remembered,
+        `reset` is true and no changes are returned: the client discards its notes and fetches
+        them all again from the notebook listings, then syncs from the returned cursor. """
+
+        since, head = yield self._get_deletions()
+
+        if since is None:
+            self.respond(head)
+
+        else:
+            yield self.stream_json(head, 'notes',
+                                   partial(_fetch_changed_notes, self.current_user, since))
+
+
+    @gen.coroutine
+    def _get_deletions(self):
+        """ Authorizes the request, and returns the time the client last synced (`None` if it has to
+        reset), and the head of the response. """
+
+        yield self.authorize()
+
+        # taken before any query runs, so nothing changed during this sync is missed by the next
+        cursor = _to_cursor(arrow.utcnow().replace(seconds=-SYNC_OVERLAP))
+        since  = self._get_since()
+
+        if since is None or since < get_retention_horizon():
+            head = OrderedDict([('cursor', cursor), ('reset', True), ('deleted', []),
+                                ('notes', [])])
+            return None, head
+
+        deleted = yield run_on_db_executor(_fetch_deletions, self.current_user, since,
+                                           handler=self)
+
+        return since, OrderedDict([('cursor', cursor), ('reset', False), ('deleted', deleted)])
+
+
+    def _get_since(self):
+        """ Returns the time passed as the `since` cursor as an Arrow, or `None` if there isn't one.
+        An invalid cursor finishes the request with a 400. """
+
+        since = self.get_argument('since', None)
+
+        if since is None:
+            return None
+
+        try:
+            return _from_cursor(since)
+
+        except (ValueError, OverflowError):
+            self.set_status(400) # Bad Request
+            message = 'Invalid sync cursor. `since` must be the `cursor` from a previous sync.'
+            self.respond({'message': message})
+            raise tornado.web.Finish()
+
+# -------------------------------------------------------------------------------------------------
+
+def _to_cursor(time):
+    """ Returns the sync cursor for an Arrow time, the milliseconds since the epoch. """
+    return str(int(time.float_timestamp * 1000))
+
+
+def _from_cursor(cursor):
+    """ Returns the Arrow time represented by a sync cursor. """
+    return arrow.get(int(cursor) / 1000.0)
+
+
+def _fetch_deletions(user, since):
+    """ Returns a user's serialized tombstones of the notes deleted since `since`. """
+
+    deleted = get_tombstones_since(user, since)
+    return [tombstone.to_ordered_dict() for tombstone in deleted]
+
+
+def _fetch_changed_notes(user, since, limit, after):
+    """ Returns a page of a user's serialized notes changed since `since`, and the cursor for the
+    next page. """
+
+    notes, next_cursor = get_changed_notes_page(user, since, limit, after=after)
+    return [note.to_ordered_dict() for note in notes], next_cursor
@@ -1,20 +1,31 @@
 """ Module for the UserHandler class in the cloudCache REST API. """
 
+import tornado.web
+from tornado import gen
 from tornado.escape import json_decode
 
 from . import AuthorizeHandler
 
+from cloudCache.API.Concurrency import run_on_db_executor, run_on_cpu_executor
+
 from cloudCache.Business.Models import User, DB_SESSION as db
-from cloudCache.Business.Models.User import create_user, delete_user
+from cloudCache.Business.Models.User import create_user, delete_user, get_user_with_notebooks
+from cloudCache.Business.Models.User import get_users_page, get_password_hash, verify_password
+from cloudCache.Business.Models.User import set_password_hash
 from cloudCache.Business.Errors import UserAlreadyExistsError, UserDoesntExistError
 
 # -------------------------------------------------------------------------------------------------
 
+INVALID_CREDENTIALS = 'Invalid username/password combination.'
+
+# -------------------------------------------------------------------------------------------------
+
 # /users/{username}
 
 class UserHandler(AuthorizeHandler):
     """ The request handler for managing cloudCache users. """
 
+    @gen.coroutine
     def post(self, **kwargs):
         """ Implements HTTP POST for the UserHandler. Creates a new user. The user must provide an
         HTTP body of the type application/json, with the following format:
@@ -37,11 +48,12 @@ class UserHandler(AuthorizeHandler):
             last_name  = info['last_name']
             email      = info['email']
             password   = info['password']
-            user = create_user(username, first_name, last_name, email, password)
+            user_id, api_key = yield run_on_db_executor(_create_user, username, first_name,
+                                                        last_name, email, password, handler=self)
 
             response = {
-                'user_id': user.id,
-                'api_key': user.api_key
+                'user_id': user_id,
+                'api_key': api_key
             }
 
         except UserAlreadyExistsError as error:
@@ -53,64 +65,139 @@ class UserHandler(AuthorizeHandler):
             message = 'Invalid POST body. Must include username, first and last names, email, and password.'
             response = {'message': message}
 
-        self.write(response)
+        self.respond(response)
 
 
+    @gen.coroutine
     def delete(self, username):
         """ Implements the HTTP DELETE call on /users/{username}. """
 
-        self.authorize()
+        yield self.authorize()
+        yield self.check_password(username)
+
+        deleted = yield run_on_db_executor(_delete_user, username, handler=self)
+
+        if not deleted:
+            # deleted since the password was checked
+            self.set_status(401) # Unauthenticated
+            response = {'message': INVALID_CREDENTIALS}
+
+        else:
+            response = {'message': 'Success'}
+
+        self.respond(response)
+
+
+    @gen.coroutine
+    def get(self, username):
+        """ Implements the HTTP GET call on /users/{username}. If the caller does not provide a
+        a username, the call will retrieve details for all users in the system, a page at a time
+        (see AuthorizeHandler.get_page_arguments) or all at once in a streamed response (see
+        AuthorizeHandler.stream_json). If the caller provides a username, the call will retrieve
+        all details for that user. """
+
+        if not username and self.is_streaming():
+            yield self.authorize()
+            yield self.stream_json({}, 'users', _fetch_users)
+
+        else:
+            if username:
+                yield self.check_password(username)
+
+            yield self._get(username)
+
+
+    @gen.coroutine
+    def check_password(self, username):
+        """ Checks the password in the request body against the user's, and finishes the request
+        with a 400 if there isn't one, or a 401 if it's wrong. The password is hashed on the CPU
+        executor, so it holds up neither the IOLoop nor a DB executor thread and its connection. If
+        the user's stored hash is outdated, it's replaced by a new hash of the password. """
 
         try:
             password = json_decode(self.request.body)['password']
-            user = db.query(User).filter_by(username=username).first()
 
-            if (not user) or (user.password != password):
-                self.set_status(401) # Unauthenticated
-                response = {'message': 'Invalid username/password combination.'}
+        except (KeyError, TypeError, ValueError):
+            # no http body, or no password in it
+            self.set_status(400) # Bad Request
+            self.respond({'message': 'You must provide a user password for this operation.'})
+            raise tornado.web.Finish()
 
-            else:
-                delete_user(user)
-                response = {'message': 'Success'}
+        password_hash = yield run_on_db_executor(get_password_hash, username, handler=self)
+        verified, new_hash = False, None
 
-        except ValueError:
-            # raised by the json_decode part if no http body is passed in, and therefore no password passed in
-            self.set_status(400) # Bad Request
-            response = {'message': 'You must provide a user password for this operation.'}
+        if password_hash is not None:
+            verified, new_hash = yield run_on_cpu_executor(verify_password, username,
+                                                           password_hash, password)
 
-        self.write(response)
+        if not verified:
+            self.set_status(401) # Unauthenticated
+            self.respond({'message': INVALID_CREDENTIALS})
+            raise tornado.web.Finish()
 
+        if new_hash is not None:
+            yield run_on_db_executor(set_password_hash, username, new_hash, handler=self)
 
-    def get(self, username):
-        """ Implements the HTTP GET call on /users/{username}. If the caller does not provide a
-        a username, the call will retrieve details for all users in the system. If the caller
-        provides a username, the call will retrieve all details for that user. """
+
+    @gen.coroutine
+    def _get(self, username):
+        """ Writes the details of a single user whose password has been checked, or a single page
+        of all users. """
 
         if not username:
-            self.authorize()
+            yield self.authorize()
 
         # looking for a specific user
         if username:
-            try:
-                password = json_decode(self.request.body)['password']
-                user = db.query(User).filter_by(username=username).first()
-
-                if (not user) or (user.password != password):
-                    self.set_status(401) # Unauthenticated
-                    response = {'message': 'Invalid username/password combination.'}
-
-                else:
-                    response = {'user': user.to_ordered_dict()}
+            user = yield run_on_db_executor(_get_user_dict, username, handler=self)
 
+            if not user:
+                # deleted since the password was checked
+                self.set_status(401) # Unauthenticated
+                response = {'message': INVALID_CREDENTIALS}
 
-            except ValueError:
-                # raised by the json_decode part if no http body is passed in, and therefore no password passed in
-                self.set_status(400) # Bad Request
-                response = {'message': 'You must provide a user password for this operation.'}
+            else:
+                response = {'user': user}
 
         # Get all users
         else:
-            users = [{'id': user.id, 'username': user.username} for user in db.query(User).all()]
-            response = {'users' : users}
+            limit, after = self.get_page_arguments()
+            users, next_cursor = yield run_on_db_executor(_fetch_users, limit, after, handler=self)
+
+            response = {'users' : users, 'next': next_cursor}
+
+        self.respond(response)
+
+# -------------------------------------------------------------------------------------------------
+
+def _create_user(username, first_name, last_name, email_address, password):
+    """ Creates a user, and returns their ID and API key. """
+
+    user = create_user(username, first_name, last_name, email_address, password)
+    return user.id, user.api_key
+
+
+def _delete_user(username):
+    """ Deletes a user, and returns whether they existed. """
+
+    user = db.query(User).filter_by(username=username).first()
+
+    if user:
+        delete_user(user)
+
+    return user is not None
+
+
+def _get_user_dict(username):
+    """ Returns the OrderedDict representation of a user, with their notebooks and notes, or `None`
+    if they don't exist. """
+
+    user = get_user_with_notebooks(username)
+    return None if user is None else user.to_ordered_dict()
+
+
+def _fetch_users(limit, after):
+    """ Returns a page of users' IDs and usernames, and the cursor for the next page. """
 
-        self.write(response)
+    users, next_cursor = get_users_page(limit, after=after)
+    return [{'id': user.id, 'username': user.username} for user in users], next_cursor
@@ -7,3 +7,9 @@ from .AccessHandler import AccessHandler
 from .NotebookHandler import NotebookHandler
 from .NotesHandler import NotesHandler
 from .NoteHandler import NoteHandler
+from .NoteKeyHandler import NoteKeyHandler
+from .NoteValueHandler import NoteValueHandler
+from .BulkNotesHandler import BulkNotesHandler
+from .SyncHandler import SyncHandler
+from .SearchHandler import SearchHandler
+from .MetricsHandler import MetricsHandler
@@ -0,0 +1,347 @@
+""" Collects metrics about the requests the server handles, the database connection pool and the
+process-local caches, and renders them in the Prometheus text exposition format for the /metrics
+endpoint.
+
+Per-request metrics are labelled with the handler class and HTTP method, e.g.
+
+    cloudcache_request_duration_seconds_bucket{handler="NoteHandler",method="GET",le="0.005"} 42
+
+SQL time and statement counts are captured by SQLAlchemy engine events, and attributed to the
+request whose DB executor work issued the statement (see Concurrency.current_handler). Every metric
+is process-local: with --workers, each worker reports only the requests it handled itself, so a
+scraper should scrape every worker, or the totals should be read as a sample. """
+
+from bisect import bisect_left
+from threading import Lock
+from time import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from cloudCache.API.Concurrency import current_handler
+from cloudCache.Business import Models
+from cloudCache.Business.Config import get_setting
+from cloudCache.Business.Models.Note import get_note_cache
+from cloudCache.Business.Models.User import get_credential_cache
+from cloudCache.Business.Models.UserAccessToken import get_token_cache
+
+# -------------------------------------------------------------------------------------------------
+
+# Off by default: the endpoint isn't authenticated, and reveals the server's traffic and internals
+# to anyone who can reach it, so it should only be turned on where scrapers alone can reach it
+METRICS_ENABLED = get_setting('metrics', 'enabled', False, bool)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS  = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+REQUEST_LABELS = ('handler', 'method')
+
+# The most statements a request keeps in its statement log, so a long stream can't grow it forever
+MAX_LOGGED_STATEMENTS = 500
+
+# -------------------------------------------------------------------------------------------------
+
+class Counter(object):
+    """ A monotonically increasing count, kept separately for each combination of label values. """
+
+
+    def __init__(self, name, description, labels=()):
+        self.name        = name
+        self.description = description
+        self.labels      = labels
+        self._values     = dict()
+        self._lock       = Lock()
+
+
+    def inc(self, *label_values, amount=1):
+        """ Adds `amount` to the count for `label_values`, which are given in the order of
+        this counter's labels. """
+
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+    def render(self):
+        """ Returns the lines of this counter in the text exposition format. """
+
+        lines = _header(self.name, self.description, 'counter')
+
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for label_values, value in values:
+            lines.append(_sample(self.name, zip(self.labels, label_values), value))
+
+        return lines
+
+# -------------------------------------------------------------------------------------------------
+
+class Histogram(object):
+    """ Counts observations into buckets by their value, and keeps their sum and count, separately
+    for each combination of label values. Buckets are cumulative when rendered, as Prometheus
+    expects, but stored per bucket so that an observation only touches one of them. """
+
+
+    def __init__(self, name, description, buckets, labels=()):
+        self.name        = name
+        self.description = description
+        self.buckets     = tuple(buckets)
+        self.labels      = labels
+        self._series     = dict()
+        self._lock       = Lock()
+
+
+    def observe(self, value, *label_values):
+        """ Records one observation of `value` for `label_values`. """
+
+        # the last slot holds observations above the highest bucket, which only count towards +Inf
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+
+    def render(self):
+        """ Returns the lines of this histogram in the text exposition format. """
+
+        lines = _header(self.name, self.description, 'histogram')
+
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count) in self._series.items())
+
+        for label_values, (counts, total, count) in series:
+            labels     = list(zip(self.labels, label_values))
+            cumulative = 0
+
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(_sample(self.name + '_bucket', labels + [('le', bound)], cumulative))
+
+            lines.append(_sample(self.name + '_bucket', labels + [('le', '+Inf')], count))
+            lines.append(_sample(self.name + '_sum', labels, total))
+            lines.append(_sample(self.name + '_count', labels, count))
+
+        return lines
+
+# -------------------------------------------------------------------------------------------------
+
+class RequestMetrics(object):
+    """ The metrics of a single request, accumulated while it's handled, and recorded in the
+    per-route histograms by `observe_request` once it has finished.
+
+    Attributes:
+        statements (int): The number of SQL statements executed for the request.
+        sql_seconds (float): The time spent executing those statements.
+        serialization_seconds (float): The time spent encoding response bodies.
+        statement_log (list): (statement, seconds) for each of the first MAX_LOGGED_STATEMENTS
+            statements, if the request was started with `log_statements`, otherwise `None`.
+
+    """
+
+    def __init__(self, log_statements=False):
+        self.statements            = 0
+        self.sql_seconds           = 0.0
+        self.serialization_seconds = 0.0
+        self.statement_log         = list() if log_statements else None
+
+
+    def record_statement(self, statement, seconds):
+        """ Records the execution of one SQL statement, which took `seconds`. """
+
+        self.statements  += 1
+        self.sql_seconds += seconds
+
+        log = self.statement_log
+        if log is not None and len(log) < MAX_LOGGED_STATEMENTS:
+            log.append((statement, seconds))
+
+# -------------------------------------------------------------------------------------------------
+
+REQUESTS = Counter('cloudcache_requests_total',
+                   'Requests handled, by handler, method and response status.',
+                   REQUEST_LABELS + ('status',))
+
+REQUEST_SECONDS = Histogram('cloudcache_request_duration_seconds',
+                            'Total time taken to handle a request.',
+                            DURATION_BUCKETS, REQUEST_LABELS)
+
+SQL_SECONDS = Histogram('cloudcache_request_sql_duration_seconds',
+                        'Time spent executing SQL statements for a request.',
+                        DURATION_BUCKETS, REQUEST_LABELS)
+
+SERIALIZATION_SECONDS = Histogram('cloudcache_request_serialization_duration_seconds',
+                                  'Time spent encoding response bodies for a request.',
+                                  DURATION_BUCKETS, REQUEST_LABELS)
+
+STATEMENTS = Histogram('cloudcache_request_statements',
+                       'Number of SQL statements executed for a request.',
+                       STATEMENT_BUCKETS, REQUEST_LABELS)
+
+# (name, description, type, collect) of each gauge or counter whose samples are collected when
+# metrics are rendered, rather than recorded as they happen
+_COLLECTED = list()
+
+# -------------------------------------------------------------------------------------------------
+
+def observe_request(handler, method, status, seconds, request_metrics):
+    """ Records a finished request in the per-route metrics.
+
+    Args:
+        handler (string): The name of the request's handler class.
+        method (string): The request's HTTP method.
+        status (int): The response status.
+        seconds (float): The total time taken to handle the request.
+        request_metrics (RequestMetrics): The metrics accumulated while handling it.
+
+    """
+
+    REQUESTS.inc(handler, method, str(status))
+    REQUEST_SECONDS.observe(seconds, handler, method)
+    SQL_SECONDS.observe(request_metrics.sql_seconds, handler, method)
+    SERIALIZATION_SECONDS.observe(request_metrics.serialization_seconds, handler, method)
+    STATEMENTS.observe(request_metrics.statements, handler, method)
+
+
+def register_gauge(name, description, collect):
+    """ Registers a gauge whose current samples are returned by `collect()` each time metrics are
+    rendered, as a list of (labels dict, value) tuples. """
+
+    _COLLECTED.append((name, description, 'gauge', collect))
+
+
+def register_counter(name, description, collect):
+    """ Registers a counter which is kept elsewhere (e.g. by a cache), as `register_gauge` does.
+    Its samples must only ever increase. """
+
+    _COLLECTED.append((name, description, 'counter', collect))
+
+
+def render():
+    """ Returns every metric in the Prometheus text exposition format. """
+
+    lines = list()
+
+    for metric in (REQUESTS, REQUEST_SECONDS, SQL_SECONDS, SERIALIZATION_SECONDS, STATEMENTS):
+        lines.extend(metric.render())
+
+    for name, description, metric_type, collect in _COLLECTED:
+        lines.extend(_header(name, description, metric_type))
+        for labels, value in collect():
+            lines.append(_sample(name, sorted(labels.items()), value))
+
+    return '\n'.join(lines) + '\n'
+
+# -------------------------------------------------------------------------------------------------
+
+def _header(name, description, metric_type):
+    """ Returns the HELP and TYPE lines which introduce a metric. """
+
+    return ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, metric_type)]
+
+
+def _sample(name, labels, value):
+    """ Returns the line for one sample of a metric, with `labels` as (name, value) pairs. """
+
+    labels = ','.join('{}="{}"'.format(label, _escape(value)) for label, value in labels)
+
+    if labels:
+        return '{}{{{}}} {}'.format(name, labels, _format_value(value))
+
+    return '{} {}'.format(name, _format_value(value))
+
+
+def _escape(value):
+    """ Escapes a label value for the text exposition format. """
+
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+    """ Formats a sample value, using repr for floats so that none of their precision is lost. """
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# -------------------------------------------------------------------------------------------------
+
+def _collect_pool():
+    """ Returns the samples of the connection pool gauge. """
+
+    stats = Models.get_pool_stats()
+
+    return [({'pool': stats['pool'], 'state': state}, stats[state])
+            for state in ('size', 'checked_in', 'checked_out', 'overflow') if state in stats]
+
+
+def _collect_caches(stat):
+    """ Returns a function collecting the samples of the cache gauge for the statistic `stat`. """
+
+    def collect():
+        """ Returns the samples of `stat` for each cache which reports it. """
+
+        caches = (('note', get_note_cache()), ('access_token', get_token_cache()),
+                  ('credential', get_credential_cache()))
+        samples = list()
+
+        for name, cache in caches:
+            stats = cache.stats()
+            if stat in stats:
+                samples.append(({'cache': name}, stats[stat]))
+
+        return samples
+
+    return collect
+
+
+register_gauge('cloudcache_db_pool_connections',
+               'Database connection pool usage (only a QueuePool reports its size and usage).',
+               _collect_pool)
+
+register_counter('cloudcache_cache_hits_total', 'Lookups answered by a process-local cache.',
+                 _collect_caches('hits'))
+
+register_counter('cloudcache_cache_misses_total', 'Lookups missed by a process-local cache.',
+                 _collect_caches('misses'))
+
+register_gauge('cloudcache_cache_hit_ratio', 'Proportion of lookups answered by a cache.',
+               _collect_caches('hit_rate'))
+
+register_gauge('cloudcache_cache_entries', 'Entries held by a process-local cache.',
+               _collect_caches('entries'))
+
+register_gauge('cloudcache_cache_bytes', 'Estimated size of the values held by a cache.',
+               _collect_caches('bytes'))
+
+# -------------------------------------------------------------------------------------------------
+
+# Listening on the Engine class rather than on DB_ENGINE itself keeps the timings working for the
+# engines which Models.reset_engine creates in forked worker processes
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """ Notes when a statement started executing. """
+
+    # pylint: disable=W0613,R0913
+    # the listener's signature is fixed by SQLAlchemy
+    context.cloudcache_started = time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """ Attributes a finished statement, and the time it took, to the request it was executed for,
+    if there is one. """
+
+    # pylint: disable=W0613,R0913
+    handler = current_handler()
+    request_metrics = getattr(handler, 'request_metrics', None)
+
+    if request_metrics is not None:
+        request_metrics.record_statement(statement, time() - context.cloudcache_started)
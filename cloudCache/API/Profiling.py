@@ -0,0 +1,103 @@
+""" Hooks for catching slow requests: logs any request slower than a threshold along with every SQL
+statement it issued, and profiles a random sample of requests with cProfile, for offline analysis.
+
+Both are configured in the `profiling` section of the settings (see cloudCache.Business.Config):
+
+    [profiling]
+    # requests taking at least this long are logged, 0 turns the log off
+    slow_request_ms = 1000
+    # fraction of requests profiled, from 0 (the default, off) to 1
+    sample_rate = 0.01
+    # where profiles are written
+    dir = /var/tmp/cloudcache-profiles
+
+Profiles are written in the pstats format, one file per request, named after the handler, method,
+time and process. They can be read with pstats, or turned into flamegraphs by tools which accept
+pstats files, e.g. snakeviz, or flameprof and flamegraph.pl. A profile covers the request's work on
+the DB executor (see cloudCache.API.Concurrency), which is where handler methods run their queries
+and serialize the models they load; encoding and writing the response on the IOLoop, and time the
+request spends waiting there, aren't in it. """
+
+import cProfile
+import os
+import random
+import tempfile
+from time import time
+
+from tornado.log import app_log
+
+from cloudCache.Business.Config import get_setting
+
+# -------------------------------------------------------------------------------------------------
+
+SLOW_REQUEST_MS = get_setting('profiling', 'slow_request_ms', 1000, float)
+SAMPLE_RATE     = get_setting('profiling', 'sample_rate', 0.0, float)
+PROFILE_DIR     = get_setting('profiling', 'dir',
+                              os.path.join(tempfile.gettempdir(), 'cloudcache-profiles'))
+
+# -------------------------------------------------------------------------------------------------
+
+def log_statements():
+    """ Returns whether requests should keep a log of their statements, for `log_slow_request`. """
+    return SLOW_REQUEST_MS > 0
+
+
+def is_slow(seconds):
+    """ Returns whether a request which took `seconds` should be logged as a slow request. """
+    return 0 < SLOW_REQUEST_MS <= seconds * 1000
+
+
+def log_slow_request(handler, seconds, request_metrics):
+    """ Logs a slow request as a warning, with its route, its user, and each SQL statement it issued
+    with that statement's duration.
+
+    Args:
+        handler (tornado.web.RequestHandler): The request's handler.
+        seconds (float): The total time the request took.
+        request_metrics (cloudCache.API.Metrics.RequestMetrics): The request's metrics, started
+            with a statement log.
+
+    """
+
+    # not handler.current_user, which may have been expired by a commit and detached since
+    user = handler.username or '-'
+    log  = request_metrics.statement_log or list()
+
+    lines = ['Slow request: {} {} ({}) for user {} took {:.1f}ms, with {} SQL statements taking '
+             '{:.1f}ms:'.format(handler.request.method, handler.request.path,
+                                type(handler).__name__, user, seconds * 1000,
+                                request_metrics.statements, request_metrics.sql_seconds * 1000)]
+
+    for statement, statement_seconds in log:
+        statement = ' '.join(statement.split())
+        lines.append('  {:8.2f}ms  {}'.format(statement_seconds * 1000, statement))
+
+    if request_metrics.statements > len(log):
+        lines.append('  ... {} more'.format(request_metrics.statements - len(log)))
+
+    app_log.warning('\n'.join(lines))
+
+
+def start_profiler():
+    """ Returns a new cProfile.Profile for a request if it's chosen to be in the profiled sample,
+    otherwise `None`. """
+
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return cProfile.Profile()
+
+    return None
+
+
+def dump_profile(profiler, handler):
+    """ Writes a request's profile to a new file in PROFILE_DIR, and returns the file's path. """
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    filename = '{}-{}-{:.6f}-{}.prof'.format(type(handler).__name__, handler.request.method,
+                                             time(), os.getpid())
+    path = os.path.join(PROFILE_DIR, filename)
+
+    profiler.dump_stats(path)
+    app_log.info('Profiled %s %s to %s', handler.request.method, handler.request.path, path)
+
+    return path
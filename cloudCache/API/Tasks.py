@@ -0,0 +1,147 @@
+""" Module for scheduled background tasks which run on the cloudCache server's IOLoop. """
+
+from time import time
+
+import tornado.ioloop
+from tornado import gen
+from tornado.log import app_log
+
+from cloudCache.API.Concurrency import run_on_db_executor
+from cloudCache.Business.Models.UserAccessToken import delete_expired_tokens, sweep_token_cache
+from cloudCache.Business.Models.NoteTombstone import delete_expired_tombstones
+from cloudCache.Business.Models.TokenRevocation import delete_expired_revocations
+from cloudCache.Business.Models.TokenRevocation import load_revocations
+
+# -------------------------------------------------------------------------------------------------
+
+class TokenReaper(object):
+    """ Periodically purges expired UserAccessTokens from the database, and expired entries from the
+    process-local access token cache. Also purges NoteTombstones and TokenRevocations older than
+    their retention periods.
+
+    Attributes:
+        interval (float): Seconds between sweeps.
+        batch_size (int): The maximum number of rows deleted by a single DELETE statement.
+        last_removed (int): The number of tokens removed from the database by the last sweep.
+        last_pruned (int): The number of tombstones and token revocations removed from the database
+            by the last sweep.
+        last_duration (float): How long the last sweep took, in seconds.
+
+    """
+
+    def __init__(self, interval=300, batch_size=1000, io_loop=None):
+        self.interval   = interval
+        self.batch_size = batch_size
+
+        self.last_removed  = 0
+        self.last_pruned   = 0
+        self.last_duration = 0.0
+
+        self._sweeping = False
+        self._callback = tornado.ioloop.PeriodicCallback(self.sweep, interval * 1000,
+                                                         io_loop=io_loop)
+
+
+    def start(self):
+        """ Starts sweeping on the IOLoop every `interval` seconds. """
+        self._callback.start()
+
+
+    def stop(self):
+        """ Stops any further sweeps from being scheduled. """
+        self._callback.stop()
+
+
+    @gen.coroutine
+    def sweep(self):
+        """ Runs a single sweep on the DB executor, logging how many tokens were removed and how
+        long it took. A sweep is skipped if the previous one is still running. """
+
+        if self._sweeping:
+            return
+
+        self._sweeping = True
+        start = time()
+
+        try:
+            removed = yield run_on_db_executor(delete_expired_tokens, batch_size=self.batch_size)
+            evicted = sweep_token_cache()
+            pruned  = yield run_on_db_executor(delete_expired_tombstones,
+                                               batch_size=self.batch_size)
+            pruned += yield run_on_db_executor(delete_expired_revocations,
+                                               batch_size=self.batch_size)
+
+        except Exception: # pylint: disable=W0703
+            # a failed sweep must not kill the periodic callback; the next sweep will try again
+            app_log.exception('Expired access token sweep failed.')
+            return
+
+        finally:
+            self._sweeping = False
+
+        self.last_removed  = removed
+        self.last_pruned   = pruned
+        self.last_duration = time() - start
+
+        message  = 'Expired access token sweep removed %d tokens (%d cache entries) '
+        message += 'and %d note tombstones and token revocations in %.3fs.'
+        app_log.info(message, removed, evicted, pruned, self.last_duration)
+
+# -------------------------------------------------------------------------------------------------
+
+class RevocationPoller(object):
+    """ Periodically loads the TokenRevocations made by other server processes, so that signed
+    access tokens revoked anywhere are rejected here too, at most `interval` seconds later. Every
+    process polls for itself.
+
+    Attributes:
+        interval (float): Seconds between polls.
+        overlap (float): Seconds before the latest revocation seen that each poll looks back to, so
+            that a revocation committed after a later-timestamped one isn't missed.
+
+    """
+
+    def __init__(self, interval=5, overlap=60, io_loop=None):
+        self.interval = interval
+        self.overlap  = overlap
+
+        self._since    = None
+        self._polling  = False
+        self._callback = tornado.ioloop.PeriodicCallback(self.poll, interval * 1000,
+                                                         io_loop=io_loop)
+
+
+    def start(self):
+        """ Polls straight away, loading every remembered revocation, then every `interval`
+        seconds. """
+
+        self.poll()
+        self._callback.start()
+
+
+    def stop(self):
+        """ Stops any further polls from being scheduled. """
+        self._callback.stop()
+
+
+    @gen.coroutine
+    def poll(self):
+        """ Loads the revocations made since the last poll on the DB executor. A poll is skipped if
+        the previous one is still running. """
+
+        if self._polling:
+            return
+
+        self._polling = True
+
+        try:
+            since = self._since.replace(seconds=-self.overlap) if self._since else None
+            latest = yield run_on_db_executor(load_revocations, since)
+            self._since = max(latest, self._since) if self._since else latest
+
+        except Exception: # pylint: disable=W0703
+            # a failed poll must not kill the periodic callback; the next poll will try again
+            app_log.exception('Token revocation poll failed.')
+
+        finally:
+            self._polling = False
@@ -0,0 +1,209 @@
+""" Init for cloudCache caching package. Provides small process-local caches used to keep hot
+lookups (such as access token validation) out of the database, and the interface which other cache
+backends implement. """
+
+# pylint: disable=C0103
+# disable name-too-short warning on `ttl` arguments
+
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+# -------------------------------------------------------------------------------------------------
+
+class CacheBackend(object):
+    """ The interface for a cloudCache cache backend. A backend shared between processes (e.g. one
+    backed by memcached or Redis, or a local stand-in for one) implements these methods, and can
+    then be plugged in wherever a process-local TTLCache is used.
+
+    Attributes:
+        hits (int): The number of lookups which found a live entry.
+        misses (int): The number of lookups which didn't.
+
+    """
+
+    def __init__(self):
+        self.hits   = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        """ Returns the value cached for `key`, or `default` if there is no live entry for it. """
+        raise NotImplementedError()
+
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """ Caches `value` for `key`. The entry expires at the epoch timestamp `expires_at` if it is
+        supplied, otherwise `ttl` seconds (or the backend's default TTL) from now. """
+        raise NotImplementedError()
+
+
+    def pop(self, key, default=None):
+        """ Removes the entry for `key`, and returns its value or `default` if it wasn't cached. """
+        raise NotImplementedError()
+
+
+    def delete_many(self, keys):
+        """ Removes the entries for all of `keys`. """
+
+        for key in keys:
+            self.pop(key)
+
+
+    def clear(self):
+        """ Removes every entry from the cache. """
+        raise NotImplementedError()
+
+
+    def stats(self):
+        """ Returns a dict of statistics about this cache's usage. """
+
+        lookups = self.hits + self.misses
+
+        return {
+            'hits'    : self.hits,
+            'misses'  : self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+# -------------------------------------------------------------------------------------------------
+
+class NullCache(CacheBackend):
+    """ A cache backend which never holds anything, for turning a cache off. """
+
+    def get(self, key, default=None):
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        pass
+
+    def pop(self, key, default=None):
+        return default
+
+    def clear(self):
+        pass
+
+# -------------------------------------------------------------------------------------------------
+
+class TTLCache(CacheBackend):
+    """ A thread-safe, size-bounded, process-local cache whose entries expire after a time-to-live.
+    Expired entries are evicted lazily when they are looked up, or in bulk by `sweep`. When the
+    cache is full, least-recently-used entries are evicted to make room for new ones.
+
+    Args:
+        max_entries (int): The maximum number of entries held at any one time.
+        default_ttl (float): Seconds an entry lives for if `set` isn't given an explicit expiry.
+        max_bytes (int): The maximum total size of the entries held at any one time, as measured by
+            `sizeof`. `None` for no limit.
+        sizeof (callable): Returns the approximate size in bytes of a cached value. Required if
+            `max_bytes` is set.
+
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=3600, max_bytes=None, sizeof=None):
+        super().__init__()
+
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_bytes   = max_bytes
+
+        self._sizeof  = sizeof
+        self._bytes   = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, key, default=None):
+        """ Returns the value cached for `key`, or `default` if there is no live entry for it. """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at, _ = entry
+            if expires_at <= time():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """ Caches `value` for `key`. The entry expires at the epoch timestamp `expires_at` if it is
+        supplied, otherwise `ttl` seconds (or the cache's default TTL) from now. """
+
+        if expires_at is None:
+            expires_at = time() + (self.default_ttl if ttl is None else ttl)
+
+        size = self._sizeof(value) if self._sizeof else 0
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or \
+                  (self.max_bytes is not None and self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+
+    def pop(self, key, default=None):
+        """ Removes the entry for `key`, and returns its value or `default` if it wasn't cached. """
+
+        with self._lock:
+            entry = self._remove(key)
+
+        return default if entry is None else entry[0]
+
+
+    def clear(self):
+        """ Removes every entry from the cache. """
+
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+    def sweep(self):
+        """ Evicts every expired entry, and returns the number of entries which were removed. """
+
+        now = time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[1] <= now]
+            for key in expired:
+                self._remove(key)
+
+        return len(expired)
+
+
+    def stats(self):
+        """ Returns a dict of statistics about this cache's usage and contents. """
+
+        stats = super().stats()
+        stats['entries'] = len(self._entries)
+        stats['bytes']   = self._bytes
+
+        return stats
+
+
+    def _remove(self, key):
+        """ Removes and returns the entry for `key`, if there is one. Must hold the lock. """
+
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+        return entry
@@ -0,0 +1,63 @@
+""" Init for cloudCache configuration package. A setting is read from an environment variable if one
+is set, otherwise from the INI file named by the CLOUDCACHE_CONFIG environment variable, otherwise
+it takes its default value.
+
+The setting `key` in section `section` is read from the environment variable
+CLOUDCACHE_{SECTION}_{KEY}, or from the file as:
+
+    [section]
+    key = value
+
+"""
+
+# pylint: disable=W0622
+# disable redefined-builtin warning on the `type` argument
+
+from configparser import ConfigParser
+from os import environ
+
+# -------------------------------------------------------------------------------------------------
+
+CONFIG_FILE_VARIABLE = 'CLOUDCACHE_CONFIG'
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+_CONFIG_FILE = ConfigParser()
+
+if environ.get(CONFIG_FILE_VARIABLE):
+    with open(environ[CONFIG_FILE_VARIABLE]) as config_file:
+        _CONFIG_FILE.read_file(config_file)
+
+# -------------------------------------------------------------------------------------------------
+
+def get_setting(section, key, default=None, type=str):
+    """ Returns the value of a setting.
+
+    Args:
+        section (string): The setting's section, e.g. 'db'.
+        key (string): The setting's name within its section, e.g. 'pool_size'.
+        default: The value returned if the setting isn't set anywhere.
+        type (callable): Converts the setting's string value, e.g. int. For `bool`, any of '1',
+            'true', 'yes' or 'on' (in any case) is True, and anything else False.
+
+    Returns:
+        The setting's value, converted by `type`, or `default`.
+
+    Raises:
+        ValueError: If the setting's value can't be converted by `type`.
+
+    """
+
+    variable = 'CLOUDCACHE_{}_{}'.format(section, key).upper()
+
+    if variable in environ:
+        value = environ[variable]
+    elif _CONFIG_FILE.has_option(section, key):
+        value = _CONFIG_FILE.get(section, key)
+    else:
+        return default
+
+    if type is bool:
+        return value.strip().lower() in _TRUE_VALUES
+
+    return type(value)
@@ -34,3 +34,10 @@ class NoteDoesntExistError(CloudCacheError):
 class NoteAlreadyExistsError(CloudCacheError):
     """ Raised when attempting to create a Note for a specific notebook, and a Note with that key
     already exists for that notebook. """
+
+class NoteVersionMismatchError(CloudCacheError):
+    """ Raised when attempting to update a Note on the condition that it's at a given version (e.g.
+    the version the client last read), and it has been updated since. """
+
+class InvalidSearchQueryError(CloudCacheError):
+    """ Raised when a search query has no terms to search for, or too many. """
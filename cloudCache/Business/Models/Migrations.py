@@ -0,0 +1,141 @@
+""" Contains schema migrations for existing cloudCache databases. `create_all` only creates tables
+which don't exist yet, so changes to existing tables (such as new columns and indexes) are applied
+here. """
+
+from sqlalchemy import bindparam, inspect, select
+from sqlalchemy.schema import CreateColumn
+
+from . import SQL_ALCHEMY_BASE
+from .Note import Note
+from .NoteValue import measure_value
+from .Search import create_search_index
+
+# -------------------------------------------------------------------------------------------------
+
+# Notes whose value metadata is filled in per statement, see backfill_value_metadata
+BACKFILL_BATCH_SIZE = 1000
+
+# -------------------------------------------------------------------------------------------------
+
+def create_missing_columns(engine):
+    """ Adds any column declared on a cloudCache model which doesn't exist in the database yet.
+    Existing rows get the column's server default, so a new NOT NULL column must have one.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine for the database to migrate.
+
+    Returns:
+        list: The names of the columns which were added, as `table.column`.
+
+    """
+
+    inspector = inspect(engine)
+    preparer  = engine.dialect.identifier_preparer
+    added = list()
+
+    for table in SQL_ALCHEMY_BASE.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+
+        for column in table.columns:
+            if column.name not in existing:
+                definition = CreateColumn(column).compile(dialect=engine.dialect)
+                engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(preparer.format_table(table),
+                                                                     definition))
+                added.append('{}.{}'.format(table.name, column.name))
+
+    return added
+
+
+def backfill_value_metadata(engine, batch_size=BACKFILL_BATCH_SIZE):
+    """ Fills in the value_size and value_hash of the notes which don't have them, i.e. which were
+    created before the columns existed, and so have their values stored inline. The notes are
+    read and updated `batch_size` at a time, in order of ID. Their last_updated times and versions
+    are left alone, as their values haven't changed.
+
+    Each batch is committed as it's done, so if the backfill is interrupted, running it again picks
+    up the notes it hadn't reached yet.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine for the database to migrate.
+        batch_size (int): The maximum number of notes read and updated per statement.
+
+    Returns:
+        int: The number of notes which were updated.
+
+    """
+
+    table = Note.__table__
+    update = table.update()\
+                  .where(table.c.id == bindparam('note_id'))\
+                  .values(value_size=bindparam('size'), value_hash=bindparam('digest'),
+                          last_updated=table.c.last_updated)
+
+    after, updated = 0, 0
+
+    while True:
+        rows = engine.execute(select([table.c.id, table.c.value])
+                              .where(table.c.value_size.is_(None))
+                              .where(table.c.value.isnot(None))
+                              .where(table.c.id > after)
+                              .order_by(table.c.id)
+                              .limit(batch_size)).fetchall()
+        if not rows:
+            break
+
+        batch = list()
+        for note_id, value in rows:
+            size, digest = measure_value(value)
+            batch.append({'note_id': note_id, 'size': size, 'digest': digest})
+
+        engine.execute(update, batch)
+
+        after, updated = rows[-1].id, updated + len(rows)
+
+    return updated
+
+
+def create_missing_indexes(engine):
+    """ Creates any index declared on a cloudCache model which doesn't exist in the database yet.
+
+    Creating a unique index fails if the table already contains duplicate rows for it (for example
+    two notes with the same key in one notebook, which the old query-then-insert pattern could let
+    through); those rows have to be cleaned up by hand before the migration can complete.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine for the database to migrate.
+
+    Returns:
+        list: The names of the indexes which were created.
+
+    """
+
+    inspector = inspect(engine)
+    created = list()
+
+    for table in SQL_ALCHEMY_BASE.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+
+    return created
+
+
+def upgrade(engine):
+    """ Brings the schema of an existing cloudCache database up to date with the models.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine for the database to migrate.
+
+    """
+
+    create_missing_columns(engine)
+    create_missing_indexes(engine)
+
+    # run every time, not just when value_size is added, so that a backfill interrupted part way
+    # through is finished by the next upgrade; once it's complete, its one query finds nothing
+    backfill_value_metadata(engine)
+
+    create_search_index(engine)
@@ -3,15 +3,46 @@
 # pylint: disable=W0232,C0103
 # disable no-init warning on Note model, and name-too-short warning on `id` variable
 
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, backref, object_session, Session
 from sqlalchemy_utils.types import ArrowType
 
 from . import SQL_ALCHEMY_BASE, JsonMixin, DB_SESSION as db
 from . import Notebook
-from ..Errors import NoteAlreadyExistsError, NoteDoesntExistError
+from .Pagination import get_page
+from .JsonMixin import encode_json
+from .NoteTombstone import record_note_deletions, get_last_deletion
+from .NoteValue import prepare_value, write_value_chunks, delete_value_chunks, ChunkedValue
+from ..Cache import TTLCache
+from ..Errors import NoteAlreadyExistsError, NoteDoesntExistError, NoteVersionMismatchError
 
 from arrow import now as arrow_now
+from collections import OrderedDict
+
+# -------------------------------------------------------------------------------------------------
+
+# The note cache holds (owner user ID, OrderedDict representation, last modified datetime) for
+# recently-read notes, keyed by note ID. See set_note_cache for plugging in a different backend.
+NOTE_CACHE_MAX_ENTRIES = 100000
+NOTE_CACHE_MAX_BYTES   = 64 * 1024 * 1024
+NOTE_CACHE_TTL         = 300 # seconds
+
+_NOTE_CACHE = TTLCache(max_entries=NOTE_CACHE_MAX_ENTRIES,
+                       default_ttl=NOTE_CACHE_TTL,
+                       max_bytes=NOTE_CACHE_MAX_BYTES,
+                       sizeof=lambda entry: len(encode_json(entry[1])))
+
+# key in Session.info of the IDs of notes changed by the session's transaction
+_STALE_NOTE_IDS = 'stale_note_ids'
+
+# The most notes that can be looked up at once by get_note_dicts or get_notes_by_keys, which look
+# them up with a single IN query, and the most keys import_notes looks up per IN query
+MAX_NOTES_PER_LOOKUP = 1000
+
+# The greatest Unicode code point, see _get_prefix_upper_bound
+_MAX_CHARACTER = chr(0x10FFFF)
 
 # -------------------------------------------------------------------------------------------------
 
@@ -22,14 +53,30 @@ class Note(JsonMixin, SQL_ALCHEMY_BASE):
         id (int): Unique ID of this note.
         notebook_id (int): Unique ID of this note's parent notebook.
         key (string): Key for this note.
-        value (string): Value/contents of this note.
+        value (string): Value/contents of this note, if it's stored inline, or `None` if it's too
+            large and is stored in chunks instead (see NoteValue).
         created_on (Arrow): Date/time that this note was originally created.
         last_updated (Arrow): Date/time that this note was last modified.
+        version (int): Number of this version of the note, starting from 1, and incremented every
+            time the note is updated (see update_note).
+        value_size (int): Size of this note's value, in bytes (UTF-8 encoded, for a string).
+        value_hash (string): SHA-256 hash of this note's value, in hex.
+        value_encoding (string): How the chunks of this note's value are stored (see NoteValue),
+            or `None` if the value is stored inline.
         notebook (cloudCache.Business.Models.Notebook): This note's Notebook object.
 
     """
 
     __tablename__ = 'NOTE'
+    __table_args__ = (
+        # one key per notebook; also serves lookups of a notebook's notes
+        Index('ux_note_notebook_id_key', 'notebook_id', 'key', unique=True),
+        # serves the pages of a notebook's notes in ID order without sorting the whole notebook,
+        # see get_notes_page
+        Index('ix_note_notebook_id_id', 'notebook_id', 'id'),
+        # serves the notes changed since a sync cursor, see get_changed_notes_page
+        Index('ix_note_last_updated', 'last_updated'),
+    )
 
     id           = Column(Integer, primary_key=True)
     notebook_id  = Column(Integer, ForeignKey('NOTEBOOK.id'))
@@ -37,6 +84,11 @@ class Note(JsonMixin, SQL_ALCHEMY_BASE):
     value        = Column(String(255))
     created_on   = Column(ArrowType, default=arrow_now)
     last_updated = Column(ArrowType, default=arrow_now, onupdate=arrow_now)
+    version      = Column(Integer, nullable=False, default=1, server_default='1')
+
+    value_size     = Column(Integer)
+    value_hash     = Column(String(64))
+    value_encoding = Column(String(16))
 
     notebook = relationship(Notebook, backref=backref('notes', cascade='save-update, delete'))
 
@@ -61,16 +113,67 @@ class Note(JsonMixin, SQL_ALCHEMY_BASE):
 
 # -------------------------------------------------------------------------------------------------
 
+@event.listens_for(Note, 'before_delete')
+def _delete_value_chunks(mapper, connection, note): # pylint: disable=W0613
+    """ Deletes the chunks of a note's value, if it's stored in chunks, before the note itself is
+    deleted. This also covers notes deleted by cascade, e.g. by delete_notebook and delete_user. """
+
+    if note.value_encoding is not None:
+        delete_value_chunks(connection, note.id)
+
+
+@event.listens_for(Note, 'after_update')
+@event.listens_for(Note, 'after_delete')
+def _mark_note_stale(mapper, connection, note): # pylint: disable=W0613
+    """ Records that a note was changed by the current transaction. Its cache entry is invalidated
+    once the transaction commits; invalidating it any earlier would let a concurrent read cache
+    the old version again. This also covers notes deleted by cascade, e.g. by delete_notebook and
+    delete_user. """
+
+    object_session(note).info.setdefault(_STALE_NOTE_IDS, set()).add(note.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_stale_notes(session):
+    """ Invalidates the cache entries of the notes changed by a committed transaction. """
+
+    _NOTE_CACHE.delete_many(session.info.pop(_STALE_NOTE_IDS, ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stale_notes(session):
+    """ Forgets the notes changed by a rolled-back transaction, they weren't changed after all. """
+
+    session.info.pop(_STALE_NOTE_IDS, None)
+
+
+def set_note_cache(backend):
+    """ Replaces the note cache with another cloudCache.Business.Cache.CacheBackend. An in-process
+    cache only sees invalidations made by its own process, so a server running several worker
+    processes should use a backend they share (or a NullCache). """
+
+    global _NOTE_CACHE # pylint: disable=W0603
+    _NOTE_CACHE = backend
+
+
+def get_note_cache():
+    """ Returns the note cache backend, e.g. for reporting its statistics. """
+    return _NOTE_CACHE
+
+# -------------------------------------------------------------------------------------------------
+
 def _get_attributes():
-    """ Returns a list of strings representing the Note attributes which are to be serialized to
+    """ Returns a tuple of strings representing the Note attributes which are to be serialized to
     JSON or an OrderedDict. """
 
-    return ['key', 'value', 'id', 'notebook_id', 'created_on', 'last_updated']
+    return ('key', 'value', 'id', 'notebook_id', 'created_on', 'last_updated', 'version',
+            'value_size', 'value_hash')
 
 # -------------------------------------------------------------------------------------------------
 
 def create_note(key, value, notebook):
-    """ Creates a Note entry in the database, and returns the Note object to the caller.
+    """ Creates a Note entry in the database, and returns the Note object to the caller. A value
+    too large to be stored inline is stored in chunks (see NoteValue), in the same transaction.
 
     Args:
         key (string): The new note's key.
@@ -80,21 +183,246 @@ def create_note(key, value, notebook):
     Returns:
         cloudCache.Business.Models.Note: The newly-created Note.
 
+    Raises:
+        cloudCache.Business.Errors.NoteAlreadyExistsError: If a note with the given key already
+            exists in this notebook.
+
     """
 
-    if db.query(Note).filter_by(key=key, notebook=notebook).first():
+    prepared = prepare_value(value)
+    new_note = Note(key=key, notebook=notebook, **prepared.columns)
+
+    db.add(new_note)
+
+    # uniqueness of the key is enforced by the ux_note_notebook_id_key index
+    try:
+        if prepared.source is not None:
+            # the chunks need the new note's ID
+            db.flush()
+            write_value_chunks(new_note.id, prepared, replace=False)
+
+        db.commit()
+
+    except IntegrityError:
+        db.rollback()
+
+        # any other violation isn't the caller's to resolve by choosing another key
+        if not _get_note_ids_by_key(notebook.id, [key]):
+            raise
+
         message = "A note with the key '{}' already exists for the notebook '{}'"
         message = message.format(key, notebook.name)
         raise NoteAlreadyExistsError(message)
 
-    new_note = Note(key=key, value=value, notebook=notebook)
-
-    db.add(new_note)
-    db.commit()
+    # a deleted note's ID can be reused by the database, make sure nothing stale is cached for it
+    _NOTE_CACHE.pop(new_note.id)
 
     return new_note
 
 
+def import_notes(notebook, items):
+    """ Creates many Notes in a Notebook at once. Keys which already exist in the notebook (or which
+    appear more than once in `items`) are skipped. The existing keys are found by IN queries for
+    the submitted keys, MAX_NOTES_PER_LOOKUP at a time, so the cost grows with the number of items
+    rather than the size of the notebook, and all the new notes are inserted in bulk in a single
+    transaction.
+
+    Args:
+        notebook (cloudCache.Business.Models.Notebook): The new notes' notebook.
+        items (list): (key, value) tuples for the new notes.
+
+    Returns:
+        list: An OrderedDict for each item, in order, with its `key`, its `status` ('created',
+            'exists' if the notebook already has a note with that key, or 'duplicate' if the key
+            appeared earlier in `items`), and for created notes, its `note_id`.
+
+    Raises:
+        cloudCache.Business.Errors.NoteAlreadyExistsError: If a note with one of the keys was
+            created concurrently, in which case none of the notes are created.
+
+    """
+
+    existing = set(_get_note_ids_by_key(notebook.id, _unique(key for key, _ in items)))
+
+    results, mappings, seen = list(), list(), set()
+
+    # key -> PreparedValue of the new notes whose values are stored in chunks
+    chunked = dict()
+
+    for key, value in items:
+        if key in existing:
+            status = 'exists'
+        elif key in seen:
+            status = 'duplicate'
+        else:
+            status = 'created'
+            prepared = prepare_value(value)
+            mappings.append(dict(prepared.columns, notebook_id=notebook.id, key=key))
+
+            if prepared.source is not None:
+                chunked[key] = prepared
+
+        seen.add(key)
+        results.append(OrderedDict([('key', key), ('status', status)]))
+
+    if not mappings:
+        return results
+
+    try:
+        db.bulk_insert_mappings(Note, mappings)
+
+        # bulk inserts don't return the new IDs, so look them up by key
+        new_ids = _get_note_ids_by_key(notebook.id, [mapping['key'] for mapping in mappings])
+
+        for key, prepared in chunked.items():
+            write_value_chunks(new_ids[key], prepared, replace=False)
+
+        db.commit()
+
+    except IntegrityError:
+        db.rollback()
+
+        if not _get_note_ids_by_key(notebook.id, [mapping['key'] for mapping in mappings]):
+            raise
+
+        message = "Notes with some of these keys were created in the notebook '{}' concurrently."
+        raise NoteAlreadyExistsError(message.format(notebook.name))
+
+    for result in results:
+        if result['status'] == 'created':
+            result['note_id'] = new_ids[result['key']]
+
+    # bulk inserts don't fire mapper events, invalidate any reused IDs by hand
+    _NOTE_CACHE.delete_many(r['note_id'] for r in results if r['status'] == 'created')
+
+    return results
+
+
+def export_notes_page(notebook, limit, after=None):
+    """ Retrieve one page of the Notes in a Notebook, in the format accepted by `import_notes`.
+
+    Args:
+        notebook (cloudCache.Business.Models.Notebook): The notes' notebook.
+        limit (int): The maximum number of notes to return.
+        after (int): The cursor returned with the previous page, or `None` for the first page.
+
+    Returns:
+        tuple: A list of dicts with the `note_key` and `note_value` of each note, and the cursor for
+            the next page (`None` if there isn't one). A value stored in chunks isn't read here,
+            its `note_value` is a NoteValue.ChunkedValue for the caller to read and decompress.
+
+    """
+
+    query = db.query(Note.id, Note.key, Note.value, Note.version, Note.value_encoding)\
+              .filter(Note.notebook_id == notebook.id)
+    rows, next_cursor = get_page(query, Note.id, limit, after=after)
+
+    notes = list()
+    for row in rows:
+        value = row.value
+        if row.value_encoding is not None:
+            value = ChunkedValue(row.id, row.version, row.value_encoding)
+
+        notes.append({'note_key': row.key, 'note_value': value})
+
+    return notes, next_cursor
+
+
+def get_notebook_version(notebook):
+    """ Returns the number of Notes in a Notebook, and the time it was last modified: when its most
+    recently modified note was last modified, or its last note was deleted (see NoteTombstone),
+    whichever is later. Together these change whenever a note in the notebook is created, modified
+    or deleted, so they identify a version of its listing. Aggregate queries over the notebook's
+    notes and tombstones, which don't load any of them.
+
+    Args:
+        notebook (cloudCache.Business.Models.Notebook): The notes' notebook.
+
+    Returns:
+        tuple: The number of notes, and the latest last_updated time as a naive UTC datetime
+            (`None` if the notebook is empty).
+
+    """
+
+    count, last_modified = db.query(func.count(Note.id), func.max(Note.last_updated))\
+                             .filter(Note.notebook_id == notebook.id)\
+                             .one()
+
+    last_deletion = get_last_deletion(notebook.id)
+    if last_deletion is not None and (last_modified is None or last_deletion > last_modified):
+        last_modified = last_deletion
+
+    if last_modified is not None:
+        last_modified = last_modified.to('utc').naive
+
+    return count, last_modified
+
+
+def get_notes_page(notebook, limit, after=None):
+    """ Retrieve one page of the Notes in a Notebook, ordered by ID.
+
+    Args:
+        notebook (cloudCache.Business.Models.Notebook): The notes' notebook.
+        limit (int): The maximum number of notes to return.
+        after (int): The cursor returned with the previous page, or `None` for the first page.
+
+    Returns:
+        tuple: The list of Notes, and the cursor for the next page (`None` if there isn't one).
+
+    """
+
+    query = db.query(Note).filter(Note.notebook_id == notebook.id)
+    return get_page(query, Note.id, limit, after=after)
+
+
+def get_changed_notes_page(user, since, limit, after=None):
+    """ Retrieve one page of a user's Notes which were created or modified after a given time,
+    ordered by ID.
+
+    Args:
+        user (cloudCache.Business.Models.User): The notes' user.
+        since (Arrow): Only notes last updated after this time are returned.
+        limit (int): The maximum number of notes to return.
+        after (int): The cursor returned with the previous page, or `None` for the first page.
+
+    Returns:
+        tuple: The list of Notes, and the cursor for the next page (`None` if there isn't one).
+
+    """
+
+    query = db.query(Note).join(Note.notebook)\
+              .filter(Notebook.user_id == user.id, Note.last_updated > since)
+
+    return get_page(query, Note.id, limit, after=after)
+
+
+def _get_note_and_owner(note_id):
+    """ Retrieves a Note together with the ID of the user that it belongs to, in a single query,
+    rather than lazy-loading note.notebook.user.
+
+    Raises:
+        cloudCache.Business.Errors.NoteDoesntExistError: If a note with the given ID doesn't exist.
+
+    """
+
+    result = db.query(Note, Notebook.user_id).join(Note.notebook).filter(Note.id == note_id).first()
+
+    if not result:
+        message = "Note with ID '{}' doesn't exist.".format(note_id)
+        raise NoteDoesntExistError(message)
+
+    return result
+
+
+def _check_owner(note_id, owner_id, user):
+    """ Raises NoteDoesntExistError if the note with the given ID and owner doesn't belong to the
+    given user. """
+
+    if owner_id != user.id:
+        message = "The note with ID '{}' doesn't belong to you ({}).".format(note_id, user.username)
+        raise NoteDoesntExistError(message)
+
+
 def get_note(note_id, user):
     """ Retrieve a Note for a given user.
 
@@ -110,19 +438,326 @@ def get_note(note_id, user):
 
     """
 
-    note = db.query(Note).filter_by(id=note_id).first()
+    note, owner_id = _get_note_and_owner(note_id)
+    _check_owner(note_id, owner_id, user)
 
-    if not note:
-        message = "Note with ID '{}' doesn't exist.".format(note_id)
-        raise NoteDoesntExistError(message)
+    return note
 
-    if note.notebook.user != user:
-        message = "The note with ID '{}' doesn't belong to you ({}).".format(note_id, user.username)
+
+def get_note_dict(note_id, user):
+    """ Retrieve the OrderedDict representation of a Note for a given user, and the time it was last
+    modified. Notes are read through the note cache, so a cached note is returned (and its ownership
+    checked) without touching the database.
+
+    Args:
+        note_id (string): The note's id.
+        user (cloudCache.Business.Models.User): The note's user.
+
+    Returns:
+        tuple: The Note's OrderedDict representation, and its last_updated time as a naive UTC
+            datetime.
+
+    Raises:
+        ValueError: If `note_id` isn't an integer.
+        cloudCache.Business.Errors.NoteDoesntExistError: If a note with the given ID doesn't exist for this user.
+
+    """
+
+    note_id = int(note_id)
+    cached = _NOTE_CACHE.get(note_id)
+
+    if cached is None:
+        note, owner_id = _get_note_and_owner(note_id)
+        cached = (owner_id, note.to_ordered_dict(), note.last_updated.to('utc').naive)
+        _NOTE_CACHE.set(note_id, cached)
+
+    owner_id, note_dict, last_modified = cached
+    _check_owner(note_id, owner_id, user)
+
+    # a copy, so the caller can't modify the cached note
+    return OrderedDict(note_dict), last_modified
+
+
+def update_note(note_id, user, key=None, value=None, versions=None):
+    """ Update a user's Note in place, keeping its ID, with a single UPDATE statement scoped to the
+    notes in the user's notebooks. The note's version is incremented, and its last_updated time
+    set, by the same statement. If the value is too large to be stored inline, its chunks (see
+    NoteValue) are written in the same transaction.
+
+    The update can be made conditional on the note's current version (compare-and-swap), so that
+    of two clients updating the same version of a note, only the first succeeds, and the other
+    finds out rather than overwriting the first's changes.
+
+    Args:
+        note_id (int): The note's ID.
+        user (cloudCache.Business.Models.User): The note's user.
+        key (string): The note's new key, or `None` to keep its key.
+        value (string): The note's new value, or `None` to keep its value.
+        versions (list): Only update the note if its current version is one of these, unless this
+            is `None`.
+
+    Returns:
+        int: The note's new version.
+
+    Raises:
+        cloudCache.Business.Errors.NoteDoesntExistError: If a note with the given ID doesn't exist
+            for this user.
+        cloudCache.Business.Errors.NoteVersionMismatchError: If the note's current version isn't
+            one of `versions`.
+        cloudCache.Business.Errors.NoteAlreadyExistsError: If the note's notebook already has
+            another note with the new key.
+
+    """
+
+    prepared = None if value is None else prepare_value(value)
+    return _update_note(note_id, user, key, prepared, versions)
+
+
+def upload_note_value(note_id, user, prepared, versions=None):
+    """ Replace the value of a user's Note with a value uploaded as raw bytes, which is stored in
+    chunks (see NoteValue), otherwise like update_note. The value is already compressed, so the
+    transaction only has to insert its chunks.
+
+    Args:
+        note_id (int): The note's ID.
+        user (cloudCache.Business.Models.User): The note's user.
+        prepared (cloudCache.Business.Models.NoteValue.PreparedValue): The uploaded value, from
+            NoteValue.prepare_upload.
+        versions (list): Only update the note if its current version is one of these, unless this
+            is `None`.
+
+    Returns:
+        int: The note's new version.
+
+    Raises:
+        cloudCache.Business.Errors.NoteDoesntExistError: If a note with the given ID doesn't exist
+            for this user.
+        cloudCache.Business.Errors.NoteVersionMismatchError: If the note's current version isn't
+            one of `versions`.
+
+    """
+
+    return _update_note(note_id, user, None, prepared, versions)
+
+
+def _update_note(note_id, user, key, prepared, versions):
+    """ Updates a note's key (unless it's `None`) and value (unless its PreparedValue is `None`),
+    as described by update_note. """
+
+    # last_updated is set by its onupdate default
+    changes = {Note.version: Note.version + 1}
+    if key is not None:
+        changes[Note.key] = key
+    if prepared is not None:
+        changes.update((getattr(Note, name), column_value)
+                       for name, column_value in prepared.columns.items())
+
+    owned_notebooks = db.query(Notebook.id).filter(Notebook.user_id == user.id).subquery()
+    query = db.query(Note).filter(Note.id == note_id, Note.notebook_id.in_(owned_notebooks))
+
+    if versions is not None:
+        query = query.filter(Note.version.in_(versions))
+
+    try:
+        updated = query.update(changes, synchronize_session=False)
+
+    except IntegrityError:
+        db.rollback()
+
+        # only a change of key can violate the ux_note_notebook_id_key index
+        notebook_id = db.query(Note.notebook_id).filter(Note.id == note_id).scalar()
+        if key is None or _get_note_ids_by_key(notebook_id, [key]).get(key) in (None, note_id):
+            raise
+
+        message = "A note with the key '{}' already exists in this note's notebook."
+        raise NoteAlreadyExistsError(message.format(key))
+
+    if not updated:
+        db.rollback()
+
+        # find out why: either there's no such note for this user, or it's at another version
+        note, owner_id = _get_note_and_owner(note_id)
+        _check_owner(note_id, owner_id, user)
+
+        message = "The note with ID '{}' has been updated since (it's now at version {})."
+        raise NoteVersionMismatchError(message.format(note_id, note.version))
+
+    if versions is not None and len(versions) == 1:
+        version = versions[0] + 1
+    else:
+        # read back in the same transaction, so this is the version the update made
+        version = db.query(Note.version).filter(Note.id == note_id).scalar()
+
+    if prepared is not None:
+        # replaces the chunks of the previous value, if it had any
+        write_value_chunks(note_id, prepared)
+
+    # bulk updates don't fire mapper events, so mark the note's cache entry to be invalidated when
+    # the update is committed by hand (see _mark_note_stale)
+    db().info.setdefault(_STALE_NOTE_IDS, set()).add(note_id)
+    db.commit()
+
+    return version
+
+
+def get_note_dicts(note_ids, user):
+    """ Retrieve the OrderedDict representations of many of a user's Notes at once. Notes are read
+    through the note cache (see get_note_dict), and the ones which aren't cached are loaded with a
+    single IN query.
+
+    Args:
+        note_ids (list): The notes' IDs, as ints. At most MAX_NOTES_PER_LOOKUP.
+        user (cloudCache.Business.Models.User): The notes' user.
+
+    Returns:
+        tuple: A list of the OrderedDict representations of the notes which exist for this user, in
+            the order of `note_ids` (without duplicates), and a list of the IDs which don't.
+
+    """
+
+    note_ids = _unique(note_ids)
+    cached   = {note_id: _NOTE_CACHE.get(note_id) for note_id in note_ids}
+    uncached = [note_id for note_id, entry in cached.items() if entry is None]
+
+    if uncached:
+        notes = db.query(Note, Notebook.user_id).join(Note.notebook)\
+                  .filter(Note.id.in_(uncached))
+
+        for note, owner_id in notes:
+            entry = (owner_id, note.to_ordered_dict(), note.last_updated.to('utc').naive)
+            _NOTE_CACHE.set(note.id, entry)
+            cached[note.id] = entry
+
+    found, missing = list(), list()
+
+    for note_id in note_ids:
+        entry = cached[note_id]
+
+        if entry is not None and entry[0] == user.id:
+            found.append(OrderedDict(entry[1]))
+        else:
+            missing.append(note_id)
+
+    return found, missing
+
+
+def get_note_by_key(notebook_id, key, user):
+    """ Retrieve a user's Note by its notebook and key, with a single query on the notebook's
+    (notebook_id, key) index.
+
+    Args:
+        notebook_id (int): The ID of the note's notebook.
+        key (string): The note's key.
+        user (cloudCache.Business.Models.User): The note's user.
+
+    Returns:
+        cloudCache.Business.Models.Note: The Note.
+
+    Raises:
+        cloudCache.Business.Errors.NoteDoesntExistError: If the user has no notebook with this ID,
+            or the notebook has no note with this key.
+
+    """
+
+    note = db.query(Note).join(Note.notebook)\
+             .filter(Note.notebook_id == notebook_id, Note.key == key,
+                     Notebook.user_id == user.id)\
+             .first()
+
+    if not note:
+        message = "Note with key '{}' doesn't exist in notebook '{}'.".format(key, notebook_id)
         raise NoteDoesntExistError(message)
 
     return note
 
 
+def get_notes_by_keys(notebook, keys):
+    """ Retrieve many of the Notes in a Notebook by their keys, with a single IN query on the
+    notebook's (notebook_id, key) index.
+
+    Args:
+        notebook (cloudCache.Business.Models.Notebook): The notes' notebook.
+        keys (list): The notes' keys. At most MAX_NOTES_PER_LOOKUP.
+
+    Returns:
+        tuple: A list of the Notes which exist, in the order of `keys` (without duplicates), and a
+            list of the keys which don't.
+
+    """
+
+    keys  = _unique(keys)
+    notes = db.query(Note).filter(Note.notebook_id == notebook.id, Note.key.in_(keys))
+    notes = {note.key: note for note in notes}
+
+    return [notes[key] for key in keys if key in notes], [key for key in keys if key not in notes]
+
+
+def get_notes_by_prefix_page(notebook, prefix, limit, after=None):
+    """ Retrieve one page of the Notes in a Notebook whose keys start with a prefix, ordered by
+    key. The prefix is matched as a range of keys, `prefix <= key < upper bound`, which the database
+    scans on the notebook's (notebook_id, key) index, rather than with LIKE (which can't use the
+    index on every database, and gives `%` and `_` in keys a special meaning).
+
+    Args:
+        notebook (cloudCache.Business.Models.Notebook): The notes' notebook.
+        prefix (string): The prefix of the notes' keys.
+        limit (int): The maximum number of notes to return.
+        after (string): The cursor (a key) returned with the previous page, or `None` for the first
+            page.
+
+    Returns:
+        tuple: The list of Notes, and the cursor for the next page (`None` if there isn't one).
+
+    """
+
+    query = db.query(Note).filter(Note.notebook_id == notebook.id, Note.key >= prefix)
+
+    upper_bound = _get_prefix_upper_bound(prefix)
+    if upper_bound is not None:
+        query = query.filter(Note.key < upper_bound)
+
+    return get_page(query, Note.key, limit, after=after)
+
+
+def _get_prefix_upper_bound(prefix):
+    """ Returns the least string greater than every string which starts with `prefix`, i.e. the
+    prefix with its last character incremented, or `None` if there's no such string (every string
+    starts with an empty prefix). """
+
+    prefix = prefix.rstrip(_MAX_CHARACTER)
+
+    if not prefix:
+        return None
+
+    successor = ord(prefix[-1]) + 1
+
+    # surrogates aren't characters, and can't be encoded to be sent to the database
+    if 0xD800 <= successor <= 0xDFFF:
+        successor = 0xE000
+
+    return prefix[:-1] + chr(successor)
+
+
+def _get_note_ids_by_key(notebook_id, keys):
+    """ Returns a dict of key -> note ID for the notes in a notebook with any of `keys` (which
+    must be distinct), looked up with IN queries on the notebook's (notebook_id, key) index,
+    MAX_NOTES_PER_LOOKUP keys at a time. """
+
+    note_ids = dict()
+
+    for start in range(0, len(keys), MAX_NOTES_PER_LOOKUP):
+        batch = keys[start:start + MAX_NOTES_PER_LOOKUP]
+        note_ids.update(db.query(Note.key, Note.id)
+                          .filter(Note.notebook_id == notebook_id, Note.key.in_(batch)))
+
+    return note_ids
+
+
+def _unique(items):
+    """ Returns a list of the distinct items in an iterable, in the order they first appear. """
+    return list(OrderedDict.fromkeys(items))
+
+
 def delete_note(note_id, user):
     """ Delete a Note for a given user.
 
@@ -135,15 +770,11 @@ def delete_note(note_id, user):
 
     """
 
-    note = db.query(Note).filter_by(id=note_id).first()
-
-    if not note:
-        message = "Note with ID '{}' doesn't exist.".format(note_id)
-        raise NoteDoesntExistError(message)
+    note, owner_id = _get_note_and_owner(note_id)
+    _check_owner(note_id, owner_id, user)
 
-    if note.notebook.user != user:
-        message = "The note with ID '{}' doesn't belong to you ({}).".format(note_id, user.username)
-        raise NoteDoesntExistError(message)
+    record_note_deletions(note.notebook_id, owner_id, [note.id])
 
+    # the note's cache entry is invalidated when the delete is committed, see _mark_note_stale
     db.delete(note)
     db.commit()
\ No newline at end of file
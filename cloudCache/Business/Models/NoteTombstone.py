@@ -0,0 +1,171 @@
+""" Contains NoteTombstone SQLAlchemy model, and utility functions for manipulating this model. """
+
+# pylint: disable=W0232,C0103
+# Disable no-init warning on NoteTombstone model
+# Disable name-too-short warning on `id` variable
+
+from sqlalchemy import Column, Integer, Index, func
+from sqlalchemy_utils.types import ArrowType
+
+from . import SQL_ALCHEMY_BASE, JsonMixin, DB_SESSION as db
+
+import arrow
+
+# -------------------------------------------------------------------------------------------------
+
+# How long a deletion is remembered for. A client which last synced longer ago than this can no
+# longer be told what was deleted, and has to fetch everything again.
+TOMBSTONE_RETENTION_DAYS = 30
+
+# -------------------------------------------------------------------------------------------------
+
+class NoteTombstone(JsonMixin, SQL_ALCHEMY_BASE):
+    """ Records the deletion of a cloudCache note, so that clients syncing their notes incrementally
+    can find out about it. The IDs aren't foreign keys, as the rows they refer to are gone.
+
+    Attributes:
+        id (int): Unique ID of this tombstone.
+        note_id (int): Unique ID of the deleted note.
+        notebook_id (int): Unique ID of the deleted note's notebook.
+        user_id (int): Unique ID of the deleted note's user.
+        deleted_on (Arrow): Date/time that the note was deleted.
+
+    """
+
+    __tablename__ = 'NOTE_TOMBSTONE'
+    __table_args__ = (
+        # serves a user's deletions since a sync cursor
+        Index('ix_note_tombstone_user_id_deleted_on', 'user_id', 'deleted_on'),
+        # serves the latest deletion from a notebook, see Note.get_notebook_version
+        Index('ix_note_tombstone_notebook_id_deleted_on', 'notebook_id', 'deleted_on'),
+        # serves pruning of expired tombstones
+        Index('ix_note_tombstone_deleted_on', 'deleted_on'),
+    )
+
+    id          = Column(Integer, primary_key=True)
+    note_id     = Column(Integer)
+    notebook_id = Column(Integer)
+    user_id     = Column(Integer)
+    deleted_on  = Column(ArrowType, default=arrow.utcnow)
+
+
+    def __repr__(self):
+        self_repr = 'NoteTombstone(note_id={note_id}, notebook_id={nb_id})'
+        return self_repr.format(note_id=self.note_id, nb_id=self.notebook_id)
+
+
+    def to_ordered_dict(self):
+        """ Returns an OrderedDict representation of this NoteTombstone. """
+        return self._to_ordered_dict(_get_attributes())
+
+
+    def to_json(self, compact=True):
+        """ Returns a JSON representation of this NoteTombstone. """
+        return self._to_json(_get_attributes(), compact=compact)
+
+# -------------------------------------------------------------------------------------------------
+
+def _get_attributes():
+    """ Returns a tuple of strings representing the NoteTombstone attributes which are to be
+    serialized to JSON or an OrderedDict. """
+
+    return ('note_id', 'notebook_id', 'deleted_on')
+
+# -------------------------------------------------------------------------------------------------
+
+def record_note_deletions(notebook_id, user_id, note_ids):
+    """ Adds a NoteTombstone for each of the given notes to the current transaction. The caller
+    deletes the notes and commits, so the tombstones exist if and only if the deletion happened.
+
+    Args:
+        notebook_id (int): Unique ID of the deleted notes' notebook.
+        user_id (int): Unique ID of the deleted notes' user.
+        note_ids (list): Unique IDs of the deleted notes.
+
+    """
+
+    now = arrow.utcnow()
+    mappings = [{'note_id': note_id, 'notebook_id': notebook_id, 'user_id': user_id,
+                 'deleted_on': now} for note_id in note_ids]
+
+    if mappings:
+        db.bulk_insert_mappings(NoteTombstone, mappings)
+
+
+def get_tombstones_since(user, since):
+    """ Retrieve the NoteTombstones of a user's notes deleted after a given time.
+
+    Args:
+        user (cloudCache.Business.Models.User): The deleted notes' user.
+        since (Arrow): Only deletions after this time are returned.
+
+    Returns:
+        list: The NoteTombstones, oldest first.
+
+    """
+
+    return db.query(NoteTombstone)\
+             .filter(NoteTombstone.user_id == user.id, NoteTombstone.deleted_on > since)\
+             .order_by(NoteTombstone.deleted_on)\
+             .all()
+
+
+def get_last_deletion(notebook_id):
+    """ Returns the time a note was last deleted from a Notebook, as an Arrow, or `None` if no
+    deletion from it is remembered. """
+
+    return db.query(func.max(NoteTombstone.deleted_on))\
+             .filter(NoteTombstone.notebook_id == notebook_id)\
+             .scalar()
+
+
+def get_retention_horizon():
+    """ Returns the time before which deletions are no longer remembered, as an Arrow. """
+    return arrow.utcnow().replace(days=-TOMBSTONE_RETENTION_DAYS)
+
+
+def delete_expired_tombstones(batch_size=1000):
+    """ Delete any NoteTombstones older than the retention period, in batches of at most
+    `batch_size` rows, committing between batches (see UserAccessToken.delete_expired_tokens).
+
+    Args:
+        batch_size (int): The maximum number of tombstones to delete per statement.
+
+    Returns:
+        int: The number of tombstones which were deleted.
+
+    """
+
+    horizon = get_retention_horizon()
+    deleted = 0
+
+    while True:
+        expired_ids = db.query(NoteTombstone.id)\
+                        .filter(NoteTombstone.deleted_on <= horizon)\
+                        .limit(batch_size)\
+                        .all()
+        expired_ids = [row.id for row in expired_ids]
+
+        if not expired_ids:
+            break
+
+        db.query(NoteTombstone)\
+          .filter(NoteTombstone.id.in_(expired_ids))\
+          .delete(synchronize_session=False)
+        db.commit()
+
+        deleted += len(expired_ids)
+
+        if len(expired_ids) < batch_size:
+            break
+
+    return deleted
+
+
+def delete_user_tombstones(user_id):
+    """ Adds the deletion of every NoteTombstone belonging to a user to the current transaction.
+    Once the user is deleted, there's no client left to tell. """
+
+    db.query(NoteTombstone)\
+      .filter(NoteTombstone.user_id == user_id)\
+      .delete(synchronize_session=False)
@@ -0,0 +1,356 @@
+""" Contains NoteValueChunk SQLAlchemy model, and utility functions for storing and reading note
+values which are too large to be stored inline in NOTE.value.
+
+A value of up to INLINE_VALUE_MAX_LENGTH characters is stored in the note's own row, as it always
+has been. A longer value (or any value uploaded as raw bytes) is compressed and split into chunks of
+at most VALUE_CHUNK_SIZE bytes, stored in NOTE_VALUE_CHUNK, and the note's `value` is NULL. Either
+way, the note records the value's size and SHA-256 hash, so listings can describe large values
+without loading them, and clients can fetch them separately (and skip the ones they already have).
+
+The compression used for new values is the `notes.value_compression` setting: 'zlib' (the default),
+'zstd' (if the zstandard package is installed) or 'none'. Each note records the compression its
+value was stored with, so the setting can be changed at any time.
+
+Compressing and decompressing are kept apart from the queries which write and read chunks, so that
+callers can do that CPU-bound work off the DB executor's threads (see cloudCache.API.Concurrency),
+which hold a database connection while they work: prepare_upload and ValueDecompressor do the
+compression work, and write_value_chunks and ValueReader only run queries. """
+
+# pylint: disable=W0232
+# Disable no-init warning on NoteValueChunk model
+
+import hashlib
+import zlib
+from collections import namedtuple
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from sqlalchemy import Column, Integer, ForeignKey, LargeBinary
+
+from . import SQL_ALCHEMY_BASE, DB_SESSION as db
+from ..Config import get_setting
+from ..Errors import NoteVersionMismatchError
+
+try:
+    # optional zstd compression of large values
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# -------------------------------------------------------------------------------------------------
+
+# The longest value stored inline in NOTE.value, a String(255)
+INLINE_VALUE_MAX_LENGTH = 255
+
+# The most (compressed) bytes stored per NOTE_VALUE_CHUNK row. Large enough that a value takes few
+# rows, small enough to stay well within MySQL's default max_allowed_packet.
+VALUE_CHUNK_SIZE = 256 * 1024
+
+# The number of chunks read per query when streaming a value, see ValueReader
+CHUNKS_PER_READ = 4
+
+# The largest value that can be stored, in bytes
+MAX_VALUE_BYTES = get_setting('notes', 'max_value_bytes', 64 * 1024 * 1024, int)
+
+# Uploads are spooled in memory up to this many bytes, and to a temporary file beyond it
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+
+ZLIB_LEVEL = 6
+
+# Names of the encodings a value's chunks can be stored with
+ZLIB, ZSTD, IDENTITY = 'zlib', 'zstd', 'identity'
+
+# notes.value_compression setting -> the encoding new large values are stored with. zstd needs the
+# zstandard package, without it values are compressed with zlib instead.
+_COMPRESSION_ENCODINGS = {'zlib': ZLIB, 'zstd': ZSTD if zstandard else ZLIB, 'none': IDENTITY}
+
+VALUE_ENCODING = _COMPRESSION_ENCODINGS[get_setting('notes', 'value_compression', 'zlib')]
+
+# The columns of a Note which describe its value, and the value's compressed bytes if they're to be
+# stored in chunks (a readable binary file, positioned at the start, or `None` if the value is
+# stored inline)
+PreparedValue = namedtuple('PreparedValue', 'columns source')
+
+# A value stored in chunks, which has to be read with ValueReader and decompressed with
+# ValueDecompressor, in place of the value itself, e.g. in an export (see Note.export_notes_page)
+ChunkedValue = namedtuple('ChunkedValue', 'note_id version encoding')
+
+# -------------------------------------------------------------------------------------------------
+
+class NoteValueChunk(SQL_ALCHEMY_BASE):
+    """ One chunk of a large note value, stored with the note's value_encoding.
+
+    Attributes:
+        note_id (int): Unique ID of the note whose value this is a chunk of.
+        sequence (int): Position of this chunk in the value, starting from 0.
+        data (bytes): The chunk's (compressed) bytes.
+
+    """
+
+    __tablename__ = 'NOTE_VALUE_CHUNK'
+
+    note_id  = Column(Integer, ForeignKey('NOTE.id'), primary_key=True)
+    sequence = Column(Integer, primary_key=True, autoincrement=False)
+    data     = Column(LargeBinary(VALUE_CHUNK_SIZE))
+
+
+    def __repr__(self):
+        self_repr = 'NoteValueChunk(note_id={note_id}, sequence={sequence}, size={size})'
+        return self_repr.format(note_id=self.note_id, sequence=self.sequence, size=len(self.data))
+
+# -------------------------------------------------------------------------------------------------
+
+class _Identity(object):
+    """ Stands in for a compressor or decompressor object, for values stored uncompressed. """
+
+    def compress(self, data):
+        """ Returns `data` as it is. """
+        return data
+
+    decompress = compress
+
+    def flush(self):
+        """ Returns nothing, as nothing is buffered. """
+        return b''
+
+
+class ValueUpload(object):
+    """ Receives a value uploaded as raw bytes, a piece at a time as the request body arrives, and
+    measures it as it goes. The value is spooled in memory up to UPLOAD_SPOOL_BYTES, and to a
+    temporary file beyond that, so a large upload is never held in memory as a whole.
+
+    Attributes:
+        file (SpooledTemporaryFile): The bytes received so far.
+        size (int): The number of bytes received so far.
+
+    """
+
+    def __init__(self):
+        self.file  = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        self.size  = 0
+        self._hash = hashlib.sha256()
+
+
+    def write(self, data):
+        """ Appends a piece of the value. """
+
+        self.file.write(data)
+        self.size += len(data)
+        self._hash.update(data)
+
+
+    def hexdigest(self):
+        """ Returns the SHA-256 hash of the bytes received so far, in hex. """
+        return self._hash.hexdigest()
+
+
+    def close(self):
+        """ Discards the value. """
+        self.file.close()
+
+
+class ValueReader(object):
+    """ Reads a large note value's chunks back out a few at a time, as they're stored (compressed),
+    so that the value can be streamed without being held in memory as a whole, and decompressed
+    separately, see ValueDecompressor. Each `read` runs a single query, in a transaction of its own,
+    so the note may be updated part way through; chunks are only read while the note is still at
+    the version being read, and if it isn't by the end, the value read is incomplete and
+    NoteVersionMismatchError is raised.
+
+    Args:
+        note_id (int): Unique ID of the note.
+        version (int): The note's version.
+
+    Attributes:
+        done (bool): Whether all of the value has been read.
+
+    """
+
+    def __init__(self, note_id, version):
+        self._note_id    = note_id
+        self._version    = version
+        self._next_chunk = 0
+        self.done        = False
+
+
+    def read(self):
+        """ Returns the next few chunks of the value, joined, or `b''` once all of it has been read.
+
+        Raises:
+            cloudCache.Business.Errors.NoteVersionMismatchError: If the note was updated (or
+                deleted) while it was being read.
+
+        """
+
+        if self.done:
+            return b''
+
+        notes  = NoteValueChunk.metadata.tables['NOTE']
+        chunks = db.query(NoteValueChunk.data)\
+                   .join(notes, notes.c.id == NoteValueChunk.note_id)\
+                   .filter(NoteValueChunk.note_id == self._note_id,
+                           NoteValueChunk.sequence >= self._next_chunk,
+                           notes.c.version == self._version)\
+                   .order_by(NoteValueChunk.sequence)\
+                   .limit(CHUNKS_PER_READ)\
+                   .all()
+
+        self._next_chunk += len(chunks)
+
+        if len(chunks) < CHUNKS_PER_READ:
+            self.done = True
+            self._check_version(notes)
+
+        return b''.join(chunk.data for chunk in chunks)
+
+
+    def _check_version(self, notes):
+        """ Raises NoteVersionMismatchError if the note is no longer at the version being read, in
+        which case the chunks stopped matching part way through. """
+
+        version = db.query(notes.c.version).filter(notes.c.id == self._note_id).scalar()
+
+        if version != self._version:
+            message = "The note with ID '{}' was changed while its value was being read."
+            raise NoteVersionMismatchError(message.format(self._note_id))
+
+
+class ValueDecompressor(object):
+    """ Decompresses a value read by ValueReader, a piece at a time. Doesn't use the database.
+
+    Args:
+        encoding (string): The note's value_encoding.
+
+    """
+
+    def __init__(self, encoding):
+        self._decompressor = _get_decompressor(encoding)
+
+
+    def decompress(self, data, final=False):
+        """ Returns the decompressed bytes of the next piece of the value, and if it's the `final`
+        piece, of anything still buffered. """
+
+        decompressed = self._decompressor.decompress(data)
+
+        if final:
+            decompressed += self._decompressor.flush()
+
+        return decompressed
+
+# -------------------------------------------------------------------------------------------------
+
+def prepare_value(value):
+    """ Returns the PreparedValue for a string value: stored inline if it's short enough, and
+    compressed, to be stored in chunks, otherwise. A `None` value is stored as NULL, and any other
+    value as a string. """
+
+    if value is None:
+        return PreparedValue(_get_value_columns(None, None, None, None), None)
+
+    value = str(value)
+    data  = value.encode('utf-8')
+
+    if len(value) <= INLINE_VALUE_MAX_LENGTH:
+        columns = _get_value_columns(value, len(data), hashlib.sha256(data).hexdigest(), None)
+        return PreparedValue(columns, None)
+
+    columns = _get_value_columns(None, len(data), hashlib.sha256(data).hexdigest(), VALUE_ENCODING)
+    return PreparedValue(columns, _compress(BytesIO(data), VALUE_ENCODING))
+
+
+def prepare_upload(upload):
+    """ Returns the PreparedValue for a value received as a ValueUpload, which is always stored in
+    chunks, as it's raw bytes rather than a string. Compresses the whole upload, and doesn't use the
+    database, so it can run before the transaction which stores it. The caller closes the prepared
+    value's source once it's stored. """
+
+    upload.file.seek(0)
+
+    columns = _get_value_columns(None, upload.size, upload.hexdigest(), VALUE_ENCODING)
+    return PreparedValue(columns, _compress(upload.file, VALUE_ENCODING))
+
+
+def measure_value(value):
+    """ Returns the size in bytes and the SHA-256 hash (in hex) of a string value, as recorded for
+    notes whose value is stored inline. """
+
+    data = value.encode('utf-8')
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+def write_value_chunks(note_id, prepared, replace=True):
+    """ Adds the statements storing a prepared value's chunks for a note to the current transaction,
+    reading and inserting its compressed bytes one VALUE_CHUNK_SIZE chunk at a time.
+
+    Args:
+        note_id (int): Unique ID of the note.
+        prepared (PreparedValue): The note's new value.
+        replace (bool): Whether the note may have chunks from a previous value, which are deleted.
+
+    """
+
+    table = NoteValueChunk.__table__
+
+    if replace:
+        db.execute(table.delete().where(table.c.note_id == note_id))
+
+    if prepared.source is None:
+        return
+
+    for sequence, data in enumerate(iter(lambda: prepared.source.read(VALUE_CHUNK_SIZE), b'')):
+        db.execute(table.insert(), {'note_id': note_id, 'sequence': sequence, 'data': data})
+
+
+def delete_value_chunks(connection, note_id):
+    """ Deletes a note's chunks using a Connection, e.g. from a mapper event during a flush. """
+
+    table = NoteValueChunk.__table__
+    connection.execute(table.delete().where(table.c.note_id == note_id))
+
+# -------------------------------------------------------------------------------------------------
+
+def _get_value_columns(value, size, digest, encoding):
+    """ Returns the Note columns describing a value. """
+    return {'value': value, 'value_size': size, 'value_hash': digest, 'value_encoding': encoding}
+
+
+def _compress(source, encoding):
+    """ Returns a file of the bytes read from a binary file `source` compressed with an encoding,
+    positioned at the start. Like an upload, it's spooled to a temporary file once it's larger than
+    UPLOAD_SPOOL_BYTES. """
+
+    compressor = _get_compressor(encoding)
+    compressed = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+    for data in iter(lambda: source.read(VALUE_CHUNK_SIZE), b''):
+        compressed.write(compressor.compress(data))
+
+    compressed.write(compressor.flush())
+    compressed.seek(0)
+
+    return compressed
+
+
+def _get_compressor(encoding):
+    """ Returns a compressor object for an encoding, with `compress` and `flush` methods. """
+
+    if encoding == ZLIB:
+        return zlib.compressobj(ZLIB_LEVEL)
+
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor().compressobj()
+
+    return _Identity()
+
+
+def _get_decompressor(encoding):
+    """ Returns a decompressor object for an encoding, with `decompress` and `flush` methods. """
+
+    if encoding == ZLIB:
+        return zlib.decompressobj()
+
+    if encoding == ZSTD:
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    return _Identity()
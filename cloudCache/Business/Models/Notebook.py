@@ -5,12 +5,15 @@
 # Disable name-too-short warning on `id` variable
 # Notebook DOES have attribute "notes", it's created as a backref in Note model
 
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy_utils.types import ArrowType
 
 from . import SQL_ALCHEMY_BASE, JsonMixin, DB_SESSION as db
 from . import User
+from .Pagination import get_page
+from .NoteTombstone import record_note_deletions
 from ..Errors import NotebookAlreadyExistsError, NotebookDoesntExistError
 
 from arrow import now as arrow_now
@@ -30,6 +33,10 @@ class Notebook(JsonMixin, SQL_ALCHEMY_BASE):
     """
 
     __tablename__ = 'NOTEBOOK'
+    __table_args__ = (
+        # one name per user; also serves lookups of a user's notebooks
+        Index('ux_notebook_user_id_name', 'user_id', 'name', unique=True),
+    )
 
     id         = Column(Integer, primary_key=True)
     user_id    = Column(Integer, ForeignKey('USER.id'))
@@ -64,10 +71,10 @@ class Notebook(JsonMixin, SQL_ALCHEMY_BASE):
 # -------------------------------------------------------------------------------------------------
 
 def _get_attributes():
-    """ Returns a list of strings representing the Notebook attributes which are to be serialized
+    """ Returns a tuple of strings representing the Notebook attributes which are to be serialized
     to JSON or an OrderedDict. """
 
-    return ['name', 'id', 'user_id', 'created_on']
+    return ('name', 'id', 'user_id', 'created_on')
 
 # -------------------------------------------------------------------------------------------------
 
@@ -87,16 +94,26 @@ def create_notebook(name, user):
 
     """
 
-    if db.query(Notebook).filter_by(name=name, user=user).first():
+    new_notebook = Notebook(user_id=user.id, name=name)
+
+    db.add(new_notebook)
+
+    # uniqueness of the name is enforced by the ux_notebook_user_id_name index
+    try:
+        db.commit()
+
+    except IntegrityError:
+        db.rollback()
+
+        # any other violation isn't the caller's to resolve by choosing another name
+        if db.query(Notebook.id).filter(Notebook.user_id == user.id,
+                                        Notebook.name == name).first() is None:
+            raise
+
         message = "A notebook with the name '{}' already exists for the user '{}'"
         message = message.format(name, user.username)
         raise NotebookAlreadyExistsError(message)
 
-    new_notebook = Notebook(user=user, name=name)
-
-    db.add(new_notebook)
-    db.commit()
-
     return new_notebook
 
 
@@ -116,7 +133,7 @@ def get_notebook(notebook_id, user):
 
     """
 
-    notebook = db.query(Notebook).filter_by(id=notebook_id, user=user).first()
+    notebook = db.query(Notebook).filter_by(id=notebook_id, user_id=user.id).first()
     if not notebook:
         message = "{} doesn't have a notebook with ID '{}'.".format(user.username, notebook_id)
         raise NotebookDoesntExistError(message)
@@ -124,6 +141,24 @@ def get_notebook(notebook_id, user):
     return notebook
 
 
+def get_notebooks_page(user, limit, after=None):
+    """ Retrieve one page of a user's notebooks, as (id, name) rows ordered by ID.
+
+    Args:
+        user (cloudCache.Business.Models.User): The notebooks' user.
+        limit (int): The maximum number of notebooks to return.
+        after (int): The cursor returned with the previous page, or `None` for the first page.
+
+    Returns:
+        tuple: The list of (id, name) rows, and the cursor for the next page (`None` if there
+            isn't one).
+
+    """
+
+    query = db.query(Notebook.id, Notebook.name).filter(Notebook.user_id == user.id)
+    return get_page(query, Notebook.id, limit, after=after)
+
+
 def delete_notebook(notebook_id, user):
     """ Delete a Notebook for a given user.
 
@@ -142,9 +177,12 @@ def delete_notebook(notebook_id, user):
         message = "Notebook with ID '{}' doesn't exist.".format(notebook_id)
         raise NotebookDoesntExistError(message)
 
-    if notebook.user != user:
+    if notebook.user_id != user.id:
         message = "The notebook with ID '{}' doesn't belong to you ({}).".format(notebook_id, user.username)
         raise NotebookDoesntExistError(message)
 
+    # the notes are loaded to be deleted by the cascade in any case
+    record_note_deletions(notebook.id, user.id, [note.id for note in notebook.notes])
+
     db.delete(notebook)
     db.commit()
\ No newline at end of file
@@ -0,0 +1,32 @@
+""" Contains utility functions for keyset (cursor) pagination of model queries. """
+
+# -------------------------------------------------------------------------------------------------
+
+def get_page(query, column, limit, after=None):
+    """ Returns one page of a query, ordered by a unique, indexed column (normally the primary key).
+    Pages are selected with `column > after` rather than an OFFSET, so fetching a page deep into a
+    large result costs the same as fetching the first one.
+
+    Args:
+        query (sqlalchemy.orm.Query): The query to paginate.
+        column (sqlalchemy.Column): The unique column to order and paginate by.
+        limit (int): The maximum number of rows on the page.
+        after (int): The cursor returned with the previous page, or `None` for the first page.
+
+    Returns:
+        tuple: The rows on the page, and the cursor for the next page (`None` if this is the last
+            page).
+
+    """
+
+    if after is not None:
+        query = query.filter(column > after)
+
+    # fetch one extra row, to find out whether there's a next page without a COUNT query
+    rows = query.order_by(column).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, getattr(rows[-1], column.key)
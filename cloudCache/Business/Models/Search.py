@@ -0,0 +1,240 @@
+""" Contains full-text search over the keys and values of a user's notes. The inverted index is kept
+by the database itself, so every way of changing notes (create_note, import_notes, deletion by
+cascade, bulk inserts) keeps it up to date:
+
+* MySQL: a FULLTEXT index on NOTE (key, value), searched in boolean mode.
+* SQLite: an FTS5 table, NOTE_FTS, indexing NOTE's rows, kept in sync by triggers on NOTE, and
+  ranked by BM25.
+
+Both are created by create_search_index, which the schema migrations run (see Migrations). On any
+other database, or a SQLite build without FTS5, notes are searched with LIKE instead, which scans
+them all: correct, but only fast enough for small databases.
+
+Every backend searches NOTE.value, so only values stored inline (of up to INLINE_VALUE_MAX_LENGTH
+characters) are searched. A larger value, or one uploaded as raw bytes, is stored compressed in
+chunks, with NOTE.value NULL (see NoteValue), so its note is only found by its key. Indexing those
+values would mean decompressing every one of them on every write, inside the writing
+transaction. """
+
+import re
+
+from sqlalchemy import case, inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import column, table
+
+from . import DB_SESSION as db
+from .Note import Note
+from .Notebook import Notebook
+from ..Errors import InvalidSearchQueryError
+
+# -------------------------------------------------------------------------------------------------
+
+FULLTEXT_INDEX = 'ft_note_key_value'
+FTS_TABLE      = 'NOTE_FTS'
+
+# The most terms a query may contain, and the deepest a query may page into its results. Ranked
+# results are paged by OFFSET (they have no stable key to page by), so every page costs as much as
+# all the pages before it.
+MAX_SEARCH_TERMS  = 10
+MAX_SEARCH_OFFSET = 1000
+
+# A search term is a run of letters, digits and underscores, as the full-text tokenizers see them
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+_FTS = table(FTS_TABLE, column('rowid'), column('rank'))
+
+_SQLITE_FTS_DDL = (
+    'CREATE VIRTUAL TABLE "{fts}" USING fts5("key", "value", content=\'NOTE\', '
+    'content_rowid=\'id\')',
+
+    'CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON "NOTE" BEGIN '
+    'INSERT INTO "{fts}" (rowid, "key", "value") VALUES (new.id, new."key", new."value"); END',
+
+    'CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON "NOTE" BEGIN '
+    'INSERT INTO "{fts}" ("{fts}", rowid, "key", "value") '
+    'VALUES (\'delete\', old.id, old."key", old."value"); END',
+
+    'CREATE TRIGGER IF NOT EXISTS note_fts_update AFTER UPDATE OF "key", "value" ON "NOTE" BEGIN '
+    'INSERT INTO "{fts}" ("{fts}", rowid, "key", "value") '
+    'VALUES (\'delete\', old.id, old."key", old."value"); '
+    'INSERT INTO "{fts}" (rowid, "key", "value") VALUES (new.id, new."key", new."value"); END',
+
+    # indexes the notes which already exist
+    'INSERT INTO "{fts}" ("{fts}") VALUES (\'rebuild\')',
+)
+
+# Database URL -> the search backend used for it, see _get_backend
+_BACKENDS = dict()
+
+# -------------------------------------------------------------------------------------------------
+
+def create_search_index(engine):
+    """ Creates the full-text index over notes, if the database supports one and it doesn't exist
+    yet, and returns the name of the search backend the database uses: 'mysql', 'sqlite' or 'like'.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine for the database to migrate.
+
+    """
+
+    dialect = engine.dialect.name
+
+    if dialect == 'mysql':
+        indexes = {index['name'] for index in inspect(engine).get_indexes(Note.__tablename__)}
+        if FULLTEXT_INDEX not in indexes:
+            engine.execute('ALTER TABLE `NOTE` ADD FULLTEXT INDEX `{}` (`key`, `value`)'
+                           .format(FULLTEXT_INDEX))
+
+        backend = 'mysql'
+
+    elif dialect == 'sqlite':
+        backend = 'sqlite' if _has_fts_table(engine) or _create_fts_table(engine) else 'like'
+
+    else:
+        backend = 'like'
+
+    _BACKENDS[str(engine.url)] = backend
+    return backend
+
+
+def search_notes(user, query, limit, offset=0, notebook_id=None):
+    """ Search a user's notes for those whose key or value contains every term of a query, best
+    matches first. Values stored in chunks (see NoteValue) aren't searched, only their keys.
+
+    Args:
+        user (cloudCache.Business.Models.User): The notes' user.
+        query (string): The search terms, e.g. 'shopping list'. Anything other than letters, digits
+            and underscores separates terms.
+        limit (int): The maximum number of notes to return.
+        offset (int): The number of matching notes to skip, i.e. the cursor returned with the
+            previous page, or 0 for the first page.
+        notebook_id (int): Only search the notes in this notebook, if given.
+
+    Returns:
+        tuple: The list of matching Notes, and the cursor for the next page (`None` if there
+            isn't one, or it would be deeper than MAX_SEARCH_OFFSET).
+
+    Raises:
+        cloudCache.Business.Errors.InvalidSearchQueryError: If the query has no terms, or too many.
+
+    """
+
+    terms = _TERM_PATTERN.findall(query)
+
+    if not terms:
+        raise InvalidSearchQueryError('The search query must contain at least one word.')
+
+    if len(terms) > MAX_SEARCH_TERMS:
+        message = 'The search query must contain at most {} words.'.format(MAX_SEARCH_TERMS)
+        raise InvalidSearchQueryError(message)
+
+    notes = db.query(Note)\
+              .join(Notebook, Note.notebook_id == Notebook.id)\
+              .filter(Notebook.user_id == user.id)
+
+    if notebook_id is not None:
+        notes = notes.filter(Note.notebook_id == notebook_id)
+
+    backend = _get_backend()
+
+    if backend == 'sqlite':
+        notes = _match_fts(notes, terms)
+    elif backend == 'mysql':
+        notes = _match_fulltext(notes, terms)
+    else:
+        notes = _match_like(notes, terms)
+
+    # fetch one extra row, to find out whether there's a next page without a COUNT query
+    rows = notes.offset(offset).limit(limit + 1).all()
+
+    if len(rows) <= limit or offset + limit > MAX_SEARCH_OFFSET:
+        return rows[:limit], None
+
+    return rows[:limit], offset + limit
+
+# -------------------------------------------------------------------------------------------------
+
+def _match_fts(notes, terms):
+    """ Filters and orders a query of notes by an FTS5 match of every term, best BM25 rank first
+    (FTS5's rank is lower for better matches). """
+
+    # every term is quoted, which makes it a literal string rather than FTS5 query syntax
+    match = ' '.join('"{}"'.format(term) for term in terms)
+
+    return notes.join(_FTS, _FTS.c.rowid == Note.id)\
+                .filter(text('"{}" MATCH :match'.format(FTS_TABLE)).bindparams(match=match))\
+                .order_by(_FTS.c.rank, Note.id)
+
+
+def _match_fulltext(notes, terms):
+    """ Filters and orders a query of notes by a FULLTEXT match of every term, most relevant
+    first. """
+
+    # '+' requires every term to be present
+    against = ' '.join('+' + term for term in terms)
+    match   = 'MATCH(`NOTE`.`key`, `NOTE`.`value`) AGAINST (:{} IN BOOLEAN MODE)'
+
+    return notes.filter(text(match.format('against')).bindparams(against=against))\
+                .order_by(text(match.format('relevance') + ' DESC').bindparams(relevance=against),
+                          Note.id)
+
+
+def _match_like(notes, terms):
+    """ Filters a query of notes to those containing every term in their key or value, and orders
+    them with notes whose key contains the first term first. """
+
+    for term in terms:
+        pattern = _like_pattern(term)
+        notes = notes.filter(Note.key.like(pattern, escape='\\') |
+                             Note.value.like(pattern, escape='\\'))
+
+    key_match = case([(Note.key.like(_like_pattern(terms[0]), escape='\\'), 0)], else_=1)
+    return notes.order_by(key_match, Note.id)
+
+
+def _like_pattern(term):
+    """ Returns a LIKE pattern matching strings which contain `term`. Terms can contain
+    underscores, which are wildcards to LIKE, so they're escaped. """
+
+    return '%{}%'.format(term.replace('\\', '\\\\').replace('_', '\\_'))
+
+
+def _get_backend():
+    """ Returns the search backend for the database DB_SESSION is bound to, finding out which it is
+    the first time (e.g. if the schema was created by create_search_index in another process). """
+
+    engine = db.get_bind()
+    backend = _BACKENDS.get(str(engine.url))
+
+    if backend is None:
+        if engine.dialect.name == 'mysql':
+            backend = 'mysql'
+        elif engine.dialect.name == 'sqlite' and _has_fts_table(engine):
+            backend = 'sqlite'
+        else:
+            backend = 'like'
+
+        _BACKENDS[str(engine.url)] = backend
+
+    return backend
+
+
+def _has_fts_table(engine):
+    """ Returns whether a SQLite database has the NOTE_FTS table. """
+    return FTS_TABLE in inspect(engine).get_table_names()
+
+
+def _create_fts_table(engine):
+    """ Creates the NOTE_FTS table and its triggers in a SQLite database, and indexes the existing
+    notes, all in one transaction. Returns whether it succeeded, which it doesn't if this SQLite
+    build has no FTS5 module. """
+
+    try:
+        with engine.begin() as connection:
+            for statement in _SQLITE_FTS_DDL:
+                connection.execute(statement.format(fts=FTS_TABLE))
+
+    except OperationalError:
+        return False
+
+    return True
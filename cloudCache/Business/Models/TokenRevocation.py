@@ -0,0 +1,176 @@
+""" Contains TokenRevocation SQLAlchemy model, and utility functions for manipulating it. """
+
+# pylint: disable=W0232,C0103
+# Disable no-init warning on TokenRevocation model
+# Disable name-too-short warning on `id` variable
+
+from sqlalchemy import Column, Integer, Index
+from sqlalchemy_utils.types import ArrowType
+
+from . import SQL_ALCHEMY_BASE, JsonMixin, DB_SESSION as db
+
+import arrow
+
+# -------------------------------------------------------------------------------------------------
+
+# How long a revocation is remembered for. Signed access tokens are checked against revocations
+# without touching the database, so this must be longer than an access token lives (1 hour), or a
+# revoked token could outlive its revocation.
+REVOCATION_RETENTION_HOURS = 2
+
+# Process-local user ID -> time (as a float timestamp) the user's signed tokens were last revoked,
+# for the revocations made or loaded (see load_revocations) by this process
+_REVOKED = dict()
+
+# -------------------------------------------------------------------------------------------------
+
+class TokenRevocation(JsonMixin, SQL_ALCHEMY_BASE):
+    """ Records that every signed access token issued to a user up to a point in time is no longer
+    valid, e.g. because the user was deleted. Signed tokens aren't stored, so they can't be deleted
+    like UserAccessTokens; they're revoked instead. The user ID isn't a foreign key, as the user may
+    be gone.
+
+    Attributes:
+        id (int): Unique ID of this revocation.
+        user_id (int): Unique ID of the user whose tokens were revoked.
+        revoked_on (Arrow): Date/time that the tokens were revoked.
+
+    """
+
+    __tablename__ = 'TOKEN_REVOCATION'
+    __table_args__ = (
+        # serves loading and pruning revocations by time
+        Index('ix_token_revocation_revoked_on', 'revoked_on'),
+    )
+
+    id         = Column(Integer, primary_key=True)
+    user_id    = Column(Integer)
+    revoked_on = Column(ArrowType, default=arrow.utcnow)
+
+
+    def __repr__(self):
+        self_repr = 'TokenRevocation(user_id={user_id}, revoked_on="{revoked_on}")'
+        return self_repr.format(user_id=self.user_id, revoked_on=self.revoked_on)
+
+
+    def to_ordered_dict(self):
+        """ Returns an OrderedDict representation of this TokenRevocation. """
+        return self._to_ordered_dict(_get_attributes())
+
+
+    def to_json(self, compact=True):
+        """ Returns a JSON representation of this TokenRevocation. """
+        return self._to_json(_get_attributes(), compact=compact)
+
+# -------------------------------------------------------------------------------------------------
+
+def _get_attributes():
+    """ Returns a tuple of strings representing the TokenRevocation attributes which are to be
+    serialized to JSON or an OrderedDict. """
+
+    return ('user_id', 'revoked_on')
+
+# -------------------------------------------------------------------------------------------------
+
+def revoke_user_tokens(user_id):
+    """ Adds a TokenRevocation of every signed access token issued to a user so far to the current
+    transaction, and revokes them in this process straight away. Other processes see the revocation
+    once they next load_revocations.
+
+    Args:
+        user_id (int): Unique ID of the user.
+
+    """
+
+    now = arrow.utcnow()
+    db.add(TokenRevocation(user_id=user_id, revoked_on=now))
+    _remember(user_id, now.float_timestamp)
+
+
+def is_revoked(user_id, issued_at):
+    """ Returns whether a signed access token issued to a user at `issued_at` (a float timestamp)
+    has been revoked, as far as this process knows. Doesn't touch the database. """
+
+    revoked_at = _REVOKED.get(user_id)
+    return revoked_at is not None and issued_at <= revoked_at
+
+
+def load_revocations(since=None):
+    """ Loads the revocations made (by any process) after a given time into this process.
+
+    Args:
+        since (Arrow): Only revocations after this time are loaded. Defaults to the start of the
+            retention period, i.e. every revocation which is still remembered.
+
+    Returns:
+        Arrow: The time of the latest revocation loaded, to pass as `since` next time, or `since`
+            if there were none.
+
+    """
+
+    since = since or get_retention_horizon()
+
+    revocations = db.query(TokenRevocation.user_id, TokenRevocation.revoked_on)\
+                    .filter(TokenRevocation.revoked_on > since)\
+                    .all()
+
+    for user_id, revoked_on in revocations:
+        _remember(user_id, arrow.get(revoked_on).float_timestamp)
+        since = max(since, arrow.get(revoked_on))
+
+    return since
+
+
+def get_retention_horizon():
+    """ Returns the time before which revocations are no longer remembered, as an Arrow. """
+    return arrow.utcnow().replace(hours=-REVOCATION_RETENTION_HOURS)
+
+
+def delete_expired_revocations(batch_size=1000):
+    """ Delete any TokenRevocations older than the retention period from the database, in batches
+    of at most `batch_size` rows (see UserAccessToken.delete_expired_tokens), and forgets them in
+    this process.
+
+    Args:
+        batch_size (int): The maximum number of revocations to delete per statement.
+
+    Returns:
+        int: The number of revocations which were deleted from the database.
+
+    """
+
+    horizon = get_retention_horizon()
+    deleted = 0
+
+    for user_id, revoked_at in list(_REVOKED.items()):
+        if revoked_at <= horizon.float_timestamp:
+            _REVOKED.pop(user_id, None)
+
+    while True:
+        expired_ids = db.query(TokenRevocation.id)\
+                        .filter(TokenRevocation.revoked_on <= horizon)\
+                        .limit(batch_size)\
+                        .all()
+        expired_ids = [row.id for row in expired_ids]
+
+        if not expired_ids:
+            break
+
+        db.query(TokenRevocation)\
+          .filter(TokenRevocation.id.in_(expired_ids))\
+          .delete(synchronize_session=False)
+        db.commit()
+
+        deleted += len(expired_ids)
+
+        if len(expired_ids) < batch_size:
+            break
+
+    return deleted
+
+
+def _remember(user_id, revoked_at):
+    """ Records a revocation in this process, keeping the latest if there's one already. """
+
+    if revoked_at > _REVOKED.get(user_id, 0):
+        _REVOKED[user_id] = revoked_at
@@ -5,10 +5,22 @@
 # Disable name-too-short warning on `id` variable
 # User DOES have attribute "notebooks", it's created as a backref in Notebook model
 
+import hashlib
+import hmac
+import os
+
 from sqlalchemy import Column, Integer, String
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import subqueryload
 from sqlalchemy_utils.types import ArrowType, PasswordType
+from sqlalchemy_utils.types.password import Password
 
 from . import SQL_ALCHEMY_BASE, JsonMixin, DB_SESSION as db
+from .Pagination import get_page
+from .NoteTombstone import delete_user_tombstones
+from .TokenRevocation import revoke_user_tokens
+from ..Cache import TTLCache
+from ..Config import get_setting
 from ..Errors import UserAlreadyExistsError
 
 from arrow import now as arrow_now
@@ -16,6 +28,21 @@ from uuid import uuid4 as guid
 
 # -------------------------------------------------------------------------------------------------
 
+# PBKDF2 rounds for new password hashes. Hashes with any other number of rounds are rehashed with
+# this many the next time their user's password is verified (see verify_password).
+PASSWORD_ROUNDS = get_setting('auth', 'pbkdf2_rounds', 25000, int)
+
+# The credential cache remembers recently verified passwords for a short time, so that a client
+# sending the same password with every request only pays for the hash once. Entries are keyed on an
+# HMAC of the username, stored hash and password under a random per-process key, so the cache never
+# holds a password, or anything a password can be recovered from without the key.
+CREDENTIAL_CACHE_TTL = get_setting('auth', 'credential_cache_ttl', 60, float) # seconds
+
+_CREDENTIAL_CACHE = TTLCache(max_entries=10000, default_ttl=CREDENTIAL_CACHE_TTL)
+_CREDENTIAL_KEY   = os.urandom(32)
+
+# -------------------------------------------------------------------------------------------------
+
 class User(JsonMixin, SQL_ALCHEMY_BASE):
     """ Represents a cloudCache user.
 
@@ -40,7 +67,10 @@ class User(JsonMixin, SQL_ALCHEMY_BASE):
     email_address = Column(String(255))
     api_key       = Column(String(32))
     date_joined   = Column(ArrowType, default=arrow_now)
-    password      = Column(PasswordType(schemes=['pbkdf2_sha512']))
+    password      = Column(PasswordType(schemes=['pbkdf2_sha512'],
+                                        pbkdf2_sha512__default_rounds=PASSWORD_ROUNDS,
+                                        pbkdf2_sha512__min_rounds=PASSWORD_ROUNDS,
+                                        pbkdf2_sha512__max_rounds=PASSWORD_ROUNDS))
 
 
     def __repr__(self):
@@ -67,10 +97,10 @@ class User(JsonMixin, SQL_ALCHEMY_BASE):
 # -------------------------------------------------------------------------------------------------
 
 def _get_attributes():
-    """ Returns a list of strings representing the User attributes which are to be serialized to
+    """ Returns a tuple of strings representing the User attributes which are to be serialized to
     JSON or an OrderedDict. """
 
-    return ['username', 'id', 'first_name', 'last_name', 'email_address', 'api_key', 'date_joined']
+    return ('username', 'id', 'first_name', 'last_name', 'email_address', 'api_key', 'date_joined')
 
 # -------------------------------------------------------------------------------------------------
 
@@ -92,10 +122,6 @@ def create_user(username, first_name, last_name, email_address, password):
 
     """
 
-    if db.query(User).filter_by(username=username).first():
-        message = 'The username {} is already taken by another user'.format(username)
-        raise UserAlreadyExistsError(message)
-
     api_key = str(guid()).upper().replace('-', '')
 
     new_user = User(username=username,
@@ -106,18 +132,155 @@ def create_user(username, first_name, last_name, email_address, password):
                     password=password)
 
     db.add(new_user)
-    db.commit()
+
+    # uniqueness of the username is enforced by the unique constraint on USER.username
+    try:
+        db.commit()
+
+    except IntegrityError:
+        db.rollback()
+
+        # any other violation isn't the caller's to resolve by choosing another username
+        if db.query(User.id).filter(User.username == username).first() is None:
+            raise
+
+        message = 'The username {} is already taken by another user'.format(username)
+        raise UserAlreadyExistsError(message)
 
     return new_user
 
 
+def get_user_with_notebooks(username):
+    """ Retrieve a User along with all of their notebooks and notes, loaded up front by a fixed
+    number of queries (one per level) rather than one query per notebook.
+
+    Args:
+        username (string): The user's username.
+
+    Returns:
+        cloudCache.Business.Models.User: The User, or `None` if the username doesn't exist.
+
+    """
+
+    return db.query(User)\
+             .options(subqueryload('notebooks').subqueryload('notes'))\
+             .filter_by(username=username)\
+             .first()
+
+
+def get_users_page(limit, after=None):
+    """ Retrieve one page of all users, as (id, username) rows ordered by ID.
+
+    Args:
+        limit (int): The maximum number of users to return.
+        after (int): The cursor returned with the previous page, or `None` for the first page.
+
+    Returns:
+        tuple: The list of (id, username) rows, and the cursor for the next page (`None` if there
+            isn't one).
+
+    """
+
+    query = db.query(User.id, User.username)
+    return get_page(query, User.id, limit, after=after)
+
+
 def delete_user(user):
-    """ Delete a user.
+    """ Delete a user, and revoke any signed access tokens issued to them (their other tokens are
+    deleted with them, and evicted from the access token cache once the deletion is committed).
 
     Args:
         user (cloudCache.Business.Models.User): The user.
 
     """
 
+    delete_user_tombstones(user.id)
+    revoke_user_tokens(user.id)
+
     db.delete(user)
-    db.commit()
\ No newline at end of file
+    db.commit()
+
+
+def get_password_hash(username):
+    """ Retrieve a user's stored password hash, for verify_password.
+
+    Args:
+        username (string): The user's username.
+
+    Returns:
+        bytes: The hash, or `None` if the username doesn't exist.
+
+    """
+
+    row = db.query(User.password).filter_by(username=username).first()
+
+    if row is None or row.password is None:
+        return None
+
+    return row.password.hash
+
+
+def verify_password(username, password_hash, password):
+    """ Checks a password against a user's stored password hash. Doesn't touch the database, so the
+    (deliberately slow) hash can be computed away from the database threads. A password verified in
+    the last CREDENTIAL_CACHE_TTL seconds against the same hash is accepted without hashing it.
+
+    Args:
+        username (string): The user's username.
+        password_hash (bytes): The user's hash, from get_password_hash.
+        password (string): The password to check.
+
+    Returns:
+        tuple: Whether the password is correct, and a new hash of it if the stored hash is
+            outdated (e.g. was made with a different number of rounds), otherwise `None`. The new
+            hash should be stored with set_password_hash.
+
+    """
+
+    key = _credential_key(username, password_hash, password)
+
+    if _CREDENTIAL_CACHE.get(key):
+        return True, None
+
+    context = User.__table__.c.password.type.context
+    verified, new_hash = context.verify_and_update(password, password_hash)
+
+    if verified:
+        if new_hash is not None:
+            new_hash = new_hash.encode('utf-8') if isinstance(new_hash, str) else new_hash
+            key = _credential_key(username, new_hash, password)
+
+        _CREDENTIAL_CACHE.set(key, True)
+
+    return verified, new_hash
+
+
+def set_password_hash(username, password_hash):
+    """ Replaces a user's stored password hash with an already computed one, such as the new hash
+    returned by verify_password. """
+
+    db.query(User)\
+      .filter_by(username=username)\
+      .update({'password': Password(password_hash)}, synchronize_session=False)
+
+    db.commit()
+
+
+def set_credential_cache(backend):
+    """ Replaces the credential cache with another cloudCache.Business.Cache.CacheBackend, e.g. a
+    NullCache to verify every password in full. """
+
+    global _CREDENTIAL_CACHE # pylint: disable=W0603
+    _CREDENTIAL_CACHE = backend
+
+
+def get_credential_cache():
+    """ Returns the credential cache backend, e.g. for reporting its statistics. """
+    return _CREDENTIAL_CACHE
+
+
+def _credential_key(username, password_hash, password):
+    """ Returns the credential cache key for a username, stored hash and password. """
+
+    message = b'\0'.join((username.encode('utf-8'), password_hash, password.encode('utf-8')))
+    return hmac.new(_CREDENTIAL_KEY, message, hashlib.sha256).digest()
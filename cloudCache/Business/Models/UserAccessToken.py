@@ -4,12 +4,22 @@
 # Disable no-init warning on UserAccessToken model
 # Disable name-too-short warning on `id` variable
 
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship, backref
+import base64
+import hashlib
+import hmac
+import os
+from collections import namedtuple
+from time import time
+
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, event
+from sqlalchemy.orm import Session, object_session, relationship, backref
 from sqlalchemy_utils.types import ArrowType
 
 from . import SQL_ALCHEMY_BASE, JsonMixin, DB_SESSION as db
 from . import User
+from .TokenRevocation import is_revoked
+from ..Cache import TTLCache
+from ..Config import get_setting
 from ..Errors import UserDoesntExistError, InvalidApiKeyError
 
 import arrow
@@ -17,6 +27,38 @@ from uuid import uuid4 as guid
 
 # -------------------------------------------------------------------------------------------------
 
+ACCESS_TOKEN_LIFETIME_HOURS = 1
+
+# Process-local cache of access token string -> (TokenUser, expiry timestamp). Entries expire at
+# the same time as the token they represent, and are evicted once the token is deleted (see
+# _mark_token_stale), so a cache hit is a valid token without a query for the token or its user.
+_TOKEN_CACHE = TTLCache(max_entries=100000)
+
+# Session.info key of the set of access token strings deleted by the session's transaction
+_STALE_TOKENS = 'stale_access_tokens'
+
+# How access tokens are issued: 'database' tokens are random strings stored as UserAccessTokens,
+# and 'signed' tokens carry their user and expiry, signed with TOKEN_SECRET, so they're validated
+# without touching the database (see create_signed_token). Tokens of either kind are accepted in
+# 'signed' mode, so switching to it doesn't invalidate any tokens.
+TOKEN_MODES = ('database', 'signed')
+_TOKEN_MODE = get_setting('auth', 'token_mode', 'database')
+
+if _TOKEN_MODE not in TOKEN_MODES:
+    raise ValueError('auth.token_mode must be one of {}.'.format(', '.join(TOKEN_MODES)))
+
+# The key signed tokens are signed with. Every server process has to share it, so processes forked
+# from one server share the key it was started with; separate servers must configure the same one.
+# Without a configured key, signed tokens don't survive a restart.
+TOKEN_SECRET = get_setting('auth', 'token_secret', None)
+TOKEN_SECRET = TOKEN_SECRET.encode('utf-8') if TOKEN_SECRET else os.urandom(32)
+
+# The user a token was issued to, which is all it takes to authorize a request. Business functions
+# taking a user only use its ID and username, so they accept a TokenUser as well.
+TokenUser = namedtuple('TokenUser', 'id username')
+
+# -------------------------------------------------------------------------------------------------
+
 class UserAccessToken(JsonMixin, SQL_ALCHEMY_BASE):
     """ Represents a cloudCache UserAccessToken.
 
@@ -30,6 +72,11 @@ class UserAccessToken(JsonMixin, SQL_ALCHEMY_BASE):
     """
 
     __tablename__ = 'USER_ACCESS_TOKEN'
+    __table_args__ = (
+        Index('ux_user_access_token_access_token', 'access_token', unique=True),
+        Index('ix_user_access_token_user_id', 'user_id'),
+        Index('ix_user_access_token_expires_on', 'expires_on'),
+    )
 
     id           = Column(Integer, primary_key=True)
     user_id      = Column(Integer, ForeignKey('USER.id'))
@@ -59,11 +106,35 @@ class UserAccessToken(JsonMixin, SQL_ALCHEMY_BASE):
 
 # -------------------------------------------------------------------------------------------------
 
+@event.listens_for(UserAccessToken, 'after_delete')
+def _mark_token_stale(mapper, connection, token): # pylint: disable=W0613
+    """ Records that an access token was deleted by the current transaction, so its cache entry is
+    evicted once the transaction commits. This covers tokens deleted by cascade, i.e. by
+    delete_user. """
+
+    object_session(token).info.setdefault(_STALE_TOKENS, set()).add(token.access_token)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_stale_tokens(session):
+    """ Evicts the cache entries of the access tokens deleted by a committed transaction. """
+
+    _TOKEN_CACHE.delete_many(session.info.pop(_STALE_TOKENS, ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_stale_tokens(session):
+    """ Forgets the access tokens deleted by a rolled-back transaction. """
+
+    session.info.pop(_STALE_TOKENS, None)
+
+# -------------------------------------------------------------------------------------------------
+
 def _get_attributes():
-    """ Returns a list of strings representing the UserAccessToken attributes which are to be
+    """ Returns a tuple of strings representing the UserAccessToken attributes which are to be
     serialized to JSON or an OrderedDict. """
 
-    return ['id', 'user_id', 'access_token', 'expires_on']
+    return ('id', 'user_id', 'access_token', 'expires_on')
 
 # -------------------------------------------------------------------------------------------------
 
@@ -94,47 +165,213 @@ def create_access_token(username, api_key):
         message = 'The API key provided for user "{}" is invalid.'.format(username)
         raise InvalidApiKeyError(message)
 
-    # generate new guid for access token, and set the expiration date 1 hour from right now
-    token      = str(guid()).upper().replace('-', '')
-    expires_on = arrow.now().replace(hours=1)
+    # the token expires 1 hour from right now
+    expires_on = arrow.now().replace(hours=ACCESS_TOKEN_LIFETIME_HOURS)
+
+    if _TOKEN_MODE == 'signed':
+        # not added to the session: a signed token is never stored
+        token = create_signed_token(user.id, user.username, int(expires_on.float_timestamp))
+        return UserAccessToken(user_id=user.id, access_token=token, expires_on=expires_on)
+
+    # generate new guid for access token
+    token = str(guid()).upper().replace('-', '')
 
     user_access_token = UserAccessToken(user=user, access_token=token, expires_on=expires_on)
     db.add(user_access_token)
     db.commit()
 
+    expires_at = expires_on.float_timestamp
+    _TOKEN_CACHE.set(token, (TokenUser(user.id, user.username), expires_at), expires_at=expires_at)
+
     return user_access_token
 
 
-def _delete_expired_tokens():
-    """ Delete any UserAccessTokens from the database which are expired (older than one hour). """
+def create_signed_token(user_id, username, expires_at):
+    """ Returns a signed access token for a user, of the form
 
-    all_tokens = db.query(UserAccessToken).all()
-    expired_tokens = [t for t in all_tokens if arrow.get(t.expires_on) <= arrow.now()]
+        {user_id}.{expires_at}.{username}.{signature}
 
-    for expired_token in expired_tokens:
-        db.delete(expired_token)
+    where the signature is an HMAC-SHA256 of the rest of the token under TOKEN_SECRET. Usernames
+    can't contain dots, so the token splits unambiguously.
+
+    Args:
+        user_id (int): The user's unique ID.
+        username (string): The user's username.
+        expires_at (int): When the token expires, as a Unix timestamp.
+
+    Returns:
+        string: The token.
+
+    """
+
+    payload = '{}.{}.{}'.format(user_id, expires_at, username)
+    return '{}.{}'.format(payload, _sign(payload))
+
+
+def get_user_for_signed_token(access_token):
+    """ Returns the TokenUser for a signed access token, if its signature is valid, it hasn't
+    expired, and it hasn't been revoked (see TokenRevocation), otherwise `None`. Doesn't touch the
+    database. """
+
+    try:
+        user_id, expires_at, username, signature = access_token.split('.')
+        user_id, expires_at = int(user_id), int(expires_at)
+
+    except ValueError:
+        return None
+
+    payload = '{}.{}.{}'.format(user_id, expires_at, username)
+    if not hmac.compare_digest(signature.encode('utf-8'), _sign(payload).encode('ascii')):
+        return None
+
+    if expires_at <= time():
+        return None
+
+    if is_revoked(user_id, expires_at - ACCESS_TOKEN_LIFETIME_HOURS * 3600):
+        return None
+
+    return TokenUser(user_id, username)
 
-    db.commit()
+
+def _sign(payload):
+    """ Returns the signature of a signed token's payload. """
+
+    digest = hmac.new(TOKEN_SECRET, payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def set_token_mode(mode):
+    """ Sets how access tokens are issued from now on, one of TOKEN_MODES. """
+
+    if mode not in TOKEN_MODES:
+        raise ValueError('The token mode must be one of {}.'.format(', '.join(TOKEN_MODES)))
+
+    global _TOKEN_MODE # pylint: disable=W0603
+    _TOKEN_MODE = mode
+
+
+def get_token_mode():
+    """ Returns how access tokens are issued, one of TOKEN_MODES. """
+    return _TOKEN_MODE
+
+
+def delete_expired_tokens(batch_size=1000):
+    """ Delete any UserAccessTokens from the database which have expired. Tokens are removed with
+    set-based DELETE statements of at most `batch_size` rows each, committing between batches so a
+    large backlog of expired tokens doesn't hold locks on the table for long.
+
+    Args:
+        batch_size (int): The maximum number of tokens to delete per statement.
+
+    Returns:
+        int: The number of tokens which were deleted.
+
+    """
+
+    now = arrow.utcnow()
+    deleted = 0
+
+    while True:
+        expired_ids = db.query(UserAccessToken.id)\
+                        .filter(UserAccessToken.expires_on <= now)\
+                        .limit(batch_size)\
+                        .all()
+        expired_ids = [row.id for row in expired_ids]
+
+        if not expired_ids:
+            break
+
+        db.query(UserAccessToken)\
+          .filter(UserAccessToken.id.in_(expired_ids))\
+          .delete(synchronize_session=False)
+        db.commit()
+
+        deleted += len(expired_ids)
+
+        if len(expired_ids) < batch_size:
+            break
+
+    return deleted
 
 
 def get_user_for_token(access_token):
     """ Returns the user for this access token string. Only returns a user if the token exists in
-    the database, and the token has not expired.
+    the database, and the token has not expired. In 'signed' token mode, signed tokens are accepted
+    too, and validated without the database (see get_user_for_signed_token).
+
+    Tokens are looked up in a process-local cache first, along with their user's ID and username,
+    so validating a recently-seen token doesn't touch the database at all (see
+    get_cached_user_for_token). Expired tokens are never returned, but purging them from the
+    database is left to `delete_expired_tokens`, rather than done on every lookup.
 
     Args:
         access_token (string): The access token string to look up.
 
     Returns:
-        cloudCache.Business.Models.User: The user for this token. `None` if the token is expired,
+        TokenUser: The ID and username of the user for this token. `None` if the token is expired,
             or doesn't exist.
 
     """
 
-    _delete_expired_tokens()
+    if _TOKEN_MODE == 'signed' and '.' in access_token:
+        return get_user_for_signed_token(access_token)
+
+    cached = _TOKEN_CACHE.get(access_token)
+
+    if cached is None:
+        # the inner join leaves out tokens whose user has been deleted out from under them
+        row = db.query(UserAccessToken.user_id, User.username, UserAccessToken.expires_on)\
+                .join(User, User.id == UserAccessToken.user_id)\
+                .filter(UserAccessToken.access_token == access_token)\
+                .filter(UserAccessToken.expires_on > arrow.utcnow())\
+                .first()
+
+        if not row:
+            return None
+
+        expires_at = arrow.get(row.expires_on).float_timestamp
+        cached     = (TokenUser(row.user_id, row.username), expires_at)
+        _TOKEN_CACHE.set(access_token, cached, expires_at=expires_at)
+
+    return _get_unrevoked_user(access_token, cached)
+
+
+def get_cached_user_for_token(access_token):
+    """ Returns the user for an access token as get_user_for_token does, if that can be done without
+    the database, i.e. the token is signed, or in the process-local cache. Otherwise returns `None`,
+    and the token has to be looked up with get_user_for_token. Safe to call on the IOLoop.
 
-    token = db.query(UserAccessToken).filter_by(access_token=access_token).first()
+    A user's tokens are evicted from the cache when the user is deleted by this process, and
+    ignored once this process learns of the user's deletion by another one (see
+    TokenRevocation.load_revocations). """
 
-    if not token:
+    if _TOKEN_MODE == 'signed' and '.' in access_token:
+        return get_user_for_signed_token(access_token)
+
+    cached = _TOKEN_CACHE.get(access_token)
+    return None if cached is None else _get_unrevoked_user(access_token, cached)
+
+
+def _get_unrevoked_user(access_token, cached):
+    """ Returns the user of a cached token, or `None` (evicting the token) if the user's tokens have
+    been revoked since it was issued, i.e. the user was deleted by another process. """
+
+    user, expires_at = cached
+
+    if is_revoked(user.id, expires_at - ACCESS_TOKEN_LIFETIME_HOURS * 3600):
+        _TOKEN_CACHE.pop(access_token)
         return None
 
-    return token.user
+    return user
+
+
+def sweep_token_cache():
+    """ Evicts expired entries from the process-local access token cache, and returns the number of
+    entries which were removed. """
+
+    return _TOKEN_CACHE.sweep()
+
+
+def get_token_cache():
+    """ Returns the access token cache backend, e.g. for reporting its statistics. """
+    return _TOKEN_CACHE
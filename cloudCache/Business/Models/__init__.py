@@ -1,23 +1,214 @@
 """ Init for cloudCache SQLAlchemy models """
 
+# pylint: disable=W0612
+# disable unused-variable warning on the event listener, it's registered by its decorator
+
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy import create_engine, event, exc, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from ..Config import get_setting
+
+DEFAULT_CONN_STRING = 'mysql+pymysql://{user}:{password}@{host}:{port}/cloudCache'
+DEFAULT_CONN_STRING = DEFAULT_CONN_STRING.format(user='root',
+                                                 password='password',
+                                                 host='localhost',
+                                                 port='3306')
+
+# Any SQLAlchemy database URL, e.g. sqlite:////var/lib/cloudCache/cloudCache.db, or sqlite:// for a
+# throwaway in-memory database (see cloudCache.Business.Config for how settings are read)
+CONN_STRING = get_setting('db', 'url', DEFAULT_CONN_STRING)
+
+# Connection pool settings
+POOL_SIZE     = get_setting('db', 'pool_size', 10, int)
+POOL_OVERFLOW = get_setting('db', 'pool_overflow', 10, int)
+POOL_TIMEOUT  = get_setting('db', 'pool_timeout', 30, int)    # seconds
+POOL_RECYCLE  = get_setting('db', 'pool_recycle', 3600, int)  # seconds
+POOL_PRE_PING = get_setting('db', 'pool_pre_ping', True, bool)
+
+# Whether importing this package creates any missing tables and indexes (see create_schema)
+CREATE_SCHEMA = get_setting('db', 'create_schema', True, bool)
+
+# SQLite connection settings
+SQLITE_BUSY_TIMEOUT = get_setting('sqlite', 'busy_timeout', 5000, int)             # milliseconds
+SQLITE_CACHE_SIZE   = get_setting('sqlite', 'cache_size', 64 * 1024, int)          # KiB
+SQLITE_MMAP_SIZE    = get_setting('sqlite', 'mmap_size', 256 * 1024 * 1024, int)   # bytes
+SQLITE_SYNCHRONOUS  = get_setting('sqlite', 'synchronous', 'NORMAL')
+
+# -------------------------------------------------------------------------------------------------
+
+def is_sqlite(conn_string):
+    """ Returns whether a database URL is for SQLite. """
+    return make_url(conn_string).drivername.startswith('sqlite')
+
+
+def is_in_memory(conn_string):
+    """ Returns whether a database URL is for an in-memory SQLite database. """
+    return is_sqlite(conn_string) and make_url(conn_string).database in (None, '', ':memory:')
+
+
+if is_in_memory(CONN_STRING):
+    # every session shares the database's single connection, which one thread may use at a time
+    POOL_SIZE, POOL_OVERFLOW = 1, 0
+
+# -------------------------------------------------------------------------------------------------
+
+def build_engine(conn_string=CONN_STRING):
+    """ Creates a SQLAlchemy engine backed by a QueuePool configured from the POOL_* settings. If
+    POOL_PRE_PING is set, connections are tested as they are checked out of the pool, and stale
+    ones (e.g. dropped by the MySQL server's wait_timeout) are transparently replaced. SQLite
+    databases get an engine of their own, see _build_sqlite_engine. """
+
+    if is_sqlite(conn_string):
+        return _build_sqlite_engine(conn_string)
+
+    engine = create_engine(conn_string,
+                           poolclass=QueuePool,
+                           pool_size=POOL_SIZE,
+                           max_overflow=POOL_OVERFLOW,
+                           pool_timeout=POOL_TIMEOUT,
+                           pool_recycle=POOL_RECYCLE)
+
+    if POOL_PRE_PING:
+        @event.listens_for(engine, 'engine_connect')
+        def ping_connection(connection, branch):
+            """ Issues a trivial SELECT on a newly-checked-out connection. If the connection has
+            gone away, SQLAlchemy invalidates the pool's connections, and the SELECT is retried on
+            a fresh one. """
+
+            if branch:
+                # a branch shares its parent's connection, which has already been pinged
+                return
+
+            should_close_with_result = connection.should_close_with_result
+            connection.should_close_with_result = False
+
+            try:
+                connection.scalar(select([1]))
+
+            except exc.DBAPIError as error:
+                if not error.connection_invalidated:
+                    raise
+                connection.scalar(select([1]))
+
+            finally:
+                connection.should_close_with_result = should_close_with_result
+
+    return engine
+
+
+def _build_sqlite_engine(conn_string):
+    """ Creates a SQLAlchemy engine for a SQLite database. A database file gets a QueuePool like any
+    other database, with its connections in WAL mode, so that readers and the (single) writer don't
+    block each other. An in-memory database only exists as long as its one connection, so that
+    connection is shared by every session through a StaticPool. Connections are local, so they're
+    never pinged.
+
+    Every connection is tuned by the SQLITE_* settings: writers wait up to SQLITE_BUSY_TIMEOUT for
+    the database lock, rather than failing straight away, and with the default synchronous=NORMAL,
+    WAL mode only syncs to disk at checkpoints (a power cut can lose the last few commits, but never
+    corrupts the database). """
+
+    in_memory    = is_in_memory(conn_string)
+    connect_args = {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT / 1000.0}
+
+    if in_memory:
+        engine = create_engine(conn_string, poolclass=StaticPool, connect_args=connect_args)
+
+    else:
+        engine = create_engine(conn_string,
+                               poolclass=QueuePool,
+                               pool_size=POOL_SIZE,
+                               max_overflow=POOL_OVERFLOW,
+                               pool_timeout=POOL_TIMEOUT,
+                               connect_args=connect_args)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record): # pylint: disable=W0613
+        """ Applies the SQLite settings to a new connection. """
+
+        cursor = dbapi_connection.cursor()
+
+        if not in_memory:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+        cursor.execute('PRAGMA synchronous={}'.format(SQLITE_SYNCHRONOUS))
+        cursor.execute('PRAGMA cache_size=-{}'.format(SQLITE_CACHE_SIZE))
+        cursor.execute('PRAGMA mmap_size={}'.format(SQLITE_MMAP_SIZE))
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+
+    return engine
+
+
+def reset_engine():
+    """ Replaces DB_ENGINE with a newly built engine, and binds DB_SESSION to it. Pooled connections
+    must never be shared between processes, so every worker process forked by the server calls this
+    after the fork (the parent disposes of its own pool before forking). Code which needs the engine
+    after startup should read it from this module, rather than importing DB_ENGINE by name. """
+
+    global DB_ENGINE # pylint: disable=W0603
+
+    DB_ENGINE = build_engine()
+
+    DB_SESSION.remove()
+    DB_SESSION.configure(bind=DB_ENGINE)
+
+    return DB_ENGINE
+
+
+def get_pool_stats():
+    """ Returns a dict describing the current usage of the database connection pool. Only a
+    QueuePool keeps these statistics, so for other pools only the pool's class is reported. """
+
+    pool  = DB_ENGINE.pool
+    stats = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats['size']        = pool.size()
+        stats['checked_in']  = pool.checkedin()
+        stats['checked_out'] = pool.checkedout()
+        stats['overflow']    = pool.overflow()
+
+    return stats
+
+
+def create_schema(engine=None):
+    """ Creates any tables and indexes missing from the database, and brings existing tables up to
+    date with the models (see Migrations). Runs when this package is imported, unless the
+    CREATE_SCHEMA setting is turned off, e.g. for a database whose schema is managed separately.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine for the database. Defaults to DB_ENGINE.
+
+    """
+
+    engine = engine or DB_ENGINE
+
+    SQL_ALCHEMY_BASE.metadata.create_all(engine)
+    upgrade(engine)
+
+# -------------------------------------------------------------------------------------------------
+
+DB_ENGINE = build_engine()
 
-CONN_STRING = 'mysql+pymysql://{user}:{password}@{host}:{port}/cloudCache'
-CONN_STRING = CONN_STRING.format(user='root',
-                                 password='password',
-                                 host='localhost',
-                                 port='3306')
+# Sessions are scoped to the current thread. Request handlers remove theirs when the request
+# finishes, so every request starts with a fresh session and an empty identity map.
+DB_SESSION = scoped_session(sessionmaker(bind=DB_ENGINE))
 
-DB_ENGINE = create_engine(CONN_STRING)
-DB_SESSION = Session(bind=DB_ENGINE)
 SQL_ALCHEMY_BASE = declarative_base()
 
 from .JsonMixin import JsonMixin
 from .User import User
 from .Notebook import Notebook
 from .Note import Note
+from .NoteValue import NoteValueChunk
+from .NoteTombstone import NoteTombstone
+from .TokenRevocation import TokenRevocation
 from .UserAccessToken import UserAccessToken
+from .Migrations import upgrade
 
-SQL_ALCHEMY_BASE.metadata.create_all(DB_ENGINE)
+if CREATE_SCHEMA:
+    create_schema()
@@ -1,42 +1,289 @@
 """ The cloudCache REST API. Intended for use in cloudCache CLI and Android apps. """
 
+import os
+import random
+import signal
+import socket
+import sys
+from time import time
+
 import tornado.web
 import tornado.ioloop
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
+from tornado.log import app_log
+from tornado.options import define, options
 
 from API.Handlers import UserHandler, AccessHandler, NotebookHandler, NotesHandler, NoteHandler
+from API.Handlers import AuthorizeHandler, BulkNotesHandler, SyncHandler, MetricsHandler
+from API.Handlers import SearchHandler, NoteKeyHandler, NoteValueHandler
+from API.Tasks import TokenReaper, RevocationPoller
+from API.Compression import CompressResponse
+
+from cloudCache.API.Metrics import METRICS_ENABLED
+from cloudCache.Business import Models
+from cloudCache.Business.Cache import NullCache
+from cloudCache.Business.Models.Note import set_note_cache
+from cloudCache.Business.Models.UserAccessToken import get_token_mode
 
 # -------------------------------------------------------------------------------------------------
 
 SERVER_PORT = 8888
 
+TOKEN_REAPER_INTERVAL = 300 # seconds
+
+REVOCATION_POLL_INTERVAL = 5 # seconds
+
+define('port', default=SERVER_PORT, type=int, help='Port to listen on.')
+define('workers', default=1, type=int,
+       help='Number of worker processes to fork. 0 forks one per CPU core.')
+define('shutdown_timeout', default=10, type=float,
+       help='Seconds to wait for in-flight requests to finish when shutting down.')
+
 USERNAME_OPT = r'?(?P<username>[a-zA-Z0-9_-]+)?'
 USERNAME_REQ = r'(?P<username>[a-zA-Z0-9_-]+)'
 NOTEBOOK_OPT = r'?(?P<notebook>\d+)?'
 NOTEBOOK_REQ = r'(?P<notebook>\d+)'
+NOTE_OPT     = r'?(?P<note>[a-zA-Z0-9_-]+)?'
 NOTE_REQ     = r'(?P<note>[a-zA-Z0-9_-]+)'
+KEY_REQ      = r'(?P<key>[^/]+)'
 API_KEY_REQ  = r'(?P<api_key>[A-Z0-9]+)'
 
 USER_HANDLER_URL     = '/users/{}'.format(USERNAME_OPT)
 ACCESS_HANDLER_URL   = '/access/{}/{}'.format(USERNAME_REQ, API_KEY_REQ)
 NOTEBOOK_HANDLER_URL = '/notebooks/{}'.format(NOTEBOOK_OPT)
 NOTES_HANDLER_URL    = '/notebooks/{}/notes'.format(NOTEBOOK_REQ)
-NOTE_HANDLER_URL     = '/notes/{}'.format(NOTE_REQ)
+BULK_NOTES_URL       = '/notebooks/{}/notes/bulk'.format(NOTEBOOK_REQ)
+NOTE_KEY_URL         = '/notebooks/{}/keys/{}'.format(NOTEBOOK_REQ, KEY_REQ)
+NOTE_HANDLER_URL     = '/notes/{}'.format(NOTE_OPT)
+NOTE_VALUE_URL       = '/notes/{}/value'.format(NOTE_REQ)
+SYNC_HANDLER_URL     = '/sync'
+SEARCH_HANDLER_URL   = '/search'
+METRICS_URL          = '/metrics'
+
+# The PIDs of the running worker processes, in the parent process in multi-process mode
+_WORKER_PIDS = set()
+
+# Whether the parent process has passed a shutdown signal on to its workers, after which workers
+# which exit aren't restarted
+_stopping = False
 
 # -------------------------------------------------------------------------------------------------
 
-def main():
-    """ Runs the server. """
+def make_application():
+    """ Returns the cloudCache tornado.web.Application. """
 
     routes = [(NOTE_HANDLER_URL, NoteHandler),
+              (NOTE_VALUE_URL, NoteValueHandler),
               (NOTES_HANDLER_URL, NotesHandler),
+              (BULK_NOTES_URL, BulkNotesHandler),
+              (NOTE_KEY_URL, NoteKeyHandler),
               (NOTEBOOK_HANDLER_URL, NotebookHandler),
               (USER_HANDLER_URL, UserHandler),
-              (ACCESS_HANDLER_URL, AccessHandler)]
+              (ACCESS_HANDLER_URL, AccessHandler),
+              (SYNC_HANDLER_URL, SyncHandler),
+              (SEARCH_HANDLER_URL, SearchHandler)]
+
+    if METRICS_ENABLED:
+        routes.append((METRICS_URL, MetricsHandler))
+
+    # gzip responses for clients which accept it (the equivalent of `compress_response`, with a size
+    # threshold, see CompressResponse)
+    return tornado.web.Application(routes, transforms=[CompressResponse])
+
+
+def _bind_reuse_port(port):
+    """ Returns a listening, non-blocking socket bound to `port` with SO_REUSEPORT set, so that every
+    worker process can bind its own socket to the same port. (The pinned tornado's bind_sockets has
+    no reuse_port option.) """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setblocking(False)
+    sock.bind(('', port))
+    sock.listen(128)
+
+    return sock
+
+
+def _forward_signal(signum, _):
+    """ Signal handler for the parent process in multi-process mode. Passes the signal on to the
+    worker processes (and only those, not the rest of the parent's process group, which may belong
+    to a supervisor or shell), which then shut down gracefully. """
+
+    global _stopping # pylint: disable=W0603
+    _stopping = True
+
+    signal.signal(signum, signal.SIG_IGN)
+
+    for pid in list(_WORKER_PIDS):
+        try:
+            os.kill(pid, signum)
+
+        except ProcessLookupError:
+            # exited, and not yet reaped by _fork_workers
+            pass
+
+
+def _fork_workers(count, max_restarts=100):
+    """ Forks `count` worker processes (one per CPU core if `count` is 0), recording their PIDs in
+    _WORKER_PIDS, as tornado.process.fork_processes does otherwise. In each worker, returns its task
+    ID, from 0 to `count` - 1. The parent process restarts workers which exit abnormally (up to
+    `max_restarts` times), unless it's shutting down, and exits once every worker has exited. """
+
+    count    = count if count > 0 else tornado.process.cpu_count()
+    children = dict() # PID -> task ID
+
+    def start_worker(task_id):
+        """ Forks a worker, and returns its task ID in the worker, or `None` in the parent. """
+
+        pid = os.fork()
+
+        if pid == 0:
+            # a worker shuts itself down on these signals once its IOLoop is running (see main)
+            _WORKER_PIDS.clear()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+            # don't share the parent's random sequence with every other worker
+            random.seed()
+            return task_id
+
+        children[pid] = task_id
+        _WORKER_PIDS.add(pid)
+        return None
+
+    app_log.info('Starting %d worker processes.', count)
+
+    for task_id in range(count):
+        if start_worker(task_id) is not None:
+            return task_id
+
+    restarts = 0
+
+    while children:
+        try:
+            pid, status = os.wait()
+
+        except InterruptedError:
+            continue
+
+        _WORKER_PIDS.discard(pid)
+        task_id = children.pop(pid, None)
+
+        if task_id is None:
+            continue
+
+        if os.WIFSIGNALED(status):
+            app_log.warning('Worker %d (pid %d) was killed by signal %d.', task_id, pid,
+                            os.WTERMSIG(status))
+        elif os.WEXITSTATUS(status) != 0:
+            app_log.warning('Worker %d (pid %d) exited with status %d.', task_id, pid,
+                            os.WEXITSTATUS(status))
+        else:
+            continue
+
+        if _stopping:
+            continue
+
+        restarts += 1
+        if restarts > max_restarts:
+            raise RuntimeError('Too many worker restarts, giving up.')
+
+        if start_worker(task_id) is not None:
+            return task_id
+
+    # every worker has exited, so this (the parent) must not go on to run a server of its own
+    sys.exit(0)
+
+
+def _shut_down(server, tasks):
+    """ Stops accepting new connections and running background `tasks`, and stops the IOLoop once
+    the requests in flight have finished, or the shutdown timeout has passed. """
+
+    io_loop  = tornado.ioloop.IOLoop.current()
+    deadline = time() + options.shutdown_timeout
+
+    app_log.info('Shutting down, waiting for %d requests.', AuthorizeHandler.in_flight)
+
+    server.stop()
+    for task in tasks:
+        task.stop()
+
+    def stop_when_idle():
+        """ Stops the IOLoop if there's nothing left to wait for, otherwise checks again soon. """
+
+        if AuthorizeHandler.in_flight > 0 and time() < deadline:
+            io_loop.call_later(0.1, stop_when_idle)
+        else:
+            io_loop.stop()
+
+    stop_when_idle()
+
+
+def main():
+    """ Runs the server. With --workers other than 1, the server pre-forks that many worker
+    processes, each running its own IOLoop and listening on its own SO_REUSEPORT socket, so the
+    kernel balances connections across them. """
+
+    options.parse_command_line()
+
+    task_id = None
+
+    if options.workers != 1:
+        # connections pooled before the fork would otherwise be shared by every worker
+        Models.DB_ENGINE.dispose()
+
+        signal.signal(signal.SIGTERM, _forward_signal)
+        signal.signal(signal.SIGINT, _forward_signal)
+
+        task_id = _fork_workers(options.workers)
+
+        # from here on, this is a worker process
+        Models.reset_engine()
+
+        # a process-local note cache can't see notes changed by the other workers, so it's turned
+        # off unless a cache shared between the workers is plugged in with set_note_cache
+        set_note_cache(NullCache())
+
+    if task_id is None:
+        sockets = tornado.netutil.bind_sockets(options.port)
+    else:
+        sockets = [_bind_reuse_port(options.port)]
+
+    server = tornado.httpserver.HTTPServer(make_application())
+    server.add_sockets(sockets)
+
+    tasks = list()
+
+    # expired tokens only need reaping by one process
+    if task_id in (None, 0):
+        tasks.append(TokenReaper(interval=TOKEN_REAPER_INTERVAL))
+
+    # but every process checks signed tokens against its own copy of the revocations
+    if get_token_mode() == 'signed':
+        tasks.append(RevocationPoller(interval=REVOCATION_POLL_INTERVAL))
+
+    for task in tasks:
+        task.start()
+
+    io_loop = tornado.ioloop.IOLoop.current()
+
+    def on_signal(signum, _):
+        """ Starts a graceful shutdown on the IOLoop. Further signals are ignored, as a worker can
+        receive the same signal both from the terminal and forwarded by its parent. """
+
+        signal.signal(signum, signal.SIG_IGN)
+        io_loop.add_callback_from_signal(_shut_down, server, tasks)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
 
-    application = tornado.web.Application(routes)
-    application.listen(SERVER_PORT)
+    io_loop.start()
 
-    tornado.ioloop.IOLoop.instance().start()
+    Models.DB_ENGINE.dispose()
 
 
 if __name__ == '__main__':
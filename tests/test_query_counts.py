@@ -0,0 +1,213 @@
+""" Pins the number of SQL statements issued by the routes whose queries are eager-loaded or check
+ownership in SQL, so a change which brings back a lazy load (and with it a query per notebook or
+note) fails here rather than in production. Each route is requested for a user with a little data
+and a user with a lot, and must issue exactly the pinned number of statements for both.
+
+Runs the server.py application in-process against a temporary SQLite database. From the repository
+root:
+
+    python -m unittest discover tests
+
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the models read the database URL when they're first imported
+_WORKDIR = tempfile.mkdtemp(prefix='cloudcache-test-')
+os.environ['CLOUDCACHE_DB_URL'] = 'sqlite:///' + os.path.join(_WORKDIR, 'test.db')
+
+# server.py imports the handlers as a top-level `API` package
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'cloudCache')]
+
+from sqlalchemy import event
+from tornado.testing import AsyncHTTPTestCase
+
+import server
+from cloudCache.Business.Models import DB_ENGINE, DB_SESSION as db, Note
+from cloudCache.Business.Models.Note import get_note_cache
+from cloudCache.Business.Models.Notebook import create_notebook
+from cloudCache.Business.Models.User import create_user
+
+# -------------------------------------------------------------------------------------------------
+
+PASSWORD = 'test-password'
+
+# Username -> (notebooks, notes per notebook)
+USERS = {'small': (1, 1), 'large': (20, 50)}
+
+# Route -> the number of statements it issues, whatever the size of the user's data. The access
+# token is cached along with its user's ID and username after the first request, so authorization
+# doesn't add to these.
+PINNED = {
+    'GET /users/{username}': 4,
+    'GET /notebooks/': 1,
+    'GET /notebooks/{notebook}/notes': 4,
+    'GET /notes/{note}': 1,
+    'DELETE /notes/{note}': 3,
+    'DELETE /notes/{note} of another user': 1,
+}
+
+# Username -> API key, filled in by setUpModule
+_API_KEYS = dict()
+
+# -------------------------------------------------------------------------------------------------
+
+def setUpModule():
+    """ Seeds each user in USERS with their notebooks and notes. """
+
+    for username, (notebooks, notes) in USERS.items():
+        user = create_user(username, 'Test', 'User', username + '@example.com', PASSWORD)
+        _API_KEYS[username] = user.api_key
+
+        for notebook_number in range(notebooks):
+            notebook = create_notebook('notebook{}'.format(notebook_number), user)
+            db.execute(Note.__table__.insert(),
+                       [{'notebook_id': notebook.id, 'key': 'note{}'.format(n), 'value': 'value'}
+                        for n in range(notes)])
+
+        db.commit()
+
+    db.remove()
+
+
+def tearDownModule():
+    """ Deletes the temporary database. """
+
+    DB_ENGINE.dispose()
+    shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+# -------------------------------------------------------------------------------------------------
+
+class QueryCountTest(AsyncHTTPTestCase):
+    """ Counts the statements each route issues through the models' engine. Requests are made one
+    at a time, so every statement counted belongs to the request being made. """
+
+    def get_app(self):
+        return server.make_application()
+
+
+    def setUp(self):
+        super().setUp()
+
+        self.statements = 0
+        event.listen(DB_ENGINE, 'before_cursor_execute', self._count_statement)
+
+        self.tokens, self.notebook_ids, self.note_ids = dict(), dict(), dict()
+
+        for username in USERS:
+            self.tokens[username] = self._get_token(username, _API_KEYS[username])
+
+            notebooks = self.request('GET', '/notebooks/', username=username)['notebooks']
+            self.notebook_ids[username] = notebooks[-1]['id']
+
+            notes = self.request('GET', '/notebooks/{}/notes'.format(notebooks[-1]['id']),
+                                 username=username)['notes']
+            self.note_ids[username] = notes[-1]['id']
+
+
+    def tearDown(self):
+        event.remove(DB_ENGINE, 'before_cursor_execute', self._count_statement)
+        super().tearDown()
+
+
+    def _count_statement(self, *_):
+        """ Engine event listener, called before every statement. """
+        self.statements += 1
+
+
+    def _get_token(self, username, api_key):
+        """ Returns a new access token for a user. """
+
+        response = self.request('GET', '/access/{}/{}'.format(username, api_key))
+        return response['access token']['access_token']
+
+
+    def request(self, method, path, username=None, password=False, status=200):
+        """ Makes a request, as `username` if given, with the user's password in the body if
+        `password`, checks its status, and returns its decoded JSON body. """
+
+        headers = {'access token': self.tokens[username]} if username else {}
+        body    = json.dumps({'password': PASSWORD}) if password else None
+
+        response = self.fetch(path, method=method, headers=headers, body=body,
+                              allow_nonstandard_methods=True)
+
+        self.assertEqual(response.code, status, response.body)
+        return json.loads(response.body.decode('utf-8'))
+
+
+    def count_statements(self, method, path, username=None, password=False, status=200):
+        """ Returns the number of statements a request issues. """
+
+        # the note cache would otherwise answer repeated reads without any statements
+        get_note_cache().clear()
+
+        before = self.statements
+        self.request(method, path, username=username, password=password, status=status)
+
+        return self.statements - before
+
+
+    def assertPinned(self, route, method, path_for, password=False, status=200):
+        """ Asserts that a route issues PINNED[route] statements for every user in USERS.
+        `path_for` returns the path to request for a username. """
+
+        for username in USERS:
+            statements = self.count_statements(method, path_for(username), username=username,
+                                               password=password, status=status)
+
+            self.assertEqual(statements, PINNED[route],
+                             '{} for {!r} issued {} statements, not {}'.format(
+                                 route, username, statements, PINNED[route]))
+
+
+    def test_get_user(self):
+        self.assertPinned('GET /users/{username}', 'GET', '/users/{}'.format, password=True)
+
+
+    def test_get_notebooks(self):
+        self.assertPinned('GET /notebooks/', 'GET', lambda username: '/notebooks/')
+
+
+    def test_get_notebook_notes(self):
+        self.assertPinned('GET /notebooks/{notebook}/notes', 'GET',
+                          lambda username: '/notebooks/{}/notes'.format(
+                              self.notebook_ids[username]))
+
+
+    def test_get_note(self):
+        self.assertPinned('GET /notes/{note}', 'GET',
+                          lambda username: '/notes/{}'.format(self.note_ids[username]))
+
+
+    def test_delete_note(self):
+        def create_note(username):
+            """ Creates a note to delete, leaving the seeded notes for the other tests. """
+
+            response = self.fetch('/notebooks/{}/notes'.format(self.notebook_ids[username]),
+                                  method='POST', headers={'access token': self.tokens[username]},
+                                  body=json.dumps({'note_key': 'deleted', 'note_value': 'value'}))
+
+            note_id = json.loads(response.body.decode('utf-8'))['note_id']
+            return '/notes/{}'.format(note_id)
+
+        self.assertPinned('DELETE /notes/{note}', 'DELETE', create_note)
+
+
+    def test_delete_note_of_another_user(self):
+        other = {'small': 'large', 'large': 'small'}
+
+        self.assertPinned('DELETE /notes/{note} of another user', 'DELETE',
+                          lambda username: '/notes/{}'.format(self.note_ids[other[username]]),
+                          status=404)
+
+
+if __name__ == '__main__':
+    unittest.main()